@@ -41,6 +41,82 @@ defaultconfig['couchdb.uuids.algorithm']   = {
     'help'    : "CouchDB server configuration. Algorithm to generate "
                 "universally unique identifiers for documents."
 }
+defaultconfig['client.concurrency'] = {
+    'default' : 8,
+    'types'   : (int,),
+    'help'    : "Maximum number of concurrent requests made by the client, "
+                "when an API fans out requests across several databases or "
+                "documents."
+}
+defaultconfig['client.coalesce']   = {
+    'default' : False,
+    'types'   : (bool,),
+    'help'    : "Concurrent identical GET requests, from several threads, "
+                "share a single request to the server."
+}
+defaultconfig['client.threadlocal'] = {
+    'default' : False,
+    'types'   : (bool,),
+    'help'    : "Every thread gets its own Database and Document objects, "
+                "instead of sharing them with other threads. Connections "
+                "to the server are still shared."
+}
+defaultconfig['client.timeout']    = {
+    'default' : None,
+    'types'   : (float,),
+    'help'    : "Socket timeout in seconds while waiting for the server to "
+                "respond, None for no timeout. Note that long-polling "
+                "changes feeds wait for the server as well."
+}
+defaultconfig['client.connect_timeout'] = {
+    'default' : None,
+    'types'   : (float,),
+    'help'    : "Socket timeout in seconds while connecting to the server. "
+                "If None, ``client.timeout`` is used."
+}
+defaultconfig['client.deadline']   = {
+    'default' : None,
+    'types'   : (float,),
+    'help'    : "Total time in seconds allowed for a request, including "
+                "redirects and retries, None for no deadline. Requests that "
+                "take longer raise DeadlineExceeded."
+}
+defaultconfig['client.spool_threshold'] = {
+    'default' : None,
+    'types'   : (int,),
+    'help'    : "Response bodies larger than this many bytes are spooled to "
+                "a temporary file and memory-mapped, instead of being held "
+                "in memory or streamed from the connection. None to disable."
+}
+defaultconfig['cluster.policy']    = {
+    'default' : 'roundrobin',
+    'types'   : (str,),
+    'help'    : "When the client is given a list of node urls, routing policy "
+                "for requests, ``roundrobin``, ``least`` (outstanding "
+                "requests) or ``ewma`` (of response time)."
+}
+defaultconfig['cluster.pin']       = {
+    'default' : 'writes',
+    'types'   : ('csv',),
+    'help'    : "Comma separated list of pinning rules for cluster routing. "
+                "``writes``, send all writes to the first node that is up. "
+                "``session``, requests with the same cookie or credentials go "
+                "to the same node."
+}
+defaultconfig['cluster.probe_interval'] = {
+    'default' : 5.0,
+    'types'   : (float,),
+    'help'    : "Seconds between probes to check whether a cluster node, "
+                "that is down, is alive again."
+}
+defaultconfig['uuids.source']      = {
+    'default' : 'local',
+    'types'   : (str,),
+    'help'    : "Source of ids for new documents. ``local``, generate them in "
+                "the client using ``couchdb.uuids.algorithm``. ``server``, "
+                "pool uuids fetched from the server in batches. ``none``, let "
+                "the server assign ids."
+}
 defaultconfig['cookie.name']       =  {
     'default' : 'AuthSession',
     'types'   : (str,),
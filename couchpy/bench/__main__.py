@@ -0,0 +1,8 @@
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+import sys
+from   couchpy.bench import main
+
+sys.exit( main() )
@@ -69,6 +69,11 @@ Get a list of 2 univerally unique IDs, the count argument is optional.
 >>> c.uuids( 2 )
 [ u'a0cf4956301a349a0ecc99370e74331e', u'93e4ec906703b7a00abbfd46b46425fb' ]
 
+Or generate them locally, without a server round trip,
+
+>>> c.uuidgen.take( 2 )
+[ '0004b4e4c61e0ce5a53dce1bf18ca0e8', '0004b4e4c61e0d48c4a72c6a2f1e0b17' ]
+
 
 **Operations that require admin privileges :**
 
@@ -80,6 +85,8 @@ Get server log (required admin privileges)
 
 >>> logs = couch.log().splitlines()
 >>> couch.log( offset=100, bytes=10 )
+>>> [ (msg.level, msg.message) for msg in couch.Log() ]    # Parsed messages
+>>> for msg in couch.Log( follow=True ) : print msg         # Tail the log
 
 Server configuration
 
@@ -104,6 +111,12 @@ Server authetication and session,
 >>> couch.authsession() # Authenticated user's session information
 >>> couch.logout()      # Authenticated user will be identified via cookie.
 
+Operations across many databases, fanned out with bounded concurrency,
+
+>>> couch.dbsinfo( regexp='tenant_' )   # { 'ok' : { <dbname> : <info> }, ... }
+>>> couch.compactdbs( regexp='tenant_' )
+>>> couch.scatterview( 'reports', 'bymonth', regexp='tenant_', gather='merge' )
+
 Database operations :
 
 >>> c.put('blog')                       # Create database
@@ -114,6 +127,14 @@ Database operations :
 >>> c.has_database( 'blog' )            # Check whether database is present
 True
 
+A client can be shared by several threads, requests are made over a shared
+connection pool. Database and Document objects are singletons under the
+client, and are shared by all threads as well, unless the client is
+configured with ``client.threadlocal``, in which case every thread gets its
+own set of Database and Document objects,
+
+>>> couch = Client( url, config={ 'client.threadlocal' : True } )
+
 Miscellaneous operation,
 
 >>> couch.version()
@@ -122,15 +143,23 @@ u'1.0.1'
 True
 """
 
-import os, logging
+import os, re, time, logging
 from   Cookie           import SimpleCookie
 
+try:
+    from threading       import Lock, local
+except ImportError:
+    from dummy_threading import Lock, local
+
 import rest
-from   httpc            import HttpSession, OK, ACCEPTED
+from   httpc            import HttpSession, OK, ACCEPTED, bodyvalue
 from   httperror        import *
 from   couchpy          import hdr_acceptjs, hdr_ctypejs, hdr_ctypeform, \
                                hdr_accepttxtplain, hdr_acceptany, \
-                               __version__, defaultconfig
+                               __version__, defaultconfig, CouchPyError
+from   couchpy.utils    import parallel, collatekey, builtin_reduces
+from   couchpy.uuids    import uuidgen
+from   couchpy.cluster  import ClusterSession
 
 # TODO :
 #   1. Deleteing configuration section/key seems to have some complex options.
@@ -235,6 +264,19 @@ def _log( conn, paths=[], hthdrs={}, **query ) :
         log.error( 'POST /_log request failed' )
     return s, h, d
 
+def _dbs_info( conn, keys, paths=[], hthdrs={} ) :
+    """POST /_dbs_info
+    body,
+        { "keys" : [ <dbname>, ... ] }
+    """
+    hthdrs = conn.mixinhdrs( hthdrs, hdr_acceptjs, hdr_ctypejs )
+    body = rest.data2json({ 'keys' : keys })
+    s, h, d = conn.post( paths, hthdrs, body )
+    if s != OK :
+        s = h = d = None
+        log.error( 'POST /_dbs_info request failed' )
+    return s, h, d
+
 def _config( conn, paths=[], hthdrs={}, **kwargs ) :
     """
     GET /_config
@@ -283,13 +325,24 @@ def _session( conn, paths, login=None, logout=None, hthdrs={}, **kwargs ) :
     return s, h, d
 
 
+def _sumrereduce( values ):
+    """Default ``rereduce`` for :func:`Client.scatterview`."""
+    try :
+        return sum( values )
+    except TypeError :
+        raise CouchPyError( 'scatterview cannot sum values like %r, specify '
+                            'rereduce' % (values[0],) )
+
+
 #---- Client class
 
 class Client( object ) :
     """Client interface for CouchDB server.
 
     ``url``,
-        Server http url.
+        Server http url, or a list of urls for several CouchDB nodes, in
+        which case requests are routed across the nodes using
+        :class:`couchpy.cluster.ClusterSession`.
     ``config``,
         Configuration parameters.
     ``hthdrs``,
@@ -301,22 +354,47 @@ class Client( object ) :
     ``cookie``
         cookie value for authenticated sessions. Value can be of type
         ``basestring`` or cookie.SimpleCookie object.
+    ``htsess``
+        HTTP session to use for requests, by default a new
+        :class:`couchpy.httpc.HttpSession` is created. Sessions from
+        :mod:`couchpy.record` can be used to record and replay traffic.
     """
 
-    def __init__( self, url=None, config=None, hthdrs=None, cookie=None ) :
+    def __init__( self, url=None, config=None, hthdrs=None, cookie=None,
+                  htsess=None ) :
         self.hthdrs = hthdrs or {}
         self.cookie = cookie
         self.defconfig = dict( defaultconfig.items() )
         self.defconfig.update( config or {} )
 
-        self.url = url or self.defconfig['realm']
-        self.conn = rest.ReSTful(self.url, HttpSession(), headers=self.hthdrs)
+        config = self.defconfig
+        sessargs = { 'coalesce' : config['client.coalesce'],
+                     'timeout' : config['client.timeout'],
+                     'connect_timeout' : config['client.connect_timeout'],
+                     'spool_threshold' : config['client.spool_threshold'] }
+        if isinstance( url, (list, tuple) ) :
+            htsess = htsess or ClusterSession(
+                url, policy=config['cluster.policy'],
+                pin=filter( None, config['cluster.pin'].split(',') ),
+                probe_interval=config['cluster.probe_interval'], **sessargs )
+            url = url[0]
+        self.url = url or config['realm']
+        htsess = htsess or HttpSession( **sessargs )
+        self.conn = rest.ReSTful( self.url, htsess, headers=self.hthdrs,
+                                  deadline=config['client.deadline'] )
         cookie and self.conn.savecookie( self.hthdrs, cookie )
 
         self.paths = []
         self.available = None       # assume that server is not available
         # Load the saved cookie to preserve the authentication
-        self._authsession, self.opendbs = None, {}
+        self._authsession, self._opendbs = None, {}
+        self._local = local() if config['client.threadlocal'] else None
+        self.dblock = Lock()        # Guards instantiation of databases
+        self._dbs_info_supported = None     # Unknown until first request
+        self._bulk_get_supported = None
+        self.uuidgen = uuidgen( self.defconfig['couchdb.uuids.algorithm'],
+                                source=self.defconfig['uuids.source'],
+                                client=self )
 
 
     #---- Pythonification of instance methods. They are supposed to be
@@ -431,7 +509,7 @@ class Client( object ) :
         s, h, d = _all_dbs( conn, paths, hthdrs=hthdrs )
         return d if d else []
 
-    def log( self, bytes=None, offset=None, hthdrs={} ) :
+    def log( self, bytes=None, offset=None, hthdrs={}, stream=False ) :
         """Get CouchDB log, equivalent to accessing the local log file of
         the corresponding CouchDB instance. When you request the log, the
         response is returned as plain (UTF-8) text, with an HTTP Content-type
@@ -441,6 +519,11 @@ class Client( object ) :
             Bytes to be returned.
         ``offset``,
             Offset in bytes where the log tail should be started.
+        ``stream``,
+            If True, return the response body as a file-like object, that
+            can be read in parts or iterated line by line, instead of a
+            string. Large logs are not held in memory when the client is
+            configured with ``client.spool_threshold``.
 
         ``Admin-Prev, Yes``
         """
@@ -450,7 +533,19 @@ class Client( object ) :
         isinstance(offset, (int,long)) and q.setdefault('offset', offset)
         hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
         s, h, d = _log( conn, paths, hthdrs=hthdrs, **q )
-        return d.getvalue() if s == OK else None
+        if s != OK :
+            return None
+        return d if stream else bodyvalue( d )
+
+    def Log( self, **kwargs ) :
+        """Return a :class:`Log` iterator over server's log messages, refer
+        to :class:`Log` for key-word arguments. To tail the log,
+
+        >>> for msg in couch.Log( follow=True ) : print msg
+
+        ``Admin-Prev, Yes``
+        """
+        return Log( self, **kwargs )
 
     def restart( self, hthdrs={} ) :
         """Restart CouchDB server instance. You must be authenticated as admin
@@ -492,7 +587,8 @@ class Client( object ) :
     def uuids( self, count=None, hthdrs={} ) :
         """Return ``count`` number of uuids, generated by the server. These uuid
         can be used to compose document ids. Refer to CouchDB API manual to
-        know more about UUIDs.
+        know more about UUIDs. To generate uuids without a server round trip
+        use ``uuidgen`` attribute, refer :mod:`couchpy.uuids`.
         """
         q =  { 'count' : count } if isinstance(count, (int,long)) else {}
         conn, paths = self.conn, (self.paths + ['_uuids'])
@@ -623,6 +719,7 @@ class Client( object ) :
 
         ``Admin-Prev, Yes``
         """
+        self.forgetdb( name )   # Documents of an earlier database are stale
         return self.Database(name, hthdrs=hthdrs).put()
 
     def delete( self, db, hthdrs={} ) :
@@ -635,6 +732,18 @@ class Client( object ) :
         ).delete( hthdrs=hthdrs )
         return None
 
+    def forgetdb( self, name, db=None ) :
+        """Remove the shared :class:`couchpy.database.Database` instance for
+        database ``name``, along with its documents, so that it is
+        instantiated afresh. If ``db`` is specified, remove the instance only
+        if it is ``db``."""
+        self.dblock.acquire()
+        try :
+            if db is None or self.opendbs.get( name, None ) is db :
+                self.opendbs.pop( name, None )
+        finally :
+            self.dblock.release()
+
     def has_database( self, name, hthdrs={} ) :
         """Return a boolean, indicating whether database ``name`` is available
         on the server.
@@ -658,6 +767,273 @@ class Client( object ) :
         from   database     import DatabaseIterator
         return DatabaseIterator( self, values=self.all_dbs(), regexp=regexp )
 
+    def scatterview( self, designdoc, viewname, regexp=None, query={},
+                     keys=None, gather='merge', rereduce=None,
+                     concurrency=None, hthdrs={} ):
+        """Query view ``viewname`` from design document ``designdoc`` on
+        every database whose name matches ``regexp`` (all databases if
+        None), similar to the ``regexp`` argument of
+        :func:`Client.DatabaseIterator`. Requests are fanned out with at most
+        ``concurrency`` requests in flight, default is the ``client.concurrency``
+        configuration parameter. No :class:`couchpy.database.Database` or
+        :class:`couchpy.doc.DesignDocument` objects are instantiated for the
+        target databases.
+
+        ``query``,
+            Dictionary or :class:`couchpy.doc.Query` object of view query
+            parameters, applied to every database.
+        ``keys``,
+            List of keys to select, same as :func:`couchpy.doc.View.fetch`.
+        ``gather``,
+            How per-database results are gathered, one of,
+            ``stream``, return a generator yielding ``(dbname, result,
+            error)`` tuples as and when each database responds.
+            ``merge``, return a dictionary with ``rows`` from all databases
+            merged in view collation order, each row tagged with its database
+            name under ``db``.
+            ``reduce``, rows with the same key are combined by calling
+            ``rereduce(values)``, as with grouped reduce views.
+        ``rereduce``,
+            Function to combine values having the same key, used with
+            ``gather='reduce'``, or the name of a builtin reduce function,
+            ``_sum``, ``_count`` or ``_stats``. By default values are summed,
+            they must be numbers, for other values, like those of ``_stats``,
+            ``rereduce`` must be specified.
+
+        Failure to query a database does not abort the run, for ``merge``
+        and ``reduce`` they are reported in the ``errors`` dictionary keyed by
+        database name.
+
+        >>> couch.scatterview( 'reports', 'bymonth', regexp='tenant_.*',
+        ...                    query={ 'group' : True }, gather='reduce' )
+        { 'rows' : [ ... ], 'errors' : {}, 'databases' : 1200 }
+
+        ``Admin-Prev, No``
+        """
+        from  doc       import Query, _viewsgn
+        if gather not in ('stream', 'merge', 'reduce') :
+            raise CouchPyError( 'Unknown gather %r for scatterview' % gather )
+        if isinstance( rereduce, basestring ) and \
+                rereduce not in builtin_reduces :
+            raise CouchPyError(
+                    'Unknown rereduce %r for scatterview' % rereduce )
+
+        dbnames = self._selectdbs( regexp=regexp )
+        designdoc = designdoc.split('/', 1)[-1] \
+                    if designdoc.startswith('_design/') else designdoc
+        q = query if isinstance( query, Query ) else Query( **dict(query) )
+        conn = self.conn
+        hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
+
+        def fetch( dbname ) :
+            paths = self.paths + \
+                    [ dbname, '_design', designdoc, '_view', viewname ]
+            s, h, d = _viewsgn( conn, keys=keys, paths=paths, hthdrs=hthdrs,
+                                q=q )
+            if d is None :
+                raise CouchPyError( 'View query on %r failed' % dbname )
+            return d
+
+        results = self._parallel( fetch, dbnames, concurrency=concurrency )
+        if gather == 'stream' :
+            return results
+
+        rows, errors, total_rows = [], {}, 0
+        for dbname, d, err in results :
+            if err is not None :
+                log.error( 'scatterview on %r failed, %s' % (dbname, err) )
+                errors[dbname] = err
+                continue
+            total_rows += d.get( 'total_rows', 0 )
+            for row in d.get( 'rows', [] ) :
+                row['db'] = dbname
+                rows.append( row )
+
+        descending = q.get( 'descending', None ) == 'true'
+        if gather == 'merge' :
+            rows.sort( key=lambda r : (collatekey(r.get('key')), r.get('id')),
+                       reverse=descending )
+            return { 'rows'       : rows,
+                     'total_rows' : total_rows,
+                     'errors'     : errors,
+                     'databases'  : len(dbnames) }
+
+        if rereduce is None :
+            rereduce = _sumrereduce
+        elif isinstance( rereduce, basestring ) :
+            fn = builtin_reduces[ rereduce ]
+            rereduce = lambda values : fn( None, values, True )
+        groups = {}
+        for row in rows :
+            k = collatekey( row.get('key') )
+            groups.setdefault( k, (row.get('key'), []) )[1].append( row['value'] )
+        rows = [ { 'key' : key, 'value' : rereduce(values) }
+                 for _, (key, values) in sorted( groups.items(),
+                                                 reverse=descending ) ]
+        return { 'rows' : rows, 'errors' : errors, 'databases' : len(dbnames) }
+
+
+    #---- Bulk administration across databases. Requests are fanned out with
+    #---- bounded concurrency and every API returns a report dictionary,
+    #----   { 'ok'      : { <dbname> : <result>, ... },
+    #----     'errors'  : { <dbname> : <exception>, ... },
+    #----     'count'   : <number-of-databases>,
+    #----     'elapsed' : <seconds> }
+
+    DBS_INFO_BATCH = 100    # Server default for max_db_number_for_dbs_info_req
+
+    def dbsinfo( self, names=None, regexp=None, concurrency=None, hthdrs={} ):
+        """Collect database information, like ``doc_count`` and
+        ``disk_size``, for databases listed in ``names`` or matching
+        ``regexp`` (all databases if both are None). If the server supports
+        ``POST /_dbs_info``, information is fetched in batches of
+        ``DBS_INFO_BATCH`` databases per request, otherwise a ``GET /<db>`` is
+        issued for each database. Either way, at most ``concurrency`` requests
+        are made in parallel.
+
+        Returns report dictionary, where ``ok`` maps database name to its
+        information.
+
+        ``Admin-Prev, No``
+        """
+        from  database  import _getdb, _unknownendpoint
+        names = self._selectdbs( names, regexp )
+        conn = self.conn
+        hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
+
+        if self._dbs_info_supported != False :
+            st = time.time()
+            batches = [ names[i:i+self.DBS_INFO_BATCH]
+                        for i in range(0, len(names), self.DBS_INFO_BATCH) ]
+            fn = lambda keys : _dbs_info( conn, keys, self.paths+['_dbs_info'],
+                                          hthdrs=hthdrs )[2]
+            report = self._report( names )
+            try :
+                for keys, d, err in self._parallel( fn, batches, concurrency ):
+                    if not self._dbs_info_supported and \
+                            isinstance( err, HTTPError ) and \
+                            _unknownendpoint( err ) :
+                        raise err       # Fall back to GET /<db> below
+                    elif err is not None or d is None :
+                        err = err or CouchPyError( '/_dbs_info failed' )
+                        [ report['errors'].setdefault(n, err) for n in keys ]
+                        continue
+                    for x in d :
+                        if x.get( 'info', None ) :
+                            report['ok'][ x['key'] ] = x['info']
+                        else :
+                            report['errors'][ x['key'] ] = \
+                                    CouchPyError( x.get('error', 'failed') )
+                self._dbs_info_supported = True
+                report['elapsed'] = time.time() - st
+                return report
+            except HTTPError, err :
+                log.info( '/_dbs_info not supported, fall back to GET /<db>' )
+                self._dbs_info_supported = False
+
+        def fn( name ) :
+            s, h, d = _getdb( conn, self.paths+[name], hthdrs=hthdrs )
+            return d
+        return self._dbsmap( fn, names, concurrency )
+
+    def setsecurity( self, security, names=None, regexp=None,
+                     concurrency=None, hthdrs={} ):
+        """Set ``security`` object for databases listed in ``names`` or
+        matching ``regexp``. Refer :func:`couchpy.database.Database.security`.
+        Returns report dictionary.
+
+        ``Admin-Prev, Yes``
+        """
+        from  database  import _security
+        conn = self.conn
+        hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
+        def fn( name ) :
+            paths = self.paths + [ name, '_security' ]
+            return _security( conn, paths, security=security, hthdrs=hthdrs )[2]
+        return self._dbsmap( fn, self._selectdbs(names, regexp), concurrency )
+
+    def setrevslimit( self, limit, names=None, regexp=None, concurrency=None,
+                      hthdrs={} ):
+        """Set ``revs_limit`` to ``limit`` for databases listed in ``names``
+        or matching ``regexp``. Refer
+        :func:`couchpy.database.Database.revslimit`. Returns report
+        dictionary.
+
+        ``Admin-Prev, Yes``
+        """
+        from  database  import _revs_limit
+        conn = self.conn
+        hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
+        def fn( name ) :
+            paths = self.paths + [ name, '_revs_limit' ]
+            return _revs_limit( conn, paths, limit=limit, hthdrs=hthdrs )[2]
+        return self._dbsmap( fn, self._selectdbs(names, regexp), concurrency )
+
+    def compactdbs( self, names=None, regexp=None, designdoc=None,
+                    concurrency=None, hthdrs={} ):
+        """Trigger compaction for databases listed in ``names`` or matching
+        ``regexp``. If ``designdoc`` is specified, view indexes of that design
+        document are compacted instead. Compaction runs in the background on
+        the server, use :func:`Client.active_tasks` to track them. Refer
+        :func:`couchpy.database.Database.compact`. Returns report dictionary.
+
+        ``Admin-Prev, Yes``
+        """
+        from  database  import _compact
+        conn = self.conn
+        hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
+        def fn( name ) :
+            paths = self.paths + [ name, '_compact' ]
+            paths = paths + [ designdoc ] if designdoc else paths
+            return _compact( conn, paths, hthdrs=hthdrs )[2]
+        return self._dbsmap( fn, self._selectdbs(names, regexp), concurrency )
+
+    def viewcleanups( self, names=None, regexp=None, concurrency=None,
+                      hthdrs={} ):
+        """Clean-up stale view indexes for databases listed in ``names`` or
+        matching ``regexp``. Refer :func:`couchpy.database.Database.viewcleanup`.
+        Returns report dictionary.
+
+        ``Admin-Prev, Yes``
+        """
+        from  database  import _view_cleanup
+        conn = self.conn
+        hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
+        def fn( name ) :
+            paths = self.paths + [ name, '_view_cleanup' ]
+            return _view_cleanup( conn, paths, hthdrs=hthdrs )[2]
+        return self._dbsmap( fn, self._selectdbs(names, regexp), concurrency )
+
+    def _selectdbs( self, names=None, regexp=None ):
+        """List of database names, either ``names`` or all databases on the
+        server whose name matches ``regexp``."""
+        if names is not None :
+            return list( names )
+        c = re.compile( regexp ) if regexp else None
+        return [ n for n in self.all_dbs() if (c is None) or c.match(n) ]
+
+    def _parallel( self, fn, items, concurrency=None ):
+        concurrency = concurrency or self.defconfig['client.concurrency']
+        return parallel( fn, items, concurrency=concurrency )
+
+    def _report( self, names ):
+        return { 'ok' : {}, 'errors' : {}, 'count' : len(names), 'elapsed' : 0 }
+
+    def _dbsmap( self, fn, names, concurrency=None ):
+        """Call ``fn(dbname)`` for every database in ``names`` and gather the
+        outcome in a report dictionary. A ``None`` result is treated as
+        failure."""
+        st, report = time.time(), self._report( names )
+        for name, d, err in self._parallel( fn, names, concurrency ) :
+            if err is None and d is None :
+                err = CouchPyError( 'Request failed for %r' % name )
+            if err is None :
+                report['ok'][name] = d
+            else :
+                log.error( 'Database %r, %s' % (name, err) )
+                report['errors'][name] = err
+        report['elapsed'] = time.time() - st
+        return report
 
     def commit( self ):
         """ -- TBD -- This is part of multi-document access design, which is
@@ -668,6 +1044,19 @@ class Client( object ) :
         """
         [ db.commit() for dbname, db in self.opendbs.items() ]
 
+    def _getopendbs( self ):
+        if self._local is None :
+            return self._opendbs
+        opendbs = getattr( self._local, 'opendbs', None )
+        if opendbs is None :
+            opendbs = self._local.opendbs = {}
+        return opendbs
+
+    opendbs = property( _getopendbs, doc=
+        """Dictionary of Database objects instantiated under this client,
+        keyed by database name. Per thread, if the client is configured with
+        ``client.threadlocal``.""" )
+
     #---- Place holder API methods
 
     def utils( self ) :
@@ -715,28 +1104,180 @@ class Client( object ) :
 
 
 class Log( object ):
-    """Iterate over couchdb server's log messages"""
+    """Iterate over couchdb server's log messages, parsed as
+    :class:`Log.Message` records. Log text is fetched using the ``bytes`` and
+    ``offset`` parameters of ``GET /_log``, refer :func:`Client.log`, so
+    only a window of the log is transferred per request.
+
+    ``client``,
+        :class:`Client` instance, must be authenticated as admin.
+    ``bytes``,
+        Size of the log window fetched per request.
+    ``offset``,
+        Offset in bytes from the end of the log, where the window ends. Valid
+        only when not following the log.
+    ``follow``,
+        If True, keep polling the server every ``interval`` seconds and yield
+        new messages as they are logged, like ``tail -f``. While the whole
+        log fits in the window, new output is located by its byte offset,
+        otherwise by matching the tail of already seen log text, which is
+        lengthened until it matches only once. If more than ``bytes`` of log
+        is written between two polls, the window is doubled up to
+        ``maxbytes``, beyond which the skipped messages are lost and a
+        warning is logged.
+    ``grace``,
+        When following, the last message is yielded only when the next
+        message is logged, or when no continuation lines arrived for it in
+        ``grace`` seconds.
+
+    >>> for msg in couch.Log( follow=True ) :
+    ...     print msg.level, msg.pid, msg.message
+    """
+
+    ANCHOR = 256    # Bytes of seen log text first used to locate new output
 
-    def Message( object ):
-        def __init__( self, message ):
-            self.message = message
+    # CouchDB 1.x, [Thu, 01 Dec 2011 10:12:13 GMT] [info] [<0.123.0>] message
+    # CouchDB 2.x, [info] 2011-12-01T10:12:13.123Z couchdb@host <0.123.0> ...
+    LOGLINES = [
+        ( re.compile( r'^\[([^\]]+)\] \[([a-z]+)\] \[([^\]]+)\] ?(.*)$' ),
+          lambda m : (m.group(1), m.group(2), m.group(3), m.group(4)) ),
+        ( re.compile( r'^\[([a-z]+)\] (\S+) \S+ (<[^>]+>) (?:\S+ )?(.*)$' ),
+          lambda m : (m.group(2), m.group(1), m.group(3), m.group(4)) ),
+    ]
+
+    class Message( object ):
+        """A single log message, with attributes ``timestamp``, ``level``,
+        ``pid`` and ``message`` text. Continuation lines of a multi-line
+        message are part of ``message``."""
+
+        def __init__( self, timestamp, level, pid, message ):
+            self.timestamp, self.level = timestamp, level
+            self.pid, self.message = pid, message
 
         def __str__( self ):
             return '%s' % self.message
 
         def __repr__( self ):
-            return '%r' % self.message
-
-    def __init__( self, client, bytecount=None, offset=None ):
-        self.bytecount = bytecount
-        self.offset = 0
-        self.rawlog = client.rawlog( bytes=bytecount, offset=offset )
+            return '<Message %s %s %s %r>' % (
+                        self.timestamp, self.level, self.pid, self.message )
+
+    def __init__( self, client, bytes=4096, offset=None, follow=False,
+                  interval=1.0, maxbytes=1048576, grace=5.0, hthdrs={} ):
+        self.client, self.hthdrs = client, hthdrs
+        self.bytes, self.offset = bytes, offset
+        self.follow, self.interval, self.maxbytes = follow, interval, maxbytes
+        self.grace = grace
+        self.seen = None        # Tail of already consumed log text
+        self.size = None        # Bytes of log consumed, if known
+        self.pending = None     # Last message, may receive more lines
+        self.pendingat = None   # When the last line of pending message came
+        self._messages = self._iterlog()
 
     def __iter__( self ):
-        pass
+        return self
 
     def next( self ):
-        pass
+        return self._messages.next()
+
+    def close( self ):
+        """Stop following the log."""
+        self._messages.close()
+
+    def poll( self ):
+        """Fetch the log window once and return a list of messages logged
+        since the previous poll."""
+        text = self._newtext()
+        return self._parselog( text ) if text else []
+
+    def _iterlog( self ):
+        if not self.follow :
+            text = self.client.log( bytes=self.bytes, offset=self.offset,
+                                    hthdrs=self.hthdrs ) or ''
+            for msg in self._parselog( self._skippartial(text) ) :
+                yield msg
+            if self.pending :
+                yield self.pending
+            return
+
+        while True :
+            msgs = self.poll()
+            if self.pending and time.time() - self.pendingat >= self.grace :
+                msgs, self.pending = msgs + [ self.pending ], None
+            for msg in msgs :
+                yield msg
+            time.sleep( self.interval )
+
+    def _newtext( self ):
+        """Fetch log window and return text logged after ``self.seen``."""
+        bytes = self.bytes
+        while True :
+            text = self.client.log( bytes=bytes, hthdrs=self.hthdrs ) or ''
+            whole = len(text) < bytes       # Window holds the entire log
+            if self.seen is None :
+                newtext = self._skippartial( text )
+                break
+            if whole and self.size is not None and len(text) >= self.size :
+                newtext = text[ self.size: ]
+                break
+            final = bytes >= self.maxbytes or whole
+            off = self._locate( text, final )
+            if off is not None :
+                newtext = text[ off: ]
+                break
+            elif final :
+                log.warn( 'Log messages lost, more than %s bytes logged '
+                          'between polls' % bytes )
+                newtext = self._skippartial( text )
+                break
+            bytes = min( bytes * 2, self.maxbytes )
+
+        # Only complete lines are consumed
+        end = newtext.rfind( '\n' ) + 1
+        self.size = (len(text) - len(newtext) + end) if whole else None
+        newtext = newtext[:end]
+        if newtext or self.seen is None :
+            seen = (self.seen or '') + newtext
+            self.seen = seen[ -max( self.bytes, self.ANCHOR ): ]
+        return newtext
+
+    def _locate( self, text, final ):
+        """Return the offset in ``text`` just after already consumed log
+        text, or None if it is not found. The tail of consumed text is
+        matched, doubling its length while it matches more than once. If
+        the longer tail is not in ``text``, return None so that a larger
+        window is fetched, unless ``final``, when the last match is used."""
+        n, found = self.ANCHOR, None
+        while self.seen :
+            anchor = self.seen[ -n: ]
+            first, last = text.find( anchor ), text.rfind( anchor )
+            if first < 0 :
+                return found if final else None
+            found = last + len( anchor )
+            if first == last or n >= len( self.seen ) :
+                break
+            n *= 2
+        return found
+
+    def _skippartial( self, text ):
+        """Log window might start in the middle of a line, skip it."""
+        for m in re.finditer( r'(?m)^\[', text ) :
+            return text[ m.start(): ]
+        return ''
 
     def _parselog( self, text ):
-        logs = text.split('\n\n')
+        """Parse ``text`` into a list of :class:`Log.Message`. The last
+        message is held back in ``self.pending`` since its continuation lines
+        might arrive with the next window."""
+        msgs = []
+        for line in text.splitlines() :
+            for regex, fields in self.LOGLINES :
+                m = regex.match( line )
+                if m : break
+            if m :
+                self.pending and msgs.append( self.pending )
+                self.pending = self.Message( *fields(m) )
+                self.pendingat = time.time()
+            elif self.pending :
+                self.pending.message += '\n' + line
+                self.pendingat = time.time()
+        return msgs
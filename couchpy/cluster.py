@@ -0,0 +1,273 @@
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+"""Route requests across several CouchDB nodes, without an external load
+balancer. :class:`ClusterSession` has the same interface as
+:class:`couchpy.httpc.HttpSession`. Requests are composed against the first
+node's url, and the session rewrites them to the node picked by a routing
+policy,
+
+* ``roundrobin``, nodes are picked in turn.
+* ``least``, node with least number of outstanding requests.
+* ``ewma``, node with the lowest exponentially weighted moving average of
+  response time, weighted by its outstanding requests.
+
+Nodes are marked down when a request fails with a socket error, and the
+request is retried on the next node. Requests that might not be safe to
+repeat, like POST, are retried only if the connection was refused. Down nodes
+are probed with :func:`couchpy.client.Client.ispresent` in the background,
+every ``probe_interval`` seconds, and put back in rotation once they answer.
+
+``pin`` decides requests that must stick to a node,
+
+* ``writes``, all requests other than GET and HEAD go to the first node that
+  is up, so that a read-your-writes sequence from a single client can be
+  served by pinning reads as well, using ``session``. POST requests that only
+  read, like ``_find``, ``_bulk_get``, or ``_all_docs`` and views with
+  ``keys``, are routed like GET requests.
+* ``session``, requests authenticated by the same cookie or credentials go to
+  the same node, until it is down.
+
+A :class:`couchpy.client.Client` instantiated with a list of urls uses this
+session,
+
+>>> couch = Client( url=[ 'http://node1:5984', 'http://node2:5984' ] )
+>>> couch.conn.htsess.nodes()
+[ { 'url' : 'http://node1:5984', 'up' : True, 'outstanding' : 0, ... }, ... ]
+"""
+
+import re, time, errno, socket, logging
+
+try:
+    from threading       import Lock, Thread
+except ImportError:
+    from dummy_threading import Lock, Thread
+
+from   couchpy          import CouchPyError
+from   couchpy.httpc    import HttpSession
+from   couchpy.rest     import _extract_credentials
+
+log = logging.getLogger( __name__ )
+
+# Socket errors which mean that request was never sent to the server.
+CONNECT_ERRORS = frozenset([
+    errno.ECONNREFUSED, errno.EHOSTDOWN, errno.EHOSTUNREACH,
+    errno.ENETUNREACH,  errno.ENETDOWN
+])
+# Requests that can be repeated on another node. For CouchDB, repeating a
+# PUT, DELETE or COPY at the worst leads to a document update conflict.
+IDEMPOTENT = frozenset([ 'GET', 'HEAD', 'PUT', 'DELETE', 'COPY' ])
+# POST requests that only read from the database, like queries posting their
+# keys or selector in the request body. They are not pinned as writes.
+READONLY_POSTS = re.compile(
+    r'^/(_dbs_info|[^/?]+/(_all_docs(/queries)?|_design_docs|_local_docs|'
+    r'_find|_explain|_bulk_get|_revs_diff|_missing_revs|_changes|_temp_view|'
+    r'_design(/|%2F)[^/?]+/_view/[^/?]+(/queries)?))/?(\?|$)' )
+
+class Node( object ):
+    """Routing state of a single CouchDB node."""
+
+    def __init__( self, url ):
+        url = _extract_credentials( url )[0]    # Credentials are per request
+        self.url = url[:-1] if url.endswith('/') else url
+        self.up = True
+        self.outstanding = 0
+        self.ewma = None        # Response time in seconds
+        self.requests = self.failures = 0
+        self.downsince = self.nextprobe = None
+
+    def status( self ):
+        return { 'url' : self.url, 'up' : self.up,
+                 'outstanding' : self.outstanding, 'ewma' : self.ewma,
+                 'requests' : self.requests, 'failures' : self.failures }
+
+
+class ClusterSession( object ):
+    """HTTP session routing requests to nodes listed in ``urls``.
+
+    ``policy``,
+        Routing policy, one of ``roundrobin``, ``least`` or ``ewma``.
+    ``pin``,
+        List of pinning rules, ``writes`` and / or ``session``.
+    ``probe_interval``,
+        Seconds between probes of a node that is down.
+    ``alpha``,
+        Smoothing factor for ``ewma`` policy, weight given to the latest
+        response time.
+    ``htsess``,
+        Underlying :class:`couchpy.httpc.HttpSession`, which pools
+        connections per node. If None, a new session is created using
+        ``kwargs``.
+    """
+
+    policies = ( 'roundrobin', 'least', 'ewma' )
+
+    def __init__( self, urls, policy='roundrobin', pin=['writes'],
+                  probe_interval=5.0, alpha=0.3, htsess=None, **kwargs ):
+        if not urls :
+            raise CouchPyError( 'Cluster needs atleast one node url' )
+        if policy not in self.policies :
+            raise CouchPyError( 'Unknown routing policy %r' % policy )
+        self.nodelist = [ Node(url) for url in urls ]
+        self.canonical = self.nodelist[0].url
+        self.policy, self.pin = policy, pin or []
+        self.probe_interval, self.alpha = probe_interval, alpha
+        self.htsess = htsess or HttpSession( **kwargs )
+        self.lock = Lock()
+        self.rrindex = 0
+        self.pinned = {}        # session key -> Node
+
+    def __getattr__( self, name ):
+        return getattr( self.htsess, name )
+
+    def nodes( self ):
+        """List of routing status for every node."""
+        return [ node.status() for node in self.nodelist ]
+
+    def request( self, method, url, body=None, headers=None, credentials=None,
+                 num_redirects=0, chunk_cb=None ) :
+        method = method.upper()
+        path = url[ len(self.canonical): ] \
+               if url.startswith( self.canonical ) else None
+        if path is None :           # Not a cluster url, like a redirect
+            return self.htsess.request(
+                        method, url, body=body, headers=headers,
+                        credentials=credentials, num_redirects=num_redirects,
+                        chunk_cb=chunk_cb )
+
+        tried = []
+        while True :
+            node = self.choose(
+                    method, headers or {}, credentials, tried, path=path )
+            tried.append( node )
+            self._begin( node )
+            st = time.time()
+            try :
+                # Headers are updated by the http session, retries need a
+                # fresh copy.
+                resp = self.htsess.request(
+                        method, node.url + path, body=body,
+                        headers=dict( headers or {} ), credentials=credentials,
+                        num_redirects=num_redirects, chunk_cb=chunk_cb )
+            except socket.error, e :
+                self._end( node, None )
+                self.markdown( node )
+                retry = method in IDEMPOTENT or e.args[0] in CONNECT_ERRORS
+                if not retry or len(tried) >= len(self.nodelist) :
+                    raise
+                log.warn( '%s %s failed on %s, retrying on another node',
+                          method, path, node.url )
+                continue
+            except :
+                self._end( node, time.time() - st )
+                raise
+            self._end( node, time.time() - st )
+            return resp
+
+    def choose( self, method, headers, credentials, exclude=[], path='' ):
+        """Pick a node for request ``method`` on ``path``, that is not in
+        ``exclude``."""
+        self.lock.acquire()
+        try :
+            self._probedown()
+            up = [ n for n in self.nodelist if n.up and n not in exclude ]
+            if not up :     # Try the node that has been down for longest
+                down = [ n for n in self.nodelist if n not in exclude ]
+                if not down :
+                    raise CouchPyError( 'No cluster node available' )
+                return min( down, key=lambda n : n.downsince )
+
+            if 'writes' in self.pin and method not in ('GET', 'HEAD') and \
+                    not ( method == 'POST' and READONLY_POSTS.match(path) ) :
+                return up[0]
+            key = self._sessionkey( headers, credentials ) \
+                  if 'session' in self.pin else None
+            node = self.pinned.get( key, None ) if key else None
+            if node is None or node not in up :
+                node = self._route( up )
+                key and self.pinned.update({ key : node })
+            return node
+        finally :
+            self.lock.release()
+
+    def _route( self, up ):
+        if self.policy == 'least' :
+            return min( up, key=lambda n : n.outstanding )
+        elif self.policy == 'ewma' :
+            fresh = [ n for n in up if n.ewma is None ]
+            if fresh :
+                return fresh[0]
+            return min( up, key=lambda n : n.ewma * (n.outstanding + 1) )
+        self.rrindex = (self.rrindex + 1) % len(up)
+        return up[ self.rrindex ]
+
+    def _sessionkey( self, headers, credentials ):
+        cookie = headers.get( 'Cookie', headers.get( 'cookie', None ))
+        return cookie or credentials
+
+    def _begin( self, node ):
+        self.lock.acquire()
+        try :
+            node.outstanding += 1
+            node.requests += 1
+        finally :
+            self.lock.release()
+
+    def _end( self, node, elapsed ):
+        self.lock.acquire()
+        try :
+            node.outstanding -= 1
+            if elapsed is not None :
+                node.ewma = elapsed if node.ewma is None else \
+                            self.alpha * elapsed + (1 - self.alpha) * node.ewma
+        finally :
+            self.lock.release()
+
+    def markdown( self, node ):
+        """Take ``node`` out of rotation until a probe finds it alive."""
+        self.lock.acquire()
+        try :
+            if node.up :
+                log.error( 'Cluster node %s is down', node.url )
+                node.up, node.downsince = False, time.time()
+                node.nextprobe = node.downsince + self.probe_interval
+            node.failures += 1
+            self.htsess.conns.pop( self._connkey( node ), None )
+        finally :
+            self.lock.release()
+
+    def _connkey( self, node ):
+        scheme, rest = node.url.split( '://', 1 )
+        return ( scheme, rest.split('/', 1)[0] )
+
+    def _probedown( self ):
+        now = time.time()
+        for node in self.nodelist :
+            if not node.up and node.nextprobe <= now :
+                node.nextprobe = now + self.probe_interval
+                t = Thread( target=self.probe, args=(node,) )
+                t.setDaemon( True )
+                t.start()
+
+    def probe( self, node ):
+        """Check whether ``node`` is alive, using a HEAD request, and put it
+        back in rotation if it is."""
+        from couchpy.client import Client
+        try :
+            # A node that accepts connections but does not respond should
+            # not hold the probe thread forever.
+            config = { 'client.deadline' : self.probe_interval }
+            alive = Client( url=node.url, config=config ).ispresent()
+        except Exception :
+            alive = False
+        if alive :
+            self.lock.acquire()
+            try :
+                log.info( 'Cluster node %s is up', node.url )
+                node.up, node.downsince = True, None
+            finally :
+                self.lock.release()
+        return alive
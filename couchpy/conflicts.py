@@ -0,0 +1,421 @@
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+"""Detect and resolve conflicted documents. CouchDB keeps every conflicting
+leaf revision of a document until it is resolved by an application, and
+conflicted documents make every read and view update slower. A
+:class:`Resolver` finds conflicted documents, fetches all their leaf
+revisions in batches, merges them with a pluggable strategy, writes the
+merged document on top of the winning revision and deletes the losing
+revisions.
+
+>>> resolver = Resolver( db, strategy=ThreeWayMerge() )
+>>> resolver.run( 'scan' )
+{ 'found' : 120, 'resolved' : 118, 'skipped' : 2, 'failed' : 0,
+  'tombstoned' : 131, 'elapsed' : 0.84, 'rate' : 140.5, 'backlog' : 0 }
+>>> resolver.start()        # Resolve conflicts as they are replicated in
+>>> resolver.stop()
+
+Conflicted documents are found by one of,
+
+``scan``,
+    ``_all_docs`` with ``include_docs`` and ``conflicts``, a full scan of
+    the database.
+``changes``,
+    ``_changes`` feed with ``style=all_docs``, from sequence ``since``, used
+    by the background thread to resolve conflicts as they arrive.
+``view``,
+    A conflicts view, installed in design document ``_design/couchpy`` by
+    :func:`Resolver.installview`, which only indexes conflicted documents.
+
+A merge strategy is a callable, ``strategy( docs, ancestor )``, where
+``docs`` is the list of live leaf revisions, winning revision first, and
+``ancestor`` is their latest common ancestor, if the strategy has an
+``ancestor`` attribute that is True and the ancestor's body is still
+available on the server, otherwise None. It returns the merged document, or
+None to leave the document in conflict. Fields starting with ``_`` in the
+merged document are ignored, except ``_attachments``. Attachment stubs can
+only refer to attachments of the winning revision, stubs of attachments
+present only in losing revisions are dropped.
+
+Merged documents are written with a single ``_bulk_docs`` request per batch,
+and losing revisions are deleted with a second one, only for documents whose
+merged revision was written. If a merged revision fails, for instance
+because the document was updated meanwhile, its losing revisions are kept
+and will be found again.
+"""
+
+import time, logging
+
+try:
+    from threading       import Thread, Lock, Event
+except ImportError:
+    from dummy_threading import Thread, Lock, Event
+
+from   couchpy          import CouchPyError
+from   couchpy.utils    import JSON, collatekey
+
+log = logging.getLogger( __name__ )
+json = JSON()
+
+VIEWSOURCE = {
+    'javascript' : "function( doc ) {\n"
+                   "  if( doc._conflicts ) {\n"
+                   "    emit( null, [doc._rev].concat( doc._conflicts ));\n"
+                   "  }\n"
+                   "}",
+    'python'     : "def fun( doc ):\n"
+                   "    if doc.get( '_conflicts' ) :\n"
+                   "        emit( None, [doc['_rev']] + doc['_conflicts'] )\n",
+}
+"""Source of the conflicts view, for design document languages."""
+
+_missing = object()
+
+def _revkey( rev ):
+    pos, _, rid = rev.partition( '-' )
+    return (int( pos ), rid)
+
+def _history( doc ):
+    revs = doc.get( '_revisions', None )
+    if not revs :
+        return [ doc['_rev'] ]
+    return [ '%s-%s' % (revs['start'] - i, rid)
+             for i, rid in enumerate( revs['ids'] ) ]
+
+def ancestor( docs ):
+    """Return the latest common ancestor revision of leaf revisions
+    ``docs``, fetched with ``_revisions``, None if there is none."""
+    others = [ set( _history( doc )) for doc in docs[1:] ]
+    for rev in _history( docs[0] )[1:] :
+        if all([ rev in h for h in others ]) :
+            return rev
+    return None
+
+def _stubs( atts, winner ):
+    """Attachment stubs of merged document ``atts`` can only refer to
+    attachments of the ``winner`` revision it is written on. Stubs are taken
+    from the winner, those of attachments it does not have are dropped."""
+    own = winner.get( '_attachments', None ) or {}
+    return dict([ (name, own[name] if att.get( 'stub', False ) else att)
+                  for name, att in atts.items()
+                  if not att.get( 'stub', False ) or name in own ])
+
+
+class LastWriterWins( object ):
+    """Pick the revision with the greatest value of ``field``, like an
+    update timestamp. Revisions without the field lose. If ``field`` is None,
+    or on ties, the winning revision picked by CouchDB is kept."""
+
+    ancestor = False
+
+    def __init__( self, field=None ):
+        self.field = field
+
+    def __call__( self, docs, ancestor ):
+        if self.field is None :
+            return docs[0]
+        key = lambda (i, doc) : (
+                self.field in doc, collatekey( doc.get( self.field, None )),
+                -i )
+        return max( enumerate( docs ), key=key )[1]
+
+
+class ThreeWayMerge( object ):
+    """Field level three-way merge. For every top level field, changes made
+    by the revisions, with respect to their common ancestor, are combined.
+    A field changed to different values by more than one revision is
+    resolved by ``onconflict( field, values, base )``, where missing fields
+    are ``ThreeWayMerge.missing``. By default the value in the winning
+    revision is kept. Without an ancestor, every field present in any
+    revision is treated as changed."""
+
+    ancestor = True
+    missing = _missing
+
+    def __init__( self, onconflict=None ):
+        self.onconflict = onconflict
+
+    def __call__( self, docs, ancestor ):
+        base = ancestor or {}
+        fields = set( k for doc in docs for k in doc if not k.startswith('_') )
+        merged = {}
+        for field in fields :
+            old = base.get( field, _missing )
+            values = [ doc.get( field, _missing ) for doc in docs ]
+            changed = []
+            for v in values :
+                if v != old and v not in changed :
+                    changed.append( v )
+            if not changed :
+                value = old
+            elif len( changed ) == 1 :
+                value = changed[0]
+            elif self.onconflict :
+                value = self.onconflict( field, values, old )
+            else :
+                value = values[0]
+            value is not _missing and merged.update({ field : value })
+        '_attachments' in docs[0] and \
+                merged.update( _attachments=docs[0]['_attachments'] )
+        return merged
+
+
+class Resolver( object ):
+    """Resolve conflicted documents in database ``db``.
+
+    ``strategy``,
+        Merge strategy, default :class:`LastWriterWins`.
+    ``batch``,
+        Number of conflicted documents resolved per batch.
+    ``concurrency``,
+        Maximum number of parallel requests while fetching revisions,
+        default is ``client.concurrency`` configuration parameter.
+    ``timeout``,
+        Seconds to wait for changes in a long-poll request, when following
+        the changes feed in the background.
+    """
+
+    DDOC = '_design/couchpy'
+
+    def __init__( self, db, strategy=None, batch=100, concurrency=None,
+                  timeout=30.0 ):
+        self.db, self.strategy = db, (strategy or LastWriterWins())
+        self.batch, self.concurrency = batch, concurrency
+        self.timeout = timeout
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = None
+        self.since = 0
+        self.pendingsince = None    # Seen in changes feed, yet to resolve
+        self.errors = 0
+        self.backlog = 0
+        self.stats = dict([ (k, 0) for k in
+                            ( 'found', 'resolved', 'skipped', 'failed',
+                              'tombstoned' ) ])
+        self.stats['elapsed'] = 0.0
+
+    def report( self ):
+        """Return a dictionary of counters. ``found``, conflicted documents
+        processed, ``resolved``, ``skipped`` because they were no longer in
+        conflict or the strategy declined, ``failed`` to be written,
+        ``tombstoned``, losing revisions deleted, ``elapsed``, seconds spent
+        resolving, ``rate``, documents resolved per second and
+        ``backlog``, conflicted documents found but yet to be resolved."""
+        self.lock.acquire()
+        try :
+            d = dict( self.stats, backlog=self.backlog )
+        finally :
+            self.lock.release()
+        d['rate'] = d['resolved'] / d['elapsed'] if d['elapsed'] else 0.0
+        return d
+
+    def _count( self, **kwargs ):
+        self.lock.acquire()
+        try :
+            for k, v in kwargs.items() :
+                if k == 'backlog' :
+                    self.backlog += v
+                else :
+                    self.stats[k] += v
+        finally :
+            self.lock.release()
+
+    #---- Detection, generators of (_id, [leaf-revisions])
+
+    def scan( self ):
+        """Find conflicted documents with a scan of ``_all_docs``."""
+        q = { 'include_docs' : 'true', 'conflicts' : 'true',
+              'limit' : self.batch * 10 }
+        while True :
+            d = self.db.all_docs( q=q )
+            if d is None :
+                raise CouchPyError( 'Scanning _all_docs failed' )
+            rows = d['rows']
+            for row in rows :
+                doc = row.get( 'doc', None ) or {}
+                if doc.get( '_conflicts', None ) :
+                    yield row['id'], [ doc['_rev'] ] + doc['_conflicts']
+            if len( rows ) < q['limit'] :
+                return
+            q.update( startkey=json.encode( rows[-1]['id'] ), skip=1 )
+
+    def changes( self, since=None, feed='normal' ):
+        """Find documents with more than one leaf revision, in the changes
+        feed since sequence ``since``, default is the last sequence resolved
+        by this resolver. Leaf revisions can be deleted, they are skipped once
+        fetched. The last sequence seen is remembered in ``self.since`` by
+        :func:`Resolver.resolve`, only after all documents found are
+        resolved, so that a failed batch is found again."""
+        while True :
+            query = { 'feed' : feed, 'style' : 'all_docs',
+                      'since' : self.since if since is None else since,
+                      'limit' : self.batch * 10 }
+            feed == 'longpoll' and query.update(
+                                        timeout=int( self.timeout * 1000 ))
+            d = self.db.changes( **query )
+            if d is None :
+                raise CouchPyError( 'Fetching changes failed' )
+            results = d.get( 'results', [] )
+            for row in results :
+                if len( row['changes'] ) > 1 and not row.get( 'deleted' ) :
+                    yield row['id'], [ c['rev'] for c in row['changes'] ]
+            since = self.pendingsince = d.get( 'last_seq', since )
+            if feed == 'longpoll' or len( results ) < query['limit'] :
+                return
+
+    def installview( self, language='javascript' ):
+        """Create design document ``_design/couchpy`` with the conflicts
+        view, in ``language``, if it is not already present."""
+        if self.db.current_revs([ self.DDOC ]) :
+            return
+        self.db.DesignDocument({
+            '_id' : self.DDOC, 'language' : language,
+            'views' : { 'conflicts' : { 'map' : VIEWSOURCE[language] }}
+        }).post()
+
+    def view( self ):
+        """Find conflicted documents using the conflicts view, refer
+        :func:`Resolver.installview`."""
+        view = self.db.DesignDocument( self.DDOC ).fetch().views()['conflicts']
+        q = { 'limit' : self.batch * 10 }
+        while True :
+            rows = view.fetch( **q )['rows']
+            for row in rows :
+                yield row['id'], row['value']
+            if len( rows ) < q['limit'] :
+                return
+            q.update( startkey='null', startkey_docid=rows[-1]['id'], skip=1 )
+
+    #---- Resolution
+
+    def run( self, source='scan' ):
+        """Resolve all conflicted documents found by ``source``, one of
+        ``scan``, ``changes`` or ``view``. Return :func:`Resolver.report`."""
+        self.resolve( getattr( self, source )() )
+        return self.report()
+
+    def resolve( self, candidates ):
+        """Resolve ``candidates``, an iterable of ``(_id, [leaf-revisions])``,
+        in batches. Return a list of ``_bulk_docs`` results for merged
+        documents that were written."""
+        results, batch = [], {}
+        self.pendingsince = None
+        try :
+            for _id, revs in candidates :
+                if _id not in batch :
+                    self._count( backlog=1 )
+                batch.setdefault( _id, set() ).update( revs )
+                if len( batch ) >= self.batch :
+                    results.extend( self._resolve( batch ))
+                    batch = {}
+            batch and results.extend( self._resolve( batch ))
+            if self.pendingsince is not None :  # Changes feed is resolved
+                self.since = self.pendingsince
+        finally :
+            self.pendingsince = None
+        return results
+
+    def _resolve( self, batch ):
+        st = time.time()
+        try :
+            return self._resolvebatch( batch )
+        finally :
+            self._count( found=len( batch ), backlog=-len( batch ),
+                         elapsed=time.time() - st )
+
+    def _resolvebatch( self, batch ):
+        db, strategy = self.db, self.strategy
+        getancestor = getattr( strategy, 'ancestor', False )
+        pairs = [ (_id, rev) for _id, revs in batch.items() for rev in revs ]
+        leaves = {}
+        for r in db.bulk_get( pairs, revs=getancestor,
+                              concurrency=self.concurrency ) :
+            for item in r['docs'] :
+                doc = item.get( 'ok', None )
+                if doc and not doc.get( '_deleted', False ) :
+                    leaves.setdefault( r['id'], [] ).append( doc )
+        for _id, docs in leaves.items() :
+            docs.sort( key=lambda doc : _revkey( doc['_rev'] ), reverse=True )
+        skipped = len( batch ) - \
+                  len([ docs for docs in leaves.values() if len( docs ) > 1 ])
+
+        ancestors = {}
+        if getancestor :
+            pairs = [ (_id, ancestor( docs )) for _id, docs in leaves.items()
+                      if len( docs ) > 1 ]
+            pairs = [ p for p in pairs if p[1] ]
+            for r in db.bulk_get( pairs, concurrency=self.concurrency ) :
+                doc = r['docs'][0].get( 'ok', None )
+                doc and ancestors.update({ r['id'] : doc })
+
+        writes, losers = [], {}
+        for _id, docs in sorted( leaves.items() ) :
+            if len( docs ) < 2 :
+                continue
+            merged = strategy( docs, ancestors.get( _id, None ))
+            if merged is None :
+                skipped += 1
+                continue
+            write = dict([ (k, v) for k, v in merged.items()
+                           if not k.startswith( '_' ) or k == '_attachments' ])
+            write.update( _id=_id, _rev=docs[0]['_rev'] )
+            atts = _stubs( write.pop( '_attachments', None ) or {}, docs[0] )
+            atts and write.update( _attachments=atts )
+            writes.append( write )
+            losers[_id] = [ doc['_rev'] for doc in docs[1:] ]
+        self._count( skipped=skipped )
+        if not writes :
+            return []
+
+        # Losing revisions are deleted only if the merge is written, so that
+        # their changes are never lost.
+        d = db.bulkdocs( writes )
+        if d is None :
+            self._count( failed=len( writes ))
+            raise CouchPyError( 'Writing merged documents failed' )
+        written = [ r for r in d if 'rev' in r and 'error' not in r ]
+        self._count( resolved=len( written ),
+                     failed=len( writes ) - len( written ))
+        tombstones = [ { '_id' : r['id'], '_rev' : rev, '_deleted' : True }
+                       for r in written for rev in losers[ r['id'] ] ]
+        if tombstones :
+            d = db.bulkdocs( tombstones ) or []
+            self._count( tombstoned=len([ r for r in d if 'rev' in r and
+                                                          'error' not in r ]))
+        return written
+
+    #---- Background
+
+    def start( self, since=0 ):
+        """Resolve conflicts found in the changes feed, from sequence
+        ``since``, in a background thread. Return self."""
+        self.since = since
+        self.stopped.clear()
+        self.thread = Thread( target=self._run )
+        self.thread.setDaemon( True )
+        self.thread.start()
+        return self
+
+    def stop( self ):
+        """Stop the background thread. The thread exits after its pending
+        request to the server completes."""
+        self.stopped.set()
+        self.thread and self.thread.join( self.timeout )
+        self.thread = None
+
+    def _run( self ):
+        catchup = True
+        while not self.stopped.isSet() :
+            try :
+                self.resolve( self.changes(
+                                feed='normal' if catchup else 'longpoll' ))
+                catchup, self.errors = False, 0
+            except Exception, e :
+                self.errors += 1
+                log.error( 'Resolving conflicts in %r failed, %s' % (
+                           self.db.dbname, e ))
+                self.stopped.wait( min( self.timeout, 0.1 * self.errors ))
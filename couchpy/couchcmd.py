@@ -4,12 +4,46 @@
 # file 'LICENSE', which is part of this source code package.
 #       Copyright (c) 2011 SKR Farms (P) LTD.
 
-import optparse, sys, pprint, logging
+import optparse, sys, pprint, logging, time
 from   couchpy.client import Client
+from   couchpy.stats  import StatsSampler
+import couchpy.bench
 
 def empty() :
     pass
 
+def top( client, interval, count=20 ) :
+    """Live view of server counters with highest rates, current value of
+    gauges and progress of active tasks, refreshed every ``interval``
+    seconds."""
+    sampler = StatsSampler( client, interval=interval ).start()
+    try :
+        while True :
+            time.sleep( interval )
+            lines = [ '\033[2J\033[H%s  (every %ss)' % (client.url, interval),
+                      '',
+                      '%-45s %12s %12s %12s' % ('statistic', 'rate/s', 'p95/s',
+                                                'value') ]
+            for name, rate in sampler.top( count ) :
+                lines.append( '%-45s %12.2f %12.2f %12.2f' % (
+                    name, rate, sampler.percentile(name, 95) or 0.0,
+                    sampler.value(name) or 0.0 ))
+            lines.extend([ '', '%-45s %12s' % ('gauge / mean', 'value') ])
+            for name in sampler.gauges() :
+                lines.append( '%-45s %12.2f' % (name, sampler.value(name)) )
+            lines.extend([ '', '%-25s %-25s %9s %9s' % (
+                                    'task', 'type', 'progress', 'eta(s)') ])
+            for task in sampler.tasks() :
+                progress, eta = task['progress'], task['eta']
+                lines.append( '%-25s %-25s %9s %9s' % (
+                    task.get( 'task', task.get('database', '') ),
+                    task.get( 'type', '' ),
+                    '-' if progress is None else '%d%%' % progress,
+                    '-' if eta is None else '%d' % eta ))
+            print '\n'.join( lines )
+    except KeyboardInterrupt :
+        sampler.stop()
+
 def option_parse() :
     """Parse the options and check whether the semantics are correct."""
     parser  = optparse.OptionParser(usage="usage: %prog [options] url" )
@@ -28,6 +62,16 @@ def option_parse() :
     parser.add_option( '-s', dest='stats', action="store_true",
                        default=False,
                        help='Server statistics' )
+    parser.add_option( '-T', dest='top', action="store_true",
+                       default=False,
+                       help='Live view of server statistics and active-tasks' )
+    parser.add_option( '-i', dest='interval', type="float",
+                       default=2.0,
+                       help='Refresh interval in seconds for live view' )
+    parser.add_option( '-B', dest='bench', action="store_true",
+                       default=False,
+                       help='Run benchmarks against the server, needs admin '
+                            'credentials in url' )
     parser.add_option( '-c', dest='config', action="store_true",
                        default=False,
                        help='List of configuration parameters' )
@@ -65,6 +109,10 @@ if __name__ == '__main__' :
         pprint.pprint( client.active_tasks() )
     elif options.stats :
         pprint.pprint( client.stats() )
+    elif options.top :
+        top( client, options.interval )
+    elif options.bench :
+        sys.exit( couchpy.bench.main( [], url=url ))
     elif options.config :
         if options.confsec :
             pprint.pprint( client.config( section=options.confsec ) )
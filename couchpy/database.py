@@ -68,6 +68,24 @@ Bulk document inserts,
 >>> db.bulkdocs( docs )
 >>> db.bulkdocs( docs, atomic=True )
 
+Fetch many documents, or specific revisions, in a handful of requests,
+
+>>> pairs = [ 'joe', ('bob', '2-7051cbe5c8faecd085a3fa619e6e6337') ]
+>>> for result in db.bulk_get( pairs ) :
+...     doc = result['docs'][0].get( 'ok', None )
+
+Insert or update documents in place, merging with their stored version,
+
+>>> db.upsert( docs, merge=lambda dbdoc, doc : dict( dbdoc or {}, **doc ))
+
+Check and delete many documents, without a request per document,
+
+>>> db.exists_many([ 'joe', 'bob' ])
+{'joe': True, 'bob': False}
+>>> db.current_revs([ 'joe', 'bob' ])
+{u'joe': u'1-2f2b6c0ad1b1b5ec6f4ac3fb9da8c3ea'}
+>>> db.delete_many([ 'joe', 'bob' ])
+
 Get / Set security object,
 
 >>> db.security({ "admins" : { "names" : ["joe"] } })
@@ -80,16 +98,36 @@ Get / Set revs_limit
 >>> db.revslimit()
 122
 
+Query documents with Mango selectors, results are fetched lazily in batches,
+
+>>> db.createindex( ['year'] )
+{u'result': u'created', u'id': u'_design/...', u'name': u'...'}
+>>> for doc in db.find({ 'year' : { '$gt' : 2010 }}, sort=['year']) :
+...     print doc['_id'], doc['year']
+>>> db.explain({ 'year' : { '$gt' : 2010 }})['index']
+>>> db.indexes()
+
 """
 
 import re, logging
 from   copy         import deepcopy
 
+try:
+    from threading       import Lock
+except ImportError:
+    from dummy_threading import Lock
+
 import rest
-from   couchpy          import hdr_acceptjs, hdr_ctypejs, BaseIterator
+from   couchpy          import hdr_acceptjs, hdr_ctypejs, BaseIterator, \
+                               CouchPyError
 from   httperror        import *
 from   httpc            import OK, CREATED, ACCEPTED
-from   doc              import Document, LocalDocument, DesignDocument, Query
+from   doc              import Document, LocalDocument, DesignDocument, \
+                               Query, _getdoc, ST_EVENT_FETCH
+from   writebehind      import WriteBehind
+from   replica          import Replica
+from   matview          import MaterializedView
+from   expiry           import ExpirySweeper
 from   couchpy.utils    import JSON
 
 log = logging.getLogger( __name__ )
@@ -197,6 +235,20 @@ def _bulk_docs( conn, docs, atomic=False, paths=[], hthdrs={} ) :
         log.error( 'POST request to /%s failed' % '/'.join(paths) )
         return (None, None, None)
 
+def _bulk_get( conn, docs, paths=[], hthdrs={}, **query ) :
+    """POST /<db>/_bulk_get
+    query,
+        revs=<bool>     attachments=<bool>      latest=<bool>
+    """
+    hthdrs = conn.mixinhdrs( hthdrs, hdr_acceptjs, hdr_ctypejs )
+    body = rest.data2json({ 'docs' : docs })
+    s, h, d = conn.post( paths, hthdrs, body, _query=query.items() )
+    if s == OK :
+        return s, h, d
+    else :
+        log.error( 'POST request to /%s failed' % '/'.join(paths) )
+        return (None, None, None)
+
 def _temp_view( conn, designdoc, paths=[], hthdrs={}, **query ) :
     """POST /<db>/_temp_view
     query,
@@ -309,6 +361,71 @@ def _revs_limit( conn, paths=[], limit=None, hthdrs={} ) :
         log.error( '%s request to /%s failed' % (method, '/'.join(paths)) )
         return (None, None, None)
 
+def _find( conn, query, paths=[], hthdrs={} ) :
+    """POST /<db>/_find
+    query,
+        selector=<object>   fields=<list>       sort=<list>
+        limit=<num>         skip=<num>          bookmark=<string>
+        use_index=<name>    execution_stats=<bool>
+    """
+    hthdrs = conn.mixinhdrs( hthdrs, hdr_acceptjs, hdr_ctypejs )
+    body = rest.data2json( query )
+    s, h, d = conn.post( paths, hthdrs, body )
+    if s == OK :
+        return s, h, d
+    else :
+        log.error( 'POST request to /%s failed' % '/'.join(paths) )
+        return (None, None, None)
+
+def _index( conn, index=None, paths=[], hthdrs={} ) :
+    """
+    GET  /<db>/_index,      if index is None
+    POST /<db>/_index,      to create index
+    """
+    hthdrs = conn.mixinhdrs( hthdrs, hdr_acceptjs, hdr_ctypejs )
+    if index == None :
+        method = 'GET'
+        s, h, d = conn.get( paths, hthdrs, None )
+    else :
+        method = 'POST'
+        body = rest.data2json( index )
+        s, h, d = conn.post( paths, hthdrs, body )
+    if s == OK :
+        return s, h, d
+    else :
+        log.error( '%s request to /%s failed' % (method, '/'.join(paths)) )
+        return (None, None, None)
+
+def _deleteindex( conn, paths=[], hthdrs={} ) :
+    """DELETE /<db>/_index/<design-doc>/<type>/<name>"""
+    hthdrs = conn.mixinhdrs( hthdrs, hdr_acceptjs )
+    s, h, d = conn.delete( paths, hthdrs, None )
+    if s == OK and d['ok'] == True :
+        return s, h, d
+    else :
+        log.error( 'DELETE request to /%s failed' % '/'.join(paths) )
+        return (None, None, None)
+
+
+
+def _unknownendpoint( err, dblevel=False ):
+    """Return True if ``err``, raised for a request to an endpoint like
+    ``_bulk_get`` or ``_dbs_info``, shows that the server does not know the
+    endpoint, as opposed to a bad request. If ``dblevel`` is True, the
+    endpoint is under a database, and a missing database is not taken for a
+    missing endpoint."""
+    error, reason = err.args[0] if err.args and \
+                    isinstance( err.args[0], tuple ) else (None, None)
+    if isinstance( err, ResourceNotAllowed ) :
+        return True
+    elif isinstance( err, ResourceNotFound ) :
+        return not dblevel or \
+               reason not in ( 'no_db_file', 'Database does not exist.' )
+    elif isinstance( err, BadRequest ) :
+        # Servers without the endpoint take it for a document id, or a
+        # database name.
+        return error in ( 'illegal_docid', 'illegal_database_name' )
+    return False
 
 
 class Database( object ):
@@ -324,9 +441,18 @@ class Database( object ):
         for request headers. Aside from these headers, if an instance method
         supports ``hthdrs`` key-word argument, it will override instance-level
         request-headers.
+
+    ``deadline``,
+        Total time in seconds allowed for every request made via this
+        instance, and its documents, overriding client's ``client.deadline``
+        configuration. Refer to :class:`couchpy.httpc.Deadline`.
+
+    Instances created with ``hthdrs`` or ``deadline`` are not shared, other
+    instances of the database and their documents are not affected by them.
+    Deleting the database forgets the shared instance and its documents.
     """
 
-    def __new__( cls, client, dbname, **kwargs ):
+    def __new__( cls, client, dbname, hthdrs={}, deadline=None, **kwargs ):
         """Database factory providing singleton pattern for Database
         objects. Database instance are cached under the client object, and
         every instantiation
@@ -334,18 +460,52 @@ class Database( object ):
         >>> a = Database( 'dbname' )
         >>> b = Database( 'dbname' )
 
-        ``a`` and ``b`` will point to the same object.
+        ``a`` and ``b`` will point to the same object. If ``hthdrs`` or
+        ``deadline`` is specified, a new instance is returned, bound to them,
+        with its own documents.
         """
-        self = client.opendbs.get( dbname, None )
-        if self == None :
-            self = object.__new__( Database )
-            client.opendbs[dbname] = self
+        opendbs = client.opendbs
+        self = opendbs.get( dbname, None )
+        if self is None :
+            client.dblock.acquire()
+            try :
+                self = opendbs.get( dbname, None )
+                if self is None :
+                    self = object.__new__( cls )
+                    self.poollock = Lock()  # Guards document pools
+                    opendbs[dbname] = self
+            finally :
+                client.dblock.release()
+        if hthdrs or deadline is not None :
+            db = object.__new__( cls )
+            db._shared, db.poollock = self, Lock()
+            return db
         return self
 
-    def __init__( self, client, dbname, hthdrs={}, **kwargs ):
+    def __init__( self, client, dbname, hthdrs={}, deadline=None, **kwargs ):
+        # Cached instances are shared, initialize them only once, so that
+        # documents and settings of other users of this database are left
+        # undisturbed.
+        shared = self.__dict__.get( '_shared', self )
+        client.dblock.acquire()
+        try :
+            if not shared.__dict__.get( '_initialized', False ) :
+                shared._initialize( client, dbname )
+        finally :
+            client.dblock.release()
+        if shared is not self :
+            # Instance with its own headers or deadline. Documents carry the
+            # connection and headers of their database, hence not shared.
+            self.__dict__.update( shared.__dict__, poollock=self.poollock )
+            if deadline is not None :
+                self.conn = client.conn( deadline=deadline )
+            self.hthdrs = self.conn.mixinhdrs( shared.hthdrs, hthdrs )
+            self._singleton_docs = { 'active' : {}, 'cache' : {} }
+
+    def _initialize( self, client, dbname ):
         self.client, self.conn = client, client.conn
         self.dbname = Database.validate_dbname( dbname )
-        self.hthdrs = self.conn.mixinhdrs( self.client.hthdrs, hthdrs )
+        self.hthdrs = self.conn.mixinhdrs( self.client.hthdrs, {} )
 
         self.paths = client.paths + [ dbname ]
         self._info = {}
@@ -356,7 +516,10 @@ class Database( object ):
         # instance, all dirty documents will be commited to the server and
         # moved to `cached` list.
         # { <dbname>  : { 'active' : {...}, 'cache' : {...} }
-        self._singleton_docs = { 'active' : {}, 'cache' : {} } 
+        # Pools are mutated only with `poollock` held, so that threads
+        # sharing this instance see consistent pools.
+        self._singleton_docs = { 'active' : {}, 'cache' : {} }
+        self._initialized = True
 
 
     #---- Pythonification of instance methods. They are supposed to be
@@ -563,7 +726,8 @@ class Database( object ):
 
         `docs` contains a list of :class:`couchpy.doc.Document` instances or dictionaries.
         In case of :class:`couchpy.doc.Document` instance, the object instance will be
-        updated with the new `revision` number.
+        updated with the new `revision` number. Documents without `_id` are
+        assigned one by the client's ``uuidgen``, refer :mod:`couchpy.uuids`.
 
         To perform document updates and inserts atomically, pass `atomic`
         keyword as True.
@@ -574,17 +738,177 @@ class Database( object ):
         """
         conn, paths = self.conn, (self.paths + ['_bulk_docs'])
         h = conn.mixinhdrs( self.hthdrs, hthdrs )
+        uuidgen = self.client.uuidgen
         docs_ = []
         for doc in docs :
-            if isinstance(doc, dict) :
+            if isinstance(doc, Document) :
+                doc._autoid()
+                docs_.append( dict( doc.items() ))
+            elif isinstance(doc, dict) :
+                if uuidgen and ('_id' not in doc) :
+                    doc['_id'] = uuidgen.next()
                 docs_.append(doc)
-            elif isinstance(doc, Document) :
-                docs_.append( dict( doc.item() ))
             else :
                 raise CouchPyError( 'bulk docs contains unknown element' )
         s, h, d = _bulk_docs(conn, docs_, atomic=atomic, paths=paths, hthdrs=h)
         return d
 
+    def upsert( self, docs, merge=None, retries=3, hthdrs={} ) :
+        """Insert or update documents ``docs`` in place, whether or not they
+        are already present in the database, with two requests per batch.
+        Current revisions of the documents are looked up with ``_all_docs``
+        requests, like :func:`Database.current_revs`, and all documents are
+        written with a single ``_bulk_docs`` request. Documents that failed
+        with a conflict, because they were updated meanwhile, are looked up
+        and written again, upto ``retries`` times.
+
+        ``docs`` is a list of dictionaries or :class:`couchpy.doc.Document`
+        objects. Their ``_rev`` is ignored. Documents without ``_id`` are
+        assigned one by the client's ``uuidgen``.
+
+        ``merge``,
+            Optional function, ``merge( dbdoc, doc )``, returning the document
+            to write. ``dbdoc`` is the document in the database, None if it is
+            not present or deleted. By default ``doc`` replaces ``dbdoc``.
+
+        Document objects that are written are updated with the document, and
+        revision, as written in the database.
+
+        Return a list of results as returned by ``_bulk_docs``, in the same
+        order as ``docs``.
+
+        ``Admin-prev: No``
+        """
+        conn = self.conn
+        hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
+        uuidgen = self.client.uuidgen
+        pending = []
+        for i, doc in enumerate( docs ) :
+            body = dict( doc.items() ) if isinstance( doc, Document ) \
+                   else dict( doc )
+            body.pop( '_rev', None )
+            if '_id' not in body :
+                if uuidgen is None :
+                    raise CouchPyError( '`_id` to be supplied for upsert' )
+                body['_id'] = uuidgen.next()
+            pending.append( (i, doc, body) )
+
+        results = [ None ] * len( pending )
+        for attempt in range( retries + 1 ) :
+            if not pending :
+                break
+            ids = [ body['_id'] for i, doc, body in pending ]
+            current = self._liverows( ids, include_docs=bool(merge),
+                                      hthdrs=hthdrs )
+            writes = []
+            for i, doc, body in pending :
+                row = current.get( body['_id'], None )
+                rev = row and row['value']['rev']
+                dbdoc = row and row.get( 'doc', None )
+                newdoc = dict( merge( dbdoc, dict( body )) if merge else body )
+                newdoc['_id'] = body['_id']
+                newdoc.pop( '_rev', None )
+                rev and newdoc.update( _rev=rev )
+                writes.append( newdoc )
+            s, h, d = _bulk_docs( conn, writes, hthdrs=hthdrs,
+                                  paths=(self.paths + ['_bulk_docs']) )
+            if d is None :
+                raise CouchPyError( 'upsert failed to write documents' )
+
+            conflicts = []
+            for (i, doc, body), r, newdoc in zip( pending, d, writes ) :
+                results[i] = r
+                if r.get( 'error', None ) == 'conflict' :
+                    conflicts.append( (i, doc, body) )
+                elif 'rev' in r and isinstance( doc, Document ) :
+                    newdoc['_rev'] = r['rev']
+                    doc.invalidate()
+                    doc._x_smach.handle_event( ST_EVENT_FETCH, doc, newdoc )
+            pending = conflicts
+        if pending :
+            log.error( 'upsert gave up on %s conflicting documents' %
+                       len(pending) )
+        return results
+
+    ALL_DOCS_BATCH = 1000
+
+    def exists_many( self, ids, concurrency=None, hthdrs={} ) :
+        """Check whether documents ``ids`` are present in the database, with
+        ``POST /<db>/_all_docs`` requests for ``ALL_DOCS_BATCH`` ids each,
+        instead of a HEAD request per document. Deleted documents are not
+        present. Return a dictionary mapping every id to True or False.
+
+        ``Admin-prev: No``
+        """
+        ids = list( ids )
+        revs = self.current_revs( ids, concurrency=concurrency, hthdrs=hthdrs )
+        return dict([ (_id, _id in revs) for _id in ids ])
+
+    def current_revs( self, ids, concurrency=None, hthdrs={} ) :
+        """Return a dictionary mapping document ids, from ``ids``, to their
+        current revision. Missing and deleted documents are left out. Like
+        :func:`Database.exists_many`, ids are looked up in batches, with at
+        most ``concurrency`` requests in parallel, default is the
+        ``client.concurrency`` configuration parameter.
+
+        ``Admin-prev: No``
+        """
+        rows = self._liverows( ids, concurrency=concurrency, hthdrs=hthdrs )
+        return dict([ (_id, row['value']['rev'])
+                      for _id, row in rows.items() ])
+
+    def delete_many( self, ids, concurrency=None, hthdrs={} ) :
+        """Delete documents ``ids`` with their current revision, looked up
+        using :func:`Database.current_revs`, and deleted using
+        :func:`Database.bulkdelete`, ``ALL_DOCS_BATCH`` documents per request.
+        Documents that are missing are skipped.
+
+        Return a list of results as returned by ``_bulk_docs``, for documents
+        that were present. Documents updated after their revision was looked
+        up fail with a ``conflict`` error.
+
+        ``Admin-prev: No``
+        """
+        ids = list( ids )
+        revs = self.current_revs( ids, concurrency=concurrency, hthdrs=hthdrs )
+        docs = [ { '_id' : _id, '_rev' : revs[_id] } for _id in ids
+                 if _id in revs ]
+        offsets = range( 0, len(docs), self.ALL_DOCS_BATCH )
+        fn = lambda i : self.bulkdelete( docs[ i:i+self.ALL_DOCS_BATCH ],
+                                         hthdrs=hthdrs )
+        results = {}
+        for i, d, err in self.client._parallel( fn, offsets, concurrency ) :
+            if err is not None :
+                raise err
+            elif d is None :
+                raise CouchPyError( 'delete_many failed to delete documents' )
+            results[i] = d
+        return [ r for i in offsets for r in results[i] ]
+
+    def _liverows( self, ids, include_docs=False, concurrency=None,
+                   hthdrs={} ):
+        """Return a dictionary of ``_all_docs`` rows for documents ``ids``
+        that are present, fetched in batches of ``ALL_DOCS_BATCH``."""
+        conn, paths = self.conn, (self.paths + ['_all_docs'])
+        hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
+        q = { 'include_docs' : 'true' } if include_docs else {}
+        ids = list( ids )
+        batches = [ ids[i:i+self.ALL_DOCS_BATCH]
+                    for i in range(0, len(ids), self.ALL_DOCS_BATCH) ]
+        fn = lambda keys : _all_docs( conn, keys=keys, paths=paths,
+                                      hthdrs=hthdrs, q=q )[2]
+        rows = {}
+        for keys, d, err in self.client._parallel( fn, batches, concurrency ):
+            if err is not None :
+                raise err
+            elif d is None :
+                raise CouchPyError( 'POST /%s failed' % '/'.join(paths) )
+            for row in d['rows'] :
+                value = row.get( 'value', None ) or {}
+                if 'error' not in row and not value.get( 'deleted', False ) :
+                    rows[ row['id'] ] = row
+        return rows
+
     def bulkdelete( self, docs=[], atomic=False, hthdrs={} ) :
         """Same as :func:`Database.bulkdocs` except that the `_delete`
         property in each document will be set to True, thus deleting the
@@ -596,6 +920,101 @@ class Database( object ):
         docs_ = [ doc.setdefault( '_deleted', True ) for doc in docs ]
         return self.bulkdocs( docs, atomic=atomic, hthdrs=hthdrs )
 
+    BULK_GET_BATCH = 500
+
+    def bulk_get( self, pairs, revs=False, attachments=False, latest=False,
+                  concurrency=None, hthdrs={} ) :
+        """Fetch many documents, or specific revisions of them, with a
+        handful of requests. ``pairs`` is a list of document ids, ``(id,
+        rev)`` tuples or ``{ 'id' : ..., 'rev' : ... }`` dictionaries. If
+        revision is not specified, the winning revision is fetched.
+
+        If the server supports ``POST /<db>/_bulk_get``, documents are
+        fetched in batches of ``BULK_GET_BATCH`` per request, otherwise a
+        ``GET /<db>/<doc>`` is issued for every pair. Either way, at most
+        ``concurrency`` requests are made in parallel, default is the
+        ``client.concurrency`` configuration parameter.
+
+        ``revs``,
+            If True, include ``_revisions`` in fetched documents.
+        ``attachments``,
+            If True, include attachment data, base64 encoded.
+        ``latest``,
+            If True, fetch the latest leaf revision descending from the
+            requested revision.
+
+        Return a generator yielding, in the order they are fetched, a
+        result for every pair in the same format as that of ``_bulk_get``,
+        ``{ 'id' : <id>, 'docs' : [ { 'ok' : <doc> } ] }``, or
+        ``{ 'id' : <id>, 'docs' : [ { 'error' : { 'id', 'rev', 'error',
+        'reason' } } ] }`` if the document could not be fetched.
+
+        ``Admin-prev: No``
+        """
+        docs = []
+        for pair in pairs :
+            if isinstance( pair, basestring ) :
+                docs.append({ 'id' : pair })
+            elif isinstance( pair, dict ) :
+                docs.append( dict( pair ))
+            else :
+                _id, rev = pair
+                docs.append({ 'id' : _id, 'rev' : rev } if rev else
+                            { 'id' : _id })
+        client, conn = self.client, self.conn
+        hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
+        query = dict([ (k, 'true') for k, v in [ ('revs', revs),
+                       ('attachments', attachments), ('latest', latest) ]
+                       if v ])
+
+        if client._bulk_get_supported != False :
+            paths = self.paths + [ '_bulk_get' ]
+            batches = [ docs[i:i+self.BULK_GET_BATCH]
+                        for i in range(0, len(docs), self.BULK_GET_BATCH) ]
+            fn = lambda batch : _bulk_get( conn, batch, paths, hthdrs=hthdrs,
+                                           **query )[2]
+            try :
+                for batch, d, err in client._parallel( fn, batches,
+                                                       concurrency ) :
+                    if isinstance( err, HTTPError ) and \
+                            not client._bulk_get_supported :
+                        raise err
+                    elif err is not None or d is None :
+                        err = err or CouchPyError( '/_bulk_get failed' )
+                        for doc in batch :
+                            yield self._bulkgeterror( doc, err )
+                        continue
+                    client._bulk_get_supported = True
+                    for result in d['results'] :
+                        yield result
+                return
+            except HTTPError, err :
+                if not _unknownendpoint( err, dblevel=True ) :
+                    raise
+                log.info( '/_bulk_get not supported, fall back to GET '
+                          '/<db>/<doc>' )
+                client._bulk_get_supported = False
+
+        def fetch( doc ) :
+            q = dict( query, rev=doc['rev'] ) if 'rev' in doc else query
+            return _getdoc( conn, self.paths + [ doc['id'] ], hthdrs=hthdrs,
+                            **q )[2]
+        for doc, d, err in client._parallel( fetch, docs, concurrency ) :
+            if err is not None or d is None :
+                yield self._bulkgeterror( doc, err or
+                                          CouchPyError( 'GET failed' ))
+            else :
+                yield { 'id' : doc['id'], 'docs' : [ { 'ok' : d } ] }
+
+    def _bulkgeterror( self, doc, err ):
+        if isinstance( err, HTTPError ) and isinstance( err.args[0], tuple ) :
+            error, reason = err.args[0]
+        else :
+            error, reason = err.__class__.__name__, str(err)
+        error = { 'id' : doc['id'], 'rev' : doc.get( 'rev', 'undefined' ),
+                  'error' : error, 'reason' : reason }
+        return { 'id' : doc['id'], 'docs' : [ { 'error' : error } ] }
+
     def tempview( self, designdoc, hthdrs={}, **query ) :
         """Create (and execute) a temporary view based on the view function
         supplied in the JSON request. This API accepts the same query
@@ -715,6 +1134,127 @@ class Database( object ):
         s, h, d = _all_docs( conn, keys=keys, paths=paths, hthdrs=hthdrs, q=q )
         return d
 
+    def find( self, selector, fields=None, sort=None, limit=None, skip=None,
+              use_index=None, batch=100, hthdrs={}, **options ) :
+        """Query documents using a Mango ``selector``, a JSON object
+        describing the documents to match, like,
+
+        >>> db.find({ 'year' : { '$gt' : 2010 }, 'type' : 'post' })
+
+        Return a generator yielding matching documents, as dictionaries, in
+        the order specified by ``sort``. Results are fetched lazily, ``batch``
+        documents per request, each request resuming from the bookmark
+        returned by the previous one. Servers that do not return a bookmark
+        are paged using ``skip``.
+
+        ``fields``,
+            List of fields to return for each document, dotted field names
+            select nested fields. By default, entire document is returned.
+        ``sort``,
+            List of fields, or ``{ field : 'asc' | 'desc' }`` objects, to sort
+            the results by. Needs an index on the sort fields.
+        ``limit``,
+            Maximum number of documents to yield, None for all matching
+            documents.
+        ``skip``,
+            Skip this number of matching documents.
+        ``use_index``,
+            Design document name, or a list of ``[ design-doc, index-name ]``,
+            of the index to use for the query.
+
+        Other keyword arguments, like ``r``, ``conflicts`` and
+        ``execution_stats`` are passed as it is in the request body. Refer to
+        ``POST /<db>/_find`` section in CouchDB API manual for more
+        information.
+
+        ``Admin-prev: No``
+        """
+        conn, paths = self.conn, (self.paths + ['_find'])
+        hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
+        query = dict( options, selector=selector )
+        fields and query.update( fields=fields )
+        sort and query.update( sort=sort )
+        use_index and query.update( use_index=use_index )
+        skip = skip or 0
+        while limit is None or limit > 0 :
+            size = batch if limit is None else min( batch, limit )
+            query.update( limit=size, skip=skip )
+            s, h, d = _find( conn, query, paths, hthdrs=hthdrs )
+            docs = d['docs'] if d else []
+            for doc in docs :
+                yield doc
+            if len(docs) < size :
+                break
+            limit = None if limit is None else (limit - len(docs))
+            if d.get( 'bookmark', None ) :
+                query['bookmark'], skip = d['bookmark'], 0
+            else :
+                skip += len(docs)
+
+    def explain( self, selector, hthdrs={}, **options ) :
+        """Explain the plan for Mango query ``selector``, with the same
+        keyword arguments as that of :func:`Database.find`. Return JSON
+        converted object as returned by CouchDB API /db/_explain, whose
+        ``index`` key describes the index that will be used for the query.
+
+        ``Admin-prev: No``
+        """
+        conn, paths = self.conn, (self.paths + ['_explain'])
+        hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
+        query = dict([ (k, v) for k, v in options.items() if v is not None ])
+        query.update( selector=selector )
+        s, h, d = _find( conn, query, paths, hthdrs=hthdrs )
+        return d
+
+    def createindex( self, fields, name=None, ddoc=None, type='json',
+                     partial_filter_selector=None, hthdrs={} ) :
+        """Create a Mango index on ``fields``, a list of field names or
+        ``{ field : 'asc' | 'desc' }`` objects. ``name`` and the design
+        document ``ddoc`` holding the index are generated by the server if not
+        specified. Only documents matching ``partial_filter_selector`` are
+        indexed, if it is specified.
+
+        Return JSON converted object as returned by CouchDB API /db/_index,
+        where ``result`` is either ``created`` or ``exists``.
+
+        ``Admin-prev: No``
+        """
+        conn, paths = self.conn, (self.paths + ['_index'])
+        hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
+        index = { 'fields' : fields }
+        if partial_filter_selector :
+            index['partial_filter_selector'] = partial_filter_selector
+        body = { 'index' : index, 'type' : type }
+        name and body.update( name=name )
+        ddoc and body.update( ddoc=ddoc )
+        s, h, d = _index( conn, body, paths, hthdrs=hthdrs )
+        return d
+
+    def indexes( self, hthdrs={} ) :
+        """Return a list of Mango indexes defined for this database,
+        including the special ``_all_docs`` index. Each index is a dictionary
+        of ``ddoc``, ``name``, ``type`` and ``def``.
+
+        ``Admin-prev: No``
+        """
+        conn, paths = self.conn, (self.paths + ['_index'])
+        hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
+        s, h, d = _index( conn, paths=paths, hthdrs=hthdrs )
+        return d['indexes'] if d else None
+
+    def deleteindex( self, ddoc, name, type='json', hthdrs={} ) :
+        """Delete Mango index ``name`` from design document ``ddoc``. Return
+        JSON converted object as returned by CouchDB.
+
+        ``Admin-prev: No``
+        """
+        ddoc = ddoc[8:] if ddoc.startswith( '_design/' ) else ddoc
+        conn = self.conn
+        paths = self.paths + [ '_index', '_design', ddoc, type, name ]
+        hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
+        s, h, d = _deleteindex( conn, paths, hthdrs=hthdrs )
+        return d
+
     def missingrevs( self ) :
         """TBD : To be implemented"""
 
@@ -764,6 +1304,29 @@ class Database( object ):
     def DesignDocument( self, doc, *args, **kwargs ):
         return DesignDocument( self, doc, *args, **kwargs )
 
+    def WriteBehind( self, *args, **kwargs ):
+        """Return a :class:`couchpy.writebehind.WriteBehind` buffer, that
+        queues document writes to this database and flushes them in bulk."""
+        return WriteBehind( self, *args, **kwargs )
+
+    def Replica( self, *args, **kwargs ):
+        """Return a :class:`couchpy.replica.Replica`, a local copy of this
+        database kept in sync by following its changes feed. Call its
+        start() method to begin synchronizing."""
+        return Replica( self, *args, **kwargs )
+
+    def MaterializedView( self, *args, **kwargs ):
+        """Return a :class:`couchpy.matview.MaterializedView`, a view built
+        on the client by running python map and reduce functions over this
+        database's changes feed. Call its start() method to build it."""
+        return MaterializedView( self, *args, **kwargs )
+
+    def ExpirySweeper( self, *args, **kwargs ):
+        """Return a :class:`couchpy.expiry.ExpirySweeper`, that deletes
+        documents of this database whose expiry time has passed. Call its
+        sweep() method, or start() to sweep periodically."""
+        return ExpirySweeper( self, *args, **kwargs )
+
     #---- Properties
 
     _committed_update_seq = lambda self : self()['committed_update_seq']
@@ -823,6 +1386,10 @@ class Database( object ):
         conn, paths = self.conn, self.paths
         hthdrs = conn.mixinhdrs( self.hthdrs, hthdrs )
         s, h, d = _deletedb( conn, paths, hthdrs=hthdrs )
+        # Documents of the deleted database are stale, a database created
+        # again by the same name gets a fresh instance.
+        shared = self.__dict__.get( '_shared', self )
+        self.client.forgetdb( self.dbname, shared )
         return None
 
     def fetch( self ) :
@@ -74,13 +74,21 @@ import logging, base64
 from   os.path      import basename
 from   mimetypes    import guess_type
 
+try:
+    from threading       import Lock
+    from thread          import get_ident
+except ImportError:
+    from dummy_threading import Lock
+    from dummy_thread    import get_ident
+
 import rest
 from   httperror    import *
-from   httpc        import OK, CREATED, ACCEPTED
+from   httpc        import OK, CREATED, ACCEPTED, bodyvalue
 from   couchpy      import CouchPyError, hdr_acceptjs, hdr_ctypejs
 
 # TODO :
 #   1. Batch mode POST / PUT should have a verification system built into it.
+#      Database.WriteBehind() is the verified alternative.
 #   2. Attachments allowed in local documents ???
 
 log = logging.getLogger( __name__ )
@@ -242,9 +250,16 @@ class StateMachine( object ):
     * `_x_hthdrs`, dictionary of http request headers to be used for document
       access.
     * `_x_query`, query params like ``rev``, ``revs``, ``revs_info``.
+
+    Events on a document are handled one at a time, under the state
+    machine's ``lock``. Document pools of the database are mutated under
+    database's ``poollock``, which is always acquired after, and never
+    before, a document's lock.
     """
     def __init__( self, doc ):
         self.doc = doc
+        self.lock = Lock()
+        self.owner = None       # Thread handling an event
 
     def canCreate( self, doc ):
         """A global check that can be used by anyone to figure out whether a
@@ -264,7 +279,16 @@ class StateMachine( object ):
 
     def handle_event( self, event, *args, **kwargs ):
         """Entry point to handle a document event."""
-        return self.events[event]( self, *args, **kwargs )
+        me = get_ident()
+        if self.owner == me :   # Nested event, like fetch on side effect
+            return self.events[event]( self, *args, **kwargs )
+        self.lock.acquire()
+        self.owner = me
+        try :
+            return self.events[event]( self, *args, **kwargs )
+        finally :
+            self.owner = None
+            self.lock.release()
 
     # Event handlers
 
@@ -280,17 +304,25 @@ class StateMachine( object ):
         * Can there be a situation where document state is uninitialized and
           document _id not available ?
         """
-        doc, singleton = self.doc, args[0].singleton_docs
+        db, doc = args[0], self.doc
+        singleton = db.singleton_docs
         _x_state = getattr( doc, '_x_state', None )
         _id = args[1] if isinstance(args[1], basestring) else args[1].get('_id', None)
 
         if _x_state == None :   # Fresh document
             doc._x_init, newstate = True, ST_ACTIVE_POST
-            singleton['active'].setdefault( _id, doc ) if _id else None
+            if _id :
+                db.poollock.acquire()
+                try     : singleton['active'].setdefault( _id, doc )
+                finally : db.poollock.release()
 
         if _id :
             if _x_state == ST_CACHE_INVALID :       # `cache` to `active`
-                singleton['active'][_id] = singleton['cache'].pop(_id)
+                db.poollock.acquire()
+                try :
+                    singleton['active'][_id] = singleton['cache'].pop(_id)
+                finally :
+                    db.poollock.release()
                 doc._x_reinit = True
             elif _x_state in [ ST_ACTIVE_INVALID, ST_ACTIVE_VALID ] :
                 doc._x_reinit = True                # Repeated intantiation
@@ -356,7 +388,10 @@ class StateMachine( object ):
                 newstate = ST_ACTIVE_VALID
             else :      # If post is done in batch mode
                 newstate = ST_ACTIVE_INVALID
-            doc._x_db.singleton_docs['active'][doc._id] = doc
+            db = doc._x_db
+            db.poollock.acquire()
+            try     : db.singleton_docs['active'][doc._id] = doc
+            finally : db.poollock.release()
         else :
             raise Exception( 'Document might be instantiated with `_rev` field' )
         doc._x_state = newstate
@@ -390,7 +425,11 @@ class StateMachine( object ):
         db = doc._x_db
         if _x_state in [ ST_ACTIVE_VALID, ST_ACTIVE_INVALID, ST_ACTIVE_POST ] :
             doc.update( _rev=d['rev'], _x_dirty=False ) if 'rev' in d else None
-            db.singleton_docs['active'].pop(doc._id) # Neiher active nor cached
+            db.poollock.acquire()
+            try : # Neiher active nor cached
+                db.singleton_docs['active'].pop( doc._id, None )
+            finally :
+                db.poollock.release()
         else :
             raise Exception( 'Document cannot be deleted' )
         doc._x_state = ST_ACTIVE_INVALID
@@ -531,8 +570,6 @@ class Document( dict ) :
         document instance will be added to the 'active' list after a
         :func:`Document.post` method is called.
         """
-        activedocs = db.singleton_docs['active']
-        cacheddocs = db.singleton_docs['cache']
         #----
         _id = doc if isinstance(doc, basestring) else doc.get('_id', None)
 
@@ -542,13 +579,23 @@ class Document( dict ) :
             ImmutableDocument.__init__( self, db, doc, **kwargs )
             return self
 
-        if _id and _id in activedocs :      # Document is active
-            self = activedocs[_id]
-        elif _id and _id in cacheddocs :    # Document is cached
-            self = cacheddocs[_id]
-        else :                              # Make new instance 
-            self = dict.__new__( cls )   
-            self._x_smach = StateMachine( self )
+        # Look-up and creation are atomic, so that threads instantiating the
+        # same `_id` get the same object. State machine takes the document's
+        # lock, which must not be acquired with `poollock` held.
+        db.poollock.acquire()
+        try :
+            self = None
+            singleton = db.singleton_docs
+            activedocs, cacheddocs = singleton['active'], singleton['cache']
+            if _id :
+                self = activedocs.get( _id, None )
+                self = cacheddocs.get( _id, None ) if self is None else self
+            if self is None :               # Make new instance
+                self = dict.__new__( cls )
+                self._x_smach = StateMachine( self )
+                if _id : activedocs[_id] = self
+        finally :
+            db.poollock.release()
 
         # State machine
         self._x_smach.handle_event( ST_EVENT_INSTAN, db, doc, **kwargs )
@@ -595,6 +642,16 @@ class Document( dict ) :
     def isDirty( self ):
         return self._x_smach.isDirty()
 
+    def _autoid( self ):
+        """Assign an ``_id`` generated by the client's ``uuidgen``, if this
+        document does not have one. Return the document ``_id``."""
+        _id, uuidgen = self.get( '_id', None ), self._x_db.client.uuidgen
+        if _id is None and uuidgen is not None :
+            _id = uuidgen.next()
+            self.update( _id=_id, _x_dirty=False )
+            self._x_paths.append( _id )
+        return _id
+
     #---- Dictionary methods that create side-effects
 
     def __getattr__( self, name ) :
@@ -748,8 +805,9 @@ class Document( dict ) :
         """POST method on this document. To create or insert a new document into
         the database, create an instance of :class:`Document`
         without specifying the `_rev` field and call this `post` method on the
-        instance. If `_id` is not provided, CouchDB will auto generate an id
-        value for the document and updated into this dictionary as well.
+        instance. If `_id` is not provided, it is generated by the client's
+        ``uuidgen`` (refer :mod:`couchpy.uuids`), or by CouchDB if client side
+        generation is disabled, and updated into this dictionary as well.
         New documents are not created until a call is made to this method.
 
         Optional keyword parameters,
@@ -771,6 +829,7 @@ class Document( dict ) :
         if self._x_smach.canCreate( self ) == False :
             raise Exception( 'post() not allowed !!' )
 
+        self._autoid()
         conn, paths = self._x_conn, self._x_paths
         # Prune away the document ID from url path. POST will crib on that.
         if paths and ( paths[-1] == self.get('_id', None) ) :
@@ -1032,7 +1091,7 @@ class Attachment( object ) :
         s, h, d = _getattach( conn, paths, hthdrs=hthdrs )
         if s != None :
             self.content_type = h.get( 'Content-Type', None )
-            self.data = d.read()
+            self.data = bodyvalue( d )     # Closes a spooled body
             self.doc._x_smach.handle_event( ST_EVENT_AGET, self.doc )
         return self
 
@@ -1484,9 +1543,9 @@ def _viewsgn( conn, keys=None, paths=[], hthdrs={}, q={} ) :
     hthdrs = conn.mixinhdrs( hthdrs, hdr_acceptjs, hdr_ctypejs )
     if keys :
         body = rest.data2json({ 'keys' : keys })
-        s, h, d = conn.post( paths, hthdrs, body, _query=q_.items() )
+        s, h, d = conn.post( paths, hthdrs, body, _query=q.items() )
     else :
-        s, h, d = conn.get( paths, hthdrs, None, _query=q_.items() )
+        s, h, d = conn.get( paths, hthdrs, None, _query=q.items() )
 
     if s == OK :
         return s, h, d
@@ -0,0 +1,243 @@
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+"""Time-to-live expiry of documents. Databases used as session or cache
+stores accumulate expired documents, which bloat ``_all_docs`` and views.
+An :class:`ExpirySweeper` deploys a view keyed by the expiry time of
+documents, and periodically deletes documents whose expiry time has passed,
+in batches, using :func:`couchpy.database.Database.bulkdelete`. Optionally,
+deleted documents are also purged with
+:func:`couchpy.database.Database.purge`, so that their tombstones do not
+accumulate either.
+
+Expiry time is a number, seconds since epoch like ``time.time()``, in the
+document field ``field``, default ``expires``. Documents without it never
+expire.
+
+>>> db.Document({ '_id' : sid, 'user' : 'joe',
+...               'expires' : time.time() + 3600 }).post()
+>>> sweeper = ExpirySweeper( db, rate=200, interval=60 ).start()
+>>> sweeper.report()
+{ 'deleted' : 5210, 'purged' : 0, 'failed' : 2, 'batches' : 53,
+  'sweeps' : 12, 'backlog' : 40, 'lag' : 31.2, 'elapsed' : 9.6 }
+>>> sweeper.stop()
+
+Sweeps are throttled, so that they never starve foreground traffic. No more
+than ``rate`` documents are deleted per second, and after every batch the
+sweeper sleeps long enough to keep its share of time, ``duty``, spent in
+requests to the server.
+"""
+
+import time, logging
+
+try:
+    from threading       import Thread, Lock, Event
+except ImportError:
+    from dummy_threading import Thread, Lock, Event
+
+from   couchpy          import CouchPyError
+from   couchpy.utils    import JSON
+
+log = logging.getLogger( __name__ )
+json = JSON()
+
+VIEWSOURCE = {
+    'javascript' : "function( doc ) {\n"
+                   "  if( typeof doc[%(field)s] == 'number' ) {\n"
+                   "    emit( doc[%(field)s], doc._rev );\n"
+                   "  }\n"
+                   "}",
+    'python'     : "def fun( doc ):\n"
+                   "    value = doc.get( %(field)s )\n"
+                   "    if isinstance( value, (int, long, float) ) and \\\n"
+                   "            not isinstance( value, bool ) :\n"
+                   "        emit( value, doc['_rev'] )\n",
+}
+"""Source of the expiry view, for design document languages."""
+
+
+class ExpirySweeper( object ):
+    """Delete expired documents from database ``db``.
+
+    ``field``,
+        Document field holding the expiry time.
+    ``language``,
+        Language of the expiry view, ``javascript`` or ``python``.
+    ``batch``,
+        Number of expired documents deleted per ``_bulk_docs`` request.
+    ``rate``,
+        Maximum number of documents deleted per second, None for no limit.
+    ``duty``,
+        Maximum fraction of time spent sweeping, between 0 and 1.
+    ``interval``,
+        Seconds between sweeps, when sweeping in the background.
+    ``purge``,
+        If True, purge documents after deleting them.
+    """
+
+    DDOC = '_design/expiry'
+
+    def __init__( self, db, field='expires', language='javascript',
+                  batch=100, rate=500, duty=0.5, interval=60.0, purge=False ):
+        self.db, self.field, self.language = db, field, language
+        self.batch, self.rate, self.duty = batch, rate, duty
+        self.interval, self.purge = interval, purge
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = None
+        self.deployed = False
+        self.stats = dict([ (k, 0) for k in
+                            ( 'deleted', 'purged', 'failed', 'batches',
+                              'sweeps' ) ])
+        self.stats.update( elapsed=0.0, backlog=None, lag=None )
+
+    def _count( self, **kwargs ):
+        self.lock.acquire()
+        try :
+            [ self.stats.__setitem__( k, self.stats[k] + v )
+              for k, v in kwargs.items() ]
+        finally :
+            self.lock.release()
+
+    def report( self ):
+        """Return a dictionary of metrics. ``deleted``, ``purged`` and
+        ``failed`` documents, ``batches`` and ``sweeps`` done, ``elapsed``,
+        seconds spent in requests, and as of the last sweep, ``backlog``,
+        number of expired documents, and ``lag``, seconds since the oldest
+        of them expired."""
+        self.lock.acquire()
+        try :
+            return dict( self.stats )
+        finally :
+            self.lock.release()
+
+    #---- View
+
+    def deploy( self ):
+        """Create or update design document ``_design/expiry`` with a view,
+        named after ``field``, emitting the expiry time of documents with
+        their revision. The view is reduced with ``_count``, so that the
+        backlog can be counted. Return True if the design document was
+        written."""
+        view = { 'map' : VIEWSOURCE[ self.language ] % {
+                            'field' : json.encode( self.field ) },
+                 'reduce' : '_count' }
+        self.deployed = True
+        if not self.db.current_revs([ self.DDOC ]) :
+            self.db.DesignDocument({
+                '_id' : self.DDOC, 'language' : self.language,
+                'views' : { self.field : view }
+            }).post()
+            return True
+        ddoc = self.db.DesignDocument( self.DDOC ).fetch()
+        views = ddoc.get( 'views', {} )
+        if views.get( self.field, None ) == view and \
+                ddoc.get( 'language', 'javascript' ) == self.language :
+            return False
+        ddoc['language'] = self.language
+        ddoc['views'] = dict( views, **{ self.field : view })
+        ddoc.put()
+        return True
+
+    def view( self ):
+        """Return :class:`couchpy.doc.View` for the expiry view, deploying
+        it if this sweeper has not done so yet."""
+        self.deployed or self.deploy()
+        ddoc = self.db.DesignDocument( self.DDOC ).fetch()
+        return ddoc.views()[ self.field ]
+
+    def backlog( self, now=None ):
+        """Return the number of documents expired as of ``now``, default is
+        current time, and the number of seconds since the oldest of them
+        expired, None if there are none."""
+        now = time.time() if now is None else now
+        view = self.view()
+        rows = view.fetch( endkey=json.encode( now ), reduce='true' )['rows']
+        count = rows[0]['value'] if rows else 0
+        rows = view.fetch( endkey=json.encode( now ), reduce='false',
+                           limit=1 )['rows']
+        lag = (now - rows[0]['key']) if rows else None
+        self.lock.acquire()
+        try :
+            self.stats.update( backlog=count, lag=lag )
+        finally :
+            self.lock.release()
+        return count, lag
+
+    #---- Sweep
+
+    def sweep( self, now=None ):
+        """Delete documents expired as of ``now``, default is current time,
+        in throttled batches. Return the number of documents deleted."""
+        now = time.time() if now is None else now
+        view, deleted = self.view(), 0
+        q = { 'endkey' : json.encode( now ), 'reduce' : 'false',
+              'limit' : self.batch }
+        while not self.stopped.isSet() :
+            st = time.time()
+            rows = view.fetch( **q )['rows']
+            if not rows :
+                break
+            docs = [ { '_id' : r['id'], '_rev' : r['value'] } for r in rows ]
+            d = self.db.bulkdelete( docs )
+            if d is None :
+                raise CouchPyError( 'Deleting expired documents failed' )
+            ok = [ { '_id' : r['id'], '_rev' : r['rev'] }
+                   for r in d if 'rev' in r and 'error' not in r ]
+            done, purged = set([ doc['_id'] for doc in ok ]), 0
+            if self.purge and ok :
+                d = self.db.purge( ok ) or {}
+                purged = sum( map( len, d.get( 'purged', {} ).values() ))
+            deleted += len( ok )
+            self._count( deleted=len( ok ), failed=len( rows ) - len( ok ),
+                         purged=purged, batches=1,
+                         elapsed=time.time() - st )
+            if len( rows ) < self.batch :
+                break
+            # Resume after the last row. Deleted documents leave the view,
+            # a document that failed to be deleted is skipped.
+            last = rows[-1]
+            q.update( startkey=json.encode( last['key'] ),
+                      startkey_docid=last['id'],
+                      skip=int( last['id'] not in done ))
+            self.throttle( len( rows ), time.time() - st )
+        self._count( sweeps=1 )
+        return deleted
+
+    def throttle( self, count, elapsed ):
+        """Sleep after a batch of ``count`` documents, that took ``elapsed``
+        seconds, to honour ``rate`` and ``duty``."""
+        wait = (float( count ) / self.rate - elapsed) if self.rate else 0
+        if 0 < self.duty < 1 :
+            wait = max( wait, elapsed * (1 - self.duty) / self.duty )
+        wait > 0 and self.stopped.wait( wait )
+
+    #---- Background
+
+    def start( self ):
+        """Sweep every ``interval`` seconds in a background thread. Return
+        self."""
+        self.stopped.clear()
+        self.thread = Thread( target=self._run )
+        self.thread.setDaemon( True )
+        self.thread.start()
+        return self
+
+    def stop( self ):
+        """Stop the background thread, after the batch being deleted."""
+        self.stopped.set()
+        self.thread and self.thread.join()
+        self.thread = None
+
+    def _run( self ):
+        while not self.stopped.isSet() :
+            try :
+                self.backlog()
+                self.sweep()
+            except Exception, e :
+                log.error( 'Sweeping expired documents in %r failed, %s' % (
+                           self.db.dbname, e ))
+            self.stopped.wait( self.interval )
@@ -7,11 +7,12 @@
 
 """HTTP client wrapper around stdlib's ``httplib`` module."""
 
-import sys, socket, time, errno, logging
+import sys, socket, time, errno, logging, tempfile, mmap
 from   urlparse         import urlsplit, urlunsplit
 from   base64           import b64encode
 from   datetime         import datetime
-from   httplib          import BadStatusLine, HTTPConnection, HTTPSConnection
+from   httplib          import BadStatusLine, HTTPConnection, HTTPSConnection, \
+                               IncompleteRead
 
 from   couchpy.utils    import JSON
 
@@ -21,15 +22,18 @@ except ImportError:
     from StringIO       import StringIO
 
 try:
-    from threading       import Lock
+    from threading       import Lock, Event, local
 except ImportError:
-    from dummy_threading import Lock
+    from dummy_threading import Lock, Event, local
 
 from   httperror import *
 
 log = logging.getLogger( __name__ )
+json = JSON()
 
 CHUNK_SIZE = 1024 * 8
+BUFFER_SIZE = 1024 * 64     # Read buffer for streamed response bodies
+TIMER_SLACK = 0.01          # Socket timeouts may fire marginally early
 CACHE_SIZE = 10, 75         # some random values to limit memory use
 
 RETRYABLE_ERRORS = frozenset([
@@ -62,27 +66,169 @@ REQ_RANGE_NOT_SATISFIABLE = 416
 EXPECTATION_FAILED        = 417
 INTERNAL_SERVER_ERROR           = 500
 
+# Deadline of the request being made by the current thread, as an absolute
+# time, set by :class:`Deadline`.
+_deadlines = local()
+
+def getdeadline():
+    """Return the deadline, in seconds since epoch, for requests made by
+    the current thread, or None if there is no deadline."""
+    return getattr( _deadlines, 'expiry', None )
+
+def remaining( timeout=None ):
+    """Return the lower of ``timeout`` and the seconds left before the
+    current thread's deadline, or ``timeout`` if there is no deadline.
+    Raise :class:`couchpy.httperror.DeadlineExceeded` if the deadline has
+    passed."""
+    expiry = getdeadline()
+    if expiry is None :
+        return timeout
+    left = expiry - time.time()
+    if left <= 0 :
+        raise DeadlineExceeded( 'Request deadline exceeded' )
+    return left if timeout is None else min( timeout, left )
+
+class Deadline( object ) :
+    """Bound the total time taken by requests made by the current thread,
+    including redirects and retries, to ``seconds``. A request that has not
+    completed by then raises :class:`couchpy.httperror.DeadlineExceeded`.
+    Deadlines can be nested, but an inner deadline cannot extend the outer
+    one.
+
+    >>> dl = Deadline( 2.0 ).start()
+    >>> try :
+    ...     doc = db.Document( 'joe' ).fetch()
+    ... finally :
+    ...     dl.stop()
+
+    or, from python 2.6 onwards,
+
+    >>> with Deadline( 2.0 ) :
+    ...     doc = db.Document( 'joe' ).fetch()
+    """
+
+    def __init__( self, seconds ):
+        self.seconds = seconds
+        self.outer = None
+
+    def start( self ):
+        self.outer = getdeadline()
+        expiry = time.time() + self.seconds
+        if self.outer is not None :
+            expiry = min( expiry, self.outer )
+        _deadlines.expiry = expiry
+        return self
+
+    def stop( self ):
+        _deadlines.expiry = self.outer
+
+    def __enter__( self ):
+        return self.start()
+
+    def __exit__( self, *args ):
+        self.stop()
+
 def cache_sort(i):
     d = i[1][1]['Date'][5:-4]
     t = time.mktime(time.strptime(d, '%d %b %Y %H:%M:%S'))
     return datetime.fromtimestamp(t)
 
+class SingleFlight( object ) :
+    """Coalesce concurrent calls for the same ``key`` into one in-flight
+    call. The first caller (leader) makes the call, callers arriving while it
+    is in flight (followers) wait for it and share its outcome, either the
+    result or the exception. Since all callers receive the same result,
+    ``copy`` function is applied on the result for every caller whenever
+    there are followers, so that one caller cannot modify the result seen by
+    others."""
+
+    def __init__( self, copy ):
+        self.copy = copy
+        self.lock = Lock()
+        self.calls = {}         # key -> in-flight call
+        self.leaders = 0        # Calls made
+        self.coalesced = 0      # Calls avoided
+
+    def do( self, key, fn ):
+        self.lock.acquire()
+        try :
+            call = self.calls.get( key, None )
+            leader = call is None
+            if leader :
+                call = self.calls[key] = Dummy()
+                call.event, call.followers = Event(), 0
+                call.result = call.exc_info = None
+                self.leaders += 1
+            else :
+                call.followers += 1
+                self.coalesced += 1
+        finally :
+            self.lock.release()
+
+        if leader :
+            try :
+                call.result = fn()
+            except :
+                call.exc_info = sys.exc_info()
+            self.lock.acquire()
+            try :
+                self.calls.pop( key )
+            finally :
+                self.lock.release()
+            call.event.set()
+        else :
+            # Followers are bound by their own deadline, not the leader's.
+            timeout = remaining()
+            call.event.wait( timeout )
+            if not call.event.isSet() :
+                raise DeadlineExceeded( 'Request deadline exceeded' )
+
+        if call.exc_info :
+            raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+        return self.copy( call.result ) if call.followers else call.result
+
+    def stats( self ):
+        """Return a dictionary of ``leaders``, number of calls made,
+        ``coalesced``, number of calls that shared an in-flight call, and
+        ``inflight``, number of calls currently in flight."""
+        return { 'leaders' : self.leaders, 'coalesced' : self.coalesced,
+                 'inflight' : len(self.calls) }
+
+
 class HttpSession( object ) :
 
     _allowed_methods = ( 'GET', 'HEAD', 'PUT', 'POST', 'DELETE', 'COPY' )
 
     def __init__( self, cache=None, timeout=None, max_redirects=5,
                   retry_delays=[0], retryable_errors=RETRYABLE_ERRORS,
-                  user_agent='couchpy' ) :
+                  user_agent='couchpy', coalesce=False, connect_timeout=None,
+                  deadline=None, spool_threshold=None ) :
         """Initialize an HTTP client session.
 
         cache
             an instance with a dict-like interface or None to allow
             HttpSession to create a dict for caching.
         timeout
-            socket timeout in number of seconds, or `None` for no timeout
+            socket timeout in number of seconds, or `None` for no timeout,
+            while waiting for a response.
+        connect_timeout
+            socket timeout in number of seconds while connecting to the
+            server. If `None`, ``timeout`` is used.
+        deadline
+            total time in seconds allowed for a request, including
+            redirects and retries, or `None` for no deadline. Refer to
+            :class:`Deadline`.
+        spool_threshold
+            size in bytes above which response bodies, that are not
+            consumed line by line via ``chunk_cb``, are spooled to a
+            temporary file and returned as :class:`SpooledBody`. If `None`,
+            large bodies are streamed from the connection.
         retry_delays
             list of request retry delays.
+        coalesce
+            if True, concurrent identical GET requests made via
+            :class:`couchpy.rest.ReSTful` share a single request to the
+            server. Refer to :class:`SingleFlight`.
         """
         from couchpy   import __version__ as VERSION
 
@@ -90,6 +236,9 @@ class HttpSession( object ) :
         self.user_agent = '%s-%s' % (user_agent, VERSION)
         self.cache = cache or {}
         self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.deadline = deadline
+        self.spool_threshold = spool_threshold
         self.max_redirects = max_redirects
         self.retry_delays = list(retry_delays) # We don't want this changing.
         self.retryable_errors = set(retryable_errors)
@@ -97,10 +246,32 @@ class HttpSession( object ) :
         # Initialize object-attributes
         self.perm_redirects = {}
         self.conns = {} # HTTP connections keyed by (scheme, host)
+        self.authhdrs = {} # Basic authorization header keyed by credentials
         self.lock = Lock()
+        self.singleflight = None
+        if coalesce :
+            from couchpy.rest import copyresponse
+            self.singleflight = SingleFlight( copyresponse )
 
     def request( self, method, url, body=None, headers=None, credentials=None,
                  num_redirects=0, chunk_cb=None ) :
+        """Handle a request, within the session's ``deadline``, if any,
+        or the current thread's :class:`Deadline`, whichever is earlier.
+        Refer to :func:`HttpSession._request` for arguments."""
+        dl = Deadline( self.deadline ).start() if self.deadline else None
+        try :
+            return self._request( method, url, body, headers, credentials,
+                                  num_redirects, chunk_cb )
+        except socket.timeout :
+            expiry = getdeadline()
+            if expiry is not None and time.time() >= expiry - TIMER_SLACK :
+                raise DeadlineExceeded( 'Request deadline exceeded' )
+            raise
+        finally :
+            dl and dl.stop()
+
+    def _request( self, method, url, body=None, headers=None, credentials=None,
+                  num_redirects=0, chunk_cb=None ) :
         """Handle a request
         :method ::
             HTTP method, GET, PUT, POST, DELETE, ALL
@@ -122,7 +293,6 @@ class HttpSession( object ) :
         headers = headers or {}
         basicauth = self.basicauth( credentials ) if credentials else None
         retries = iter(self.retry_delays)
-        json    = JSON()
 
         if method not in self._allowed_methods :
             raise HTTPError( 'Method ``%s`` not allowed' % method )
@@ -174,14 +344,18 @@ class HttpSession( object ) :
         # and instead return a minimal file-like object
         else :
             close_cb = lambda: self.release_connection(url, conn)
-            data = ResponseBody( resp, close_cb, chunk_cb=chunk_cb )
+            data = ResponseBody( resp, close_cb, chunk_cb=chunk_cb,
+                                 expiry=getdeadline() )
             streamed = True
+            if self.spool_threshold is not None and chunk_cb is None :
+                data = spool( data.iterchunks(), self.spool_threshold )
+                streamed = isinstance( data, SpooledBody )
 
         # Handle errors
         if status >= BAD_REQUEST :  # 400
             ctype = resp.getheader('content-type')
             if data is not None and 'application/json' in ctype:
-                data = json.decode( data )
+                data = json.decode( bodyvalue( data ))
                 error = data.get('error'), data.get('reason')
             elif method != 'HEAD':
                 error = resp.read()
@@ -209,31 +383,54 @@ class HttpSession( object ) :
         ls = sorted(self.cache.iteritems(), key=cache_sort)
         self.cache = dict(ls[-CACHE_SIZE[0]:])
 
-    def sendchunks( conn, body ) :
+    def sendchunks( self, conn, body ) :
         while True :
             chunk = body.read(CHUNK_SIZE)
             if not chunk: break
             conn.send( ('%x\r\n' % len(chunk)) + chunk + '\r\n' )
         conn.send( '0\r\n\r\n' )
 
+    def settimeout( self, conn ) :
+        """Set connect and read timeouts on ``conn`` for the next request,
+        bounded by the current thread's deadline, and connect if ``conn`` is
+        closed."""
+        connect_timeout = remaining( self.connect_timeout or self.timeout )
+        if conn.sock is None :
+            conn.timeout = socket._GLOBAL_DEFAULT_TIMEOUT \
+                           if connect_timeout is None else connect_timeout
+            conn.connect()
+        # Pooled connections may carry the timeout of an earlier deadline.
+        timeout = remaining( self.timeout )
+        conn.sock.settimeout(
+            socket.getdefaulttimeout() if timeout is None else timeout )
+
     def try_request( self, conn, method, url, headers={}, body=None ) :
         path_query = urlunsplit(('', '') + urlsplit(url)[2:4] + ('',))
         try:
+            self.settimeout( conn )
             conn.putrequest( method, path_query, skip_accept_encoding=True )
             [ conn.putheader(f, val) for f, val in headers.iteritems() ]
-            conn.endheaders()
             if isinstance(body, basestring):
-                conn.send( body )
-            elif body is not None : # assume a file-like object and ...
-                self.sendchunks(conn, body)
+                # Send headers and body in one segment, so that small
+                # requests are not delayed by Nagle's algorithm.
+                try :
+                    conn.endheaders( body )
+                except TypeError :  # Python 2.6 and older
+                    conn.endheaders()
+                    conn.send( body )
+            else :
+                conn.endheaders()
+                if body is not None : # assume a file-like object and ...
+                    self.sendchunks(conn, body)
             return conn.getresponse()
 
         except BadStatusLine, e:
             # httplib raises a BadStatusLine when it cannot read the status
             # line saying, "Presumably, the server closed the connection
             # before sending a valid response."
-            # Raise as ECONNRESET to simplify retry logic.
-            if e.line == '' or e.line == "''":
+            # Raise as ECONNRESET to simplify retry logic. Python 2.7.4+
+            # reports the empty status line with an explanatory message.
+            if e.line in ('', "''") or 'closed the connection' in e.line:
                 raise socket.error(errno.ECONNRESET)
             else:
                 raise
@@ -251,6 +448,9 @@ class HttpSession( object ) :
                     delay = retries.next()
                 except StopIteration: # No more retries
                     raise e
+                left = remaining()
+                if left is not None and delay >= left :
+                    raise DeadlineExceeded( 'Request deadline exceeded' )
                 time.sleep( delay )
                 conn.close()
 
@@ -265,15 +465,16 @@ class HttpSession( object ) :
 
         # JSON body
         if body and (not isinstance( body, basestring ) ) :
-            json = JSON()
             try : body = json.encode( body )
             except TypeError : pass
             headers.setdefault('Content-Type', 'application/json')
         # Content-length, Transfer-Encoding
-        headers.setdefault( 'Content-Length', '0' ) if body is None else None
-        headers.setdefault( 'Content-Length', str(len(body)) 
-        ) if isinstance( body, basestring
-        ) else headers.update({ 'Transfer-Encoding' : 'chunked' })
+        if body is None :
+            headers.setdefault( 'Content-Length', '0' )
+        elif isinstance( body, basestring ) :
+            headers.setdefault( 'Content-Length', str(len(body)) )
+        else :
+            headers.update({ 'Transfer-Encoding' : 'chunked' })
         # Basc-Authorization
         headers.update({ 'Authorization': basicauth }) if basicauth else None
 
@@ -281,7 +482,12 @@ class HttpSession( object ) :
 
 
     def basicauth( self, creds ) :
-        return 'Basic %s' % b64encode('%s:%s' % creds) if creds else ''
+        if not creds :
+            return ''
+        auth = self.authhdrs.get( creds, None )
+        if auth is None :
+            auth = self.authhdrs[creds] = 'Basic %s' % b64encode('%s:%s' % creds)
+        return auth
 
 
     httpconncls = {
@@ -292,7 +498,14 @@ class HttpSession( object ) :
         if scheme not in self.httpconncls.keys() :
             raise ValueError( '%s is not a supported scheme' % scheme )
         cls = self.httpconncls.get( scheme )
-        conn = cls( host )
+        timeout = remaining( self.connect_timeout or self.timeout )
+        if timeout is None :
+            conn = cls( host )
+        else :
+            try :
+                conn = cls( host, timeout=timeout )
+            except TypeError :  # Python 2.5 and older
+                conn = cls( host )
         conn.connect()
         return conn
 
@@ -346,21 +559,33 @@ class HttpSession( object ) :
                 self.perm_redirects[url] = location
             elif status == SEE_OTHER :
                 method = 'GET'
-            return self.request( method, location, body, headers,
-                                 num_redirects=num_redirects + 1 )
+            return self._request( method, location, body, headers,
+                                  num_redirects=num_redirects + 1 )
         else :
             return None
 
 
 class ResponseBody( object ) :
 
-    def __init__( self, resp, close_cb, chunk_cb=None ) :
+    def __init__( self, resp, close_cb, chunk_cb=None, expiry=None ) :
         self.resp = resp
         self.close_cb = close_cb
         self.chunk_cb = chunk_cb
+        # Body is read after the request returns, but socket timeout is
+        # still bounded by the request's deadline.
+        self.expiry = expiry
+
+    def timedout( self ) :
+        if self.expiry is not None and \
+           time.time() >= self.expiry - TIMER_SLACK :
+            raise DeadlineExceeded( 'Request deadline exceeded' )
 
     def read( self, size=None ) :
-        content = self.resp.read(size)
+        try :
+            content = self.resp.read(size)
+        except socket.timeout :
+            self.timedout()
+            raise
         self.close() if (size is None) or (len(content)<size) else None
         return content
 
@@ -371,26 +596,212 @@ class ResponseBody( object ) :
     def getvalue( self ) :
         if self.chunk_cb and \
            (self.resp.msg.get('transfer-encoding') == 'chunked') :
-            [ self.chunk_cb(l) for l in self ]
+            try :
+                [ self.chunk_cb(l) for l in self ]
+            except socket.timeout :
+                self.timedout()
+                raise
             content = ''
         else :
-            content = self.resp.read()
-            self.close()
+            content = self.read()
         return content
 
-    def __iter__( self ) :
-        assert self.resp.msg.get('transfer-encoding') == 'chunked'
+    def iterchunks( self ) :
+        """Iterate over the response body as blocks of bytes, as they are
+        received. For chunked responses, blocks are not aligned with
+        chunks."""
+        if self.resp.msg.get('transfer-encoding') == 'chunked' :
+            for block in ChunkedReader( self.resp.fp ).iterchunks() :
+                yield block
+            self.resp.close()
+            self.close_cb()
+        else :
+            while True :
+                block = self.read( BUFFER_SIZE )
+                if not block : break
+                yield block
+
+    def iterlines( self ) :
+        """Iterate over lines in the response body, without line
+        terminators. Lines split across blocks, or chunks, are joined."""
+        return iterlines( self.iterchunks() )
+
+    __iter__ = iterlines
+
+
+class ChunkedReader( object ) :
+    """Decoder for response body sent with chunked transfer-encoding.
+    Socket data is received in large blocks into a reusable buffer, instead
+    of reading chunk sizes one byte at a time with ``readline()``, which is
+    what unbuffered response files do.
+
+    ``fp``,
+        Response file, usually ``HTTPResponse.fp``. If it wraps a socket,
+        data is received directly into the buffer, otherwise it is read
+        line by line from ``fp``.
+    """
+
+    def __init__( self, fp, bufsize=BUFFER_SIZE ) :
+        self.fp = fp
+        self.buf = bytearray( bufsize )
+        self.start = self.end = 0   # Unconsumed bytes are buf[start:end]
+        sock = getattr( fp, '_sock', None )
+        self.recv_into = getattr( sock, 'recv_into', None )
+        rbuf = getattr( fp, '_rbuf', None )
+        if self.recv_into and rbuf is not None :
+            # Bytes already buffered by the file object
+            pending = rbuf.getvalue()
+            fp._rbuf = StringIO()
+            self.buf[ :len(pending) ] = pending
+            self.end = len( pending )
+
+    def fill( self ) :
+        """Receive more bytes into the buffer, making room by discarding
+        consumed bytes, or growing the buffer when it is full."""
+        buf = self.buf
+        if self.start :
+            buf[ :self.end-self.start ] = buf[ self.start:self.end ]
+            self.start, self.end = 0, self.end - self.start
+        if self.end == len(buf) :
+            buf.extend( bytearray( len(buf) ))
+        if self.recv_into :
+            n = self.recv_into( memoryview( buf )[ self.end: ] )
+        else :
+            data = self.fp.readline( len(buf) - self.end )
+            n = len( data )
+            buf[ self.end:self.end+n ] = data
+        if not n :
+            raise IncompleteRead( str( buf[ self.start:self.end ] ))
+        self.end += n
+
+    def readline( self ) :
+        """Return the next CRLF terminated line from the chunked framing,
+        without the terminator."""
+        while True :
+            i = self.buf.find( '\r\n', self.start, self.end )
+            if i >= 0 : break
+            self.fill()
+        line = str( self.buf[ self.start:i ] )
+        self.start = i + 2
+        return line
+
+    def iterchunks( self ) :
+        """Iterate over the decoded body as blocks of bytes, until the last
+        chunk and its trailers are consumed."""
         while True :
-            chunksz = int(self.resp.fp.readline().strip(), 16)
-            if not chunksz :
-                self.resp.fp.read(2) #crlf
-                self.resp.close()
-                self.close_cb()
-                break
-            chunk = self.resp.fp.read(chunksz)
-            for ln in chunk.splitlines():
-                yield ln
-            self.resp.fp.read(2) #crlf
+            size = int( self.readline().split( ';', 1 )[0], 16 )
+            if not size : break
+            while size :
+                if self.start == self.end : self.fill()
+                n = min( size, self.end - self.start )
+                yield str( self.buf[ self.start:self.start+n ] )
+                self.start += n
+                size -= n
+            self.readline()                 # CRLF after chunk data
+        while self.readline() : pass        # Trailers, till empty line
+
+
+class SpooledBody( object ) :
+    """Response body spooled to a temporary file and memory-mapped, so
+    that it is paged in from the file as it is read, instead of being held
+    in process memory. Supports the file-like interface of response bodies,
+    ``read()``, ``readline()``, ``getvalue()`` and line iteration, along
+    with ``seek()``, ``tell()``, ``len()`` and slicing.
+    """
+
+    def __init__( self, fd ) :
+        fd.flush()
+        self.fd, self.size = fd, fd.tell()
+        # Zero length files cannot be mapped
+        self.map = mmap.mmap( fd.fileno(), self.size, access=mmap.ACCESS_READ
+                            ) if self.size else None
+
+    def read( self, size=None ) :
+        if self.map is None : return ''
+        if size is None or size < 0 :
+            size = self.size - self.map.tell()
+        return self.map.read( size )
+
+    def readline( self ) :
+        return self.map.readline() if self.map is not None else ''
+
+    def seek( self, pos, whence=0 ) :
+        self.map is not None and self.map.seek( pos, whence )
+
+    def tell( self ) :
+        return self.map.tell() if self.map is not None else 0
+
+    def getvalue( self ) :
+        return self.map[:] if self.map is not None else ''
+
+    def close( self ) :
+        self.map is not None and self.map.close()
+        self.fd.close()
+
+    def __len__( self ) :
+        return self.size
+
+    def __getitem__( self, index ) :
+        return self.map[ index ] if self.map is not None else ''[ index ]
+
+    def iterchunks( self ) :
+        """Iterate over the rest of the body as blocks of bytes."""
+        while True :
+            block = self.read( BUFFER_SIZE )
+            if not block : break
+            yield block
+
+    def iterlines( self ) :
+        """Iterate over lines in the rest of the body, without line
+        terminators."""
+        return iterlines( self.iterchunks() )
+
+    __iter__ = iterlines
+
+def spool( blocks, threshold ) :
+    """Read response body from ``blocks`` of bytes. Return the body as a
+    string if it is not larger than ``threshold`` bytes, otherwise spool it
+    to a temporary file and return a :class:`SpooledBody`."""
+    parts, size, fd = [], 0, None
+    for block in blocks :
+        if fd is None :
+            parts.append( block )
+            size += len( block )
+            if size > threshold :
+                fd = tempfile.TemporaryFile( prefix='couchpy' )
+                [ fd.write( part ) for part in parts ]
+                parts = None
+        else :
+            fd.write( block )
+    return SpooledBody( fd ) if fd is not None else ''.join( parts )
+
+def bodyvalue( data ) :
+    """Return response body ``data``, a string or a file-like object, as a
+    string. A :class:`SpooledBody` is closed after it is read."""
+    if isinstance( data, basestring ) :
+        return data
+    val = data.getvalue()
+    isinstance( data, SpooledBody ) and data.close()
+    return val
+
+def iterlines( blocks ) :
+    """Join ``blocks`` of bytes and split them into lines, without line
+    terminators."""
+    parts = []
+    for block in blocks :
+        if '\n' not in block :
+            parts.append( block )
+            continue
+        lines = block.split( '\n' )
+        if parts :
+            parts.append( lines[0] )
+            lines[0] = ''.join( parts )
+        tail = lines.pop()                  # Partial line, if any
+        parts = [ tail ] if tail else []
+        for line in lines :
+            yield line[:-1] if line.endswith( '\r' ) else line
+    if parts :
+        yield ''.join( parts )
 
 class Dummy( object ) :
     pass
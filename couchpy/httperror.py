@@ -18,6 +18,11 @@ class RedirectLimit(Exception):
     by the maximum number of redirections.
     """
 
+class DeadlineExceeded(Exception):
+    """Exception raised when a request, including its redirects and
+    retries, does not complete before the deadline set for it.
+    """
+
 class BadRequest(HTTPError):
     """400. The error can indicate an error with the request URL, path or
     headers. Differences in the supplied MD5 hash and content also trigger
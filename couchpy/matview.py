@@ -0,0 +1,334 @@
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+"""Client side materialized views. A :class:`MaterializedView` runs a python
+map function, and optionally a reduce function, over documents of a
+database as they arrive on its changes feed, and keeps emitted rows in an
+in-memory index sorted by CouchDB's view collation. When a document changes
+or is deleted, rows emitted for its previous revision are removed and the
+new revision is mapped again, so that the index is maintained incrementally
+instead of being rebuilt from ``_all_docs``.
+
+>>> def latest( doc ):
+...     if doc.get( 'type' ) == 'order' :
+...         emit( [ doc['customer'], doc['date'] ], doc['total'] )
+>>> view = db.MaterializedView( latest, checkpoint='/var/cache/orders.json'
+...                           ).start()
+>>> view.fetch( startkey=['joe', {}], endkey=['joe'], descending=True,
+...             limit=10 )
+{ 'total_rows' : 5201, 'offset' : 1820, 'rows' : [ ... ] }
+>>> view.stop()
+
+Map and reduce functions can be python callables, with the signature used
+by :func:`couchpy.standin.StandinServer.addview`, or python source as
+accepted by :mod:`couchpy.queryserver`, in which case ``emit()`` is
+available to map functions and reduce can be one of the builtins ``_sum``,
+``_count`` and ``_stats``.
+
+If ``checkpoint`` is a file name, the index and the update sequence it was
+built upto are saved to it every ``interval`` seconds and when the view is
+stopped. When started again, the view is loaded from the file and only
+changes since the checkpoint are replayed. The checkpoint is discarded if
+map or reduce functions have changed.
+"""
+
+import os, time, logging
+from   bisect           import bisect_left, insort
+from   hashlib          import md5
+
+try:
+    from threading       import Thread, RLock, Event
+except ImportError:
+    from dummy_threading import Thread, RLock, Event
+
+from   couchpy          import CouchPyError
+from   couchpy.queryserver import mapper, reducer
+from   couchpy.utils    import JSON, collatekey
+
+log = logging.getLogger( __name__ )
+json = JSON()
+
+class _Top( object ):
+    """Sorts after everything, to bound index searches."""
+    __gt__ = __ge__ = lambda self, other : True
+    __lt__ = __le__ = lambda self, other : False
+    __eq__ = lambda self, other : self is other
+    __ne__ = lambda self, other : self is not other
+
+_top = _Top()
+
+def _signature( fn ):
+    if fn is None :
+        return ''
+    if isinstance( fn, basestring ) :
+        return fn
+    code = fn.func_code
+    return code.co_code + repr( code.co_consts ) + repr( code.co_names )
+
+
+class MaterializedView( object ):
+    """Materialized view of database ``db``, for ``map`` and ``reduce``
+    functions.
+
+    ``checkpoint``,
+        File name to save the view to, None to keep it only in memory.
+    ``interval``,
+        Seconds between checkpoints.
+    ``batch``,
+        Number of changes to fetch per request.
+    ``timeout``,
+        Seconds to wait for changes in a long-poll request.
+    """
+
+    def __init__( self, db, map, reduce=None, checkpoint=None, interval=10.0,
+                  batch=500, timeout=30.0 ):
+        self.db, self.checkpointfile = db, checkpoint
+        self.interval, self.batch, self.timeout = interval, batch, timeout
+        self.mapfn = mapper( map ) if isinstance( map, basestring ) else map
+        self.reducefn = reducer( reduce ) if isinstance( reduce, basestring ) \
+                        else reduce
+        self.signature = md5(
+            _signature( map ) + '\0' + _signature( reduce ) ).hexdigest()
+        self.lock = RLock()
+        self.stopped = Event()
+        self.thread = None
+        self.rows = []          # Sorted (collatekey, _id, n, key, value)
+        self.docrows = {}       # _id -> rows emitted by the document
+        self.since = 0
+        self.checkpointed = time.time()
+        self.errors = 0
+        checkpoint and os.path.isfile( checkpoint ) and self.load()
+
+    def __len__( self ):
+        return len( self.rows )
+
+    #---- Synchronization
+
+    def start( self, wait=True ):
+        """Start following the changes feed in a background thread. If
+        ``wait`` is True, catch up with the server before returning. Return
+        self."""
+        wait and self.sync()
+        self.stopped.clear()
+        self.thread = Thread( target=self._run )
+        self.thread.setDaemon( True )
+        self.thread.start()
+        return self
+
+    def stop( self ):
+        """Stop the background thread and save a checkpoint. The thread exits
+        after its pending request to the server completes."""
+        self.stopped.set()
+        self.thread and self.thread.join( self.timeout )
+        self.thread = None
+        self.checkpointfile and self.save()
+
+    def sync( self ):
+        """Catch up with the server, in the calling thread. Return the number
+        of changes applied."""
+        count = 0
+        while True :
+            n = self.poll( feed='normal' )
+            count += n
+            if n < self.batch :
+                return count
+
+    def poll( self, feed='longpoll' ):
+        """Fetch one batch of changes, waiting for them, upto ``timeout``
+        seconds, if ``feed`` is ``longpoll``, and apply them to the view.
+        Return the number of changes."""
+        query = { 'feed' : feed, 'since' : self.since, 'limit' : self.batch,
+                  'include_docs' : 'true' }
+        if feed == 'longpoll' :
+            query['timeout'] = int( self.timeout * 1000 )
+        d = self.db.changes( **query )
+        if d is None :
+            raise CouchPyError( 'Fetching changes for view failed' )
+        results = d.get( 'results', [] )
+        self.apply( results, d.get( 'last_seq', self.since ))
+        if self.checkpointfile and \
+                time.time() - self.checkpointed >= self.interval :
+            self.save()
+        return len( results )
+
+    def apply( self, results, last_seq ):
+        """Apply ``results`` of the changes feed to the view."""
+        self.lock.acquire()
+        try :
+            added = {}          # _id -> rows, not yet in the index
+            for row in results :
+                _id, doc = row['id'], row.get( 'doc', None )
+                if added.pop( _id, None ) is None :
+                    self._remove( _id )
+                if row.get( 'deleted', False ) or doc is None or \
+                        _id.startswith( '_design/' ) :
+                    continue
+                try :
+                    added[_id] = self._rows( _id, self.mapfn( doc ))
+                except Exception, e :
+                    log.warning( 'map function raised exception (%s: %s) '
+                                 'with doc._id %s' % (
+                                 e.__class__.__name__, e, _id ))
+            self._insert( added )
+            self.since = last_seq
+        finally :
+            self.lock.release()
+
+    def _rows( self, _id, emitted ):
+        return [ (collatekey( k ), _id, n, k, v)
+                 for n, (k, v) in enumerate( emitted ) ]
+
+    def _insert( self, added ):
+        rows = []
+        for _id, docrows in added.items() :
+            if docrows :
+                self.docrows[_id] = docrows
+                rows.extend( docrows )
+        if len( rows ) > 64 and len( rows ) * 8 > len( self.rows ) :
+            self.rows.extend( rows )        # Bulk load, sort once
+            self.rows.sort()
+        else :
+            [ insort( self.rows, row ) for row in rows ]
+
+    def _remove( self, _id ):
+        for row in self.docrows.pop( _id, [] ) :
+            del self.rows[ bisect_left( self.rows, row ) ]
+
+    def _run( self ):
+        while not self.stopped.isSet() :
+            try :
+                self.poll()
+                self.errors = 0
+            except Exception, e :
+                self.errors += 1
+                log.error( 'View on %r failed to sync, %s' % (
+                           self.db.dbname, e ))
+                self.stopped.wait( min( self.timeout, 0.1 * self.errors ))
+
+    #---- Checkpoints
+
+    def save( self ):
+        """Save the view and its update sequence to the checkpoint file."""
+        self.lock.acquire()
+        try :
+            data = json.encode({
+                'signature' : self.signature, 'dbname' : self.db.dbname,
+                'since' : self.since,
+                'docs' : dict([ (_id, [ [r[3], r[4]] for r in rows ])
+                                for _id, rows in self.docrows.items() ]) })
+        finally :
+            self.lock.release()
+        tmp = self.checkpointfile + '.tmp'
+        open( tmp, 'wb' ).write( data )
+        os.rename( tmp, self.checkpointfile )
+        self.checkpointed = time.time()
+
+    def load( self ):
+        """Load the view from the checkpoint file. Return True if it was
+        loaded, False if it was built with different functions or for a
+        different database."""
+        d = json.decode( open( self.checkpointfile, 'rb' ).read() )
+        if d['signature'] != self.signature or d['dbname'] != self.db.dbname :
+            log.warning( 'Discarding checkpoint %r of a different view' %
+                         self.checkpointfile )
+            return False
+        self.lock.acquire()
+        try :
+            self.rows, self.docrows = [], {}
+            self._insert( dict([ (_id, self._rows( _id, emitted ))
+                                 for _id, emitted in d['docs'].items() ]))
+            self.since = d['since']
+        finally :
+            self.lock.release()
+        return True
+
+    #---- Queries
+
+    def fetch( self, key=None, keys=None, startkey=None, endkey=None,
+               startkey_docid=None, endkey_docid=None, descending=False,
+               inclusive_end=True, limit=None, skip=0, reduce=True,
+               group=False, group_level=None ):
+        """Query the view, like :func:`couchpy.doc.View.fetch`, except that
+        keys are python values, not JSON strings, and None means the
+        parameter is not specified. Return the same structure as a view
+        query, ``total_rows``, ``offset`` and ``rows`` or, if the view has a
+        reduce function and ``reduce`` is True, ``rows`` of reduced values.
+        """
+        self.lock.acquire()
+        try :
+            if keys is not None :
+                rows = []
+                for k in keys :
+                    ck = collatekey( k )
+                    i, j = self._index( (ck,) ), self._index( (ck, _top) )
+                    rows.extend( self.rows[i:j] )
+                lo, offset = 0, 0
+            else :
+                if key is not None :
+                    startkey, endkey, inclusive_end = key, key, True
+                if descending :
+                    lo = self._lower( endkey, endkey_docid, inclusive_end )
+                    hi = self._upper( startkey, startkey_docid, True )
+                else :
+                    lo = self._lower( startkey, startkey_docid, True )
+                    hi = self._upper( endkey, endkey_docid, inclusive_end )
+                rows = self.rows[ lo : max( lo, hi ) ]
+                offset = (len( self.rows ) - max( lo, hi )) if descending \
+                         else lo
+            total = len( self.rows )
+        finally :
+            self.lock.release()
+
+        if self.reducefn and reduce :
+            rows = self._reduce( rows, group, group_level )
+            rows = rows[::-1] if descending and keys is None else rows
+            rows = rows[ skip : (skip + limit) if limit is not None else None ]
+            return { 'rows' : rows }
+        rows = rows[::-1] if descending and keys is None else rows
+        rows = rows[ skip : (skip + limit) if limit is not None else None ]
+        return { 'total_rows' : total, 'offset' : offset + skip,
+                 'rows' : [ { 'id' : r[1], 'key' : r[3], 'value' : r[4] }
+                            for r in rows ] }
+
+    def _index( self, bound ):
+        return bisect_left( self.rows, bound )
+
+    def _lower( self, key, docid, inclusive ):
+        if key is None :
+            return 0
+        ck = collatekey( key )
+        if not inclusive :
+            return self._index( (ck, _top) )
+        return self._index( (ck, docid) if docid is not None else (ck,) )
+
+    def _upper( self, key, docid, inclusive ):
+        if key is None :
+            return len( self.rows )
+        ck = collatekey( key )
+        if not inclusive :
+            return self._index( (ck,) )
+        return self._index( (ck, docid, _top) if docid is not None
+                            else (ck, _top) )
+
+    def _reduce( self, rows, group, group_level ):
+        group_level = None if group and group_level is None \
+                      else (group_level or 0)
+        def groupkey( key ) :
+            if group_level is None : return key
+            if group_level == 0 : return None
+            return list( key[:group_level] ) \
+                   if isinstance( key, (list, tuple) ) else key
+        groups = []
+        for r in rows :
+            k = groupkey( r[3] )
+            if groups and collatekey( groups[-1][0] ) == collatekey( k ) :
+                groups[-1][1].append( r )
+            else :
+                groups.append( (k, [ r ]) )
+        return [ { 'key' : k,
+                   'value' : self.reducefn( [ [r[3], r[1]] for r in rs ],
+                                            [ r[4] for r in rs ], False ) }
+                 for k, rs in groups ]
@@ -4,37 +4,26 @@
 
 # -*- coding: utf-8 -*-
 
+from   couchpy.doc      import Document
+
 class MixinDB( object ) :
 
     def deleteupdate( self, docs, key=None, merge=None ) :
         """Some document in documents `docs` can be fresh to database, while
-        some other might by pointing to exising ones. For existing documents,
-        read the database version and delete that version. Update the document
-        with the new one create a fresh copy of the document.
+        some other might by pointing to exising ones. Use ``key``, a function
+        returning the ``_id`` for a document, if documents do not carry their
+        ``_id``. :class:`couchpy.doc.Document` objects carry their ``_id`` and
+        are passed as they are, so that they are updated with the new
+        revision.
+
+        Deprecated, existing documents are no more deleted and re-created, but
+        updated in place using :func:`couchpy.database.Database.upsert`,
+        which accepts the same ``merge`` function.
         """
-        # Fetch the documents that are already available in the database.
-        key = key or ( lambda doc : doc['_id'] )
-        keys = map( key, docs )
-        dbdocs = self.docs( keys=keys ).get( 'rows', [] )
-        dbids = [ doc['id'] for doc in dbdocs ]
-        # Partition fresh documents from existing ones.
-        fn = lambda p, x : p[0].append(x) if key(x) in dbids else p[1].append(x)
-        partition = [ [], [] ]  # [ dbdocs, newdocs ]
-        reduce( fn, partition )
-        _, newdocs = partition
-        # Compose documents to delete
-        [ { '_id': d['_id'], '_rev': d['_rev'], '_deleted': True }
-          for d in dbdocs ]
-        d = self.bulkdocs( docs=deldocs )
-        conflicts = [ r for r in d if r.get('error','') == 'conflict' ]
-        if conflicts :
-            log.error( 'Conflicts while delete db versions %s' % conflicts )
-        # New documents
-        d = self.bulkdocs( docs=newdocs )
-        conflicts = [ r for r in d if r.get('error','') == 'conflict' ]
-        if conflicts :
-            log.error( 'Conflicts while updating merged versions %s' % conflicts )
-        return d
+        if key :
+            docs = [ doc if isinstance( doc, Document )
+                     else dict( doc, _id=key(doc) ) for doc in docs ]
+        return self.upsert( docs, merge=merge )
 
 
 class MixinDoc( object ) :
@@ -0,0 +1,328 @@
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+"""Query server for design documents written in python. It speaks CouchDB's
+line based view server protocol on stdin and stdout, so that views, filters,
+validation, show and update functions can be written in python instead of
+javascript. Configure it with CouchDB as,
+
+.. code-block:: ini
+
+    [query_servers]
+    python = /usr/bin/couchpy-queryserver
+
+and create design documents with ``"language" : "python"``. Functions are
+python source defining one or more functions, the last function defined is
+the one called. Map functions can either ``emit( key, value )`` or
+``yield key, value``,
+
+.. code-block:: python
+
+    def fun( doc ):
+        if doc.get( 'type' ) == 'post' :
+            for tag in doc.get( 'tags', [] ) :
+                emit( tag, 1 )
+
+Reduce functions are called as ``fun( keys, values, rereduce )``. The
+builtin reduces ``_sum``, ``_count`` and ``_stats`` are computed natively.
+Validation functions are called as ``fun( newdoc, olddoc, userctx, secobj )``
+and can raise ``Forbidden`` or ``Unauthorized``, which are available to them
+as globals, along with ``log( message )``.
+
+Compiled functions are cached by their source, CouchDB resets the query
+server and adds the same functions back for every view update, so they are
+compiled only once per process. When CouchDB pipelines commands, all the
+lines available in the input are processed before the output is flushed.
+
+The same engine runs python views in :mod:`couchpy.standin`.
+"""
+
+import os, re, sys, logging
+
+try:
+    from threading       import local
+except ImportError:
+    from dummy_threading import local
+
+from   couchpy.utils    import JSON, ReduceError, \
+                               builtin_reduces as utils_reduces
+
+log = logging.getLogger( __name__ )
+json = JSON()
+
+class QueryServerError( Exception ):
+    """Raised for errors reported back to CouchDB as ``["error", error,
+    reason]``."""
+    def __init__( self, error, reason='' ):
+        Exception.__init__( self, error, reason )
+        self.error, self.reason = error, reason
+
+class Forbidden( Exception ):
+    """Raised by validation functions to reject a document update."""
+
+class Unauthorized( Exception ):
+    """Raised by validation functions when user is not authorized for the
+    document update."""
+
+
+def compilefun( source, builtins={} ):
+    """Compile python ``source`` and return the last function defined by
+    it. ``builtins`` are made available as globals to the function."""
+    names = re.findall( r'^def\s+(\w+)', source, re.M )
+    if not names :
+        raise QueryServerError( 'compilation_error', 'No function defined' )
+    ns = dict( builtins )
+    try :
+        exec source in ns
+    except Exception, e :
+        raise QueryServerError( 'compilation_error',
+                                '%s: %s' % (e.__class__.__name__, e) )
+    return ns[ names[-1] ]
+
+class _Emitter( local ):
+    rows = None
+    def __call__( self, key, value ):
+        self.rows.append( (key, value) )
+
+def mapper( source, builtins={} ):
+    """Return a function that maps a document to a list of (key, value)."""
+    emit = _Emitter()
+    fn = compilefun( source, dict( builtins, emit=emit ))
+    def mapfn( doc ):
+        emit.rows = []
+        rc = fn( doc )
+        rows = emit.rows
+        rows.extend( rc or [] )
+        return rows
+    return mapfn
+
+def _builtin( fn ):
+    def reducefn( keys, values, rereduce ):
+        try :
+            return fn( keys, values, rereduce )
+        except ReduceError, e :
+            raise QueryServerError( 'builtin_reduce_error', str(e) )
+    return reducefn
+
+builtin_reduces = dict([ (name, _builtin( fn ))
+                         for name, fn in utils_reduces.items() ])
+
+def reducer( source ):
+    """Return a function ``fn( keys, values, rereduce )`` for reduce
+    ``source``, which is either python source or a builtin reduce."""
+    if source.strip() in builtin_reduces :
+        return builtin_reduces[ source.strip() ]
+    return compilefun( source )
+
+
+def _response( resp ):
+    return { 'body' : resp } if isinstance( resp, basestring ) else resp
+
+
+class QueryServer( object ):
+    """State of a query server process, functions added by ``add_fun``,
+    cached design documents and compiled functions. Commands can be
+    executed in-process with :func:`QueryServer.handle`, or read from a
+    stream with :func:`QueryServer.run`."""
+
+    COMMANDS = set([ 'reset', 'add_fun', 'add_lib', 'map_doc', 'reduce',
+                     'rereduce', 'ddoc' ])
+
+    MAXCACHE = 1000
+    """Maximum number of compiled functions to cache."""
+
+    REDUCE_LIMIT = 4096
+    """With ``reduce_limit`` configured, reduce output larger than this
+    many bytes must be less than half the size of its input."""
+
+    def __init__( self ):
+        self.mapfns, self.ddocs, self.libs = [], {}, {}
+        self.config = {}
+        self.cache = {}             # (kind, source) -> compiled function
+        self.logs = None            # Log messages for the running stream
+        self.linelen = 0
+
+    def log( self, message ):
+        """Log ``message`` to CouchDB's log, when running as a query
+        server, otherwise to python logging."""
+        if self.logs is None :
+            log.warning( message )
+        else :
+            self.logs.append( message )
+
+    def compiled( self, kind, source ):
+        """Return function compiled from ``source``, ``kind`` is ``map``,
+        ``reduce`` or ``ddoc``."""
+        key = (kind, source)
+        fn = self.cache.get( key, None )
+        if fn is None :
+            builtins = { 'log' : self.log, 'Forbidden' : Forbidden,
+                         'Unauthorized' : Unauthorized }
+            if kind == 'map' :
+                fn = mapper( source, builtins )
+            elif kind == 'reduce' :
+                fn = reducer( source )
+            else :
+                fn = compilefun( source, builtins )
+            len( self.cache ) >= self.MAXCACHE and self.cache.clear()
+            self.cache[key] = fn
+        return fn
+
+    def mapfun( self, source ):
+        """Return compiled map function ``fn( doc )``, returning a list of
+        (key, value)."""
+        return self.compiled( 'map', source )
+
+    def reducefun( self, source ):
+        """Return compiled reduce function ``fn( keys, values, rereduce )``.
+        """
+        return self.compiled( 'reduce', source )
+
+    #---- Commands
+
+    def handle( self, cmd ):
+        """Execute command ``cmd``, a decoded protocol line, and return the
+        response. Errors are returned as ``["error", error, reason]``."""
+        try :
+            name = cmd[0]
+            if name not in self.COMMANDS :
+                raise QueryServerError( 'unknown_command',
+                                        'unknown command %r' % (name,) )
+            return getattr( self, name )( *cmd[1:] )
+        except QueryServerError, e :
+            return [ 'error', e.error, e.reason ]
+        except Exception, e :
+            log.exception( e )
+            return [ 'error', e.__class__.__name__, str(e) ]
+
+    def reset( self, config=None ):
+        self.mapfns, self.config = [], (config or {})
+        return True
+
+    def add_fun( self, source ):
+        self.mapfns.append( self.mapfun( source ))
+        return True
+
+    def add_lib( self, lib ):
+        self.libs = lib
+        return True
+
+    def map_doc( self, doc ):
+        results = []
+        for fn in self.mapfns :
+            try :
+                results.append( fn( doc ))
+            except Exception, e :
+                # Like couchjs, the document is skipped by this function.
+                self.log( 'function raised exception (%s: %s) with doc._id '
+                          '%s' % (e.__class__.__name__, e, doc.get('_id')) )
+                results.append( [] )
+        return results
+
+    def reduce( self, sources, kvs ):
+        keys, values = [ kv[0] for kv in kvs ], [ kv[1] for kv in kvs ]
+        return self._reduced([ self.reducefun( s )( keys, values, False )
+                               for s in sources ])
+
+    def rereduce( self, sources, values ):
+        return self._reduced([ self.reducefun( s )( None, values, True )
+                               for s in sources ])
+
+    def _reduced( self, reductions ):
+        if self.config.get( 'reduce_limit', False ) and self.linelen :
+            n = len( json.encode( reductions ))
+            if n > self.REDUCE_LIMIT and n * 2 > self.linelen :
+                raise QueryServerError( 'reduce_overflow_error',
+                        'Reduce output must shrink more rapidly, got %s '
+                        'bytes from %s bytes of input' % (n, self.linelen) )
+        return [ True, reductions ]
+
+    def ddoc( self, *args ):
+        if args[0] == 'new' :
+            self.ddocs[ args[1] ] = args[2]
+            return True
+        ddocid, path, fargs = args
+        if ddocid not in self.ddocs :
+            raise QueryServerError( 'query_protocol_error',
+                                    'uncached design doc: %s' % ddocid )
+        source = self.ddocs[ ddocid ]
+        for name in path :
+            source = source.get( name, None ) if isinstance( source, dict ) \
+                     else None
+        if not isinstance( source, basestring ) :
+            raise QueryServerError( 'not_found',
+                                    'missing function %s in %s' % (
+                                    '.'.join( path ), ddocid ))
+        kind = path[0]
+        if kind == 'validate_doc_update' :
+            try :
+                self.compiled( 'ddoc', source )( *fargs )
+            except Forbidden, e :
+                return { 'forbidden' : str(e) }
+            except Unauthorized, e :
+                return { 'unauthorized' : str(e) }
+            return 1
+        elif kind == 'filters' :
+            fn, (docs, req) = self.compiled( 'ddoc', source ), fargs
+            return [ True, [ bool( fn( doc, req )) for doc in docs ]]
+        elif kind == 'views' :
+            fn, docs = self.mapfun( source ), fargs[0]
+            return [ True, [ bool( fn( doc )) for doc in docs ]]
+        elif kind == 'updates' :
+            doc, resp = self.compiled( 'ddoc', source )( *fargs )
+            resp = _response( resp )
+            return [ 'up', doc, resp ]
+        elif kind == 'shows' :
+            resp = self.compiled( 'ddoc', source )( *fargs )
+            resp = _response( resp )
+            return [ 'resp', resp ]
+        raise QueryServerError( 'not_implemented',
+                                '%s functions are not supported' % kind )
+
+    #---- Stream
+
+    def respond( self, line ):
+        """Execute protocol ``line`` and return the output lines, log
+        messages followed by the response."""
+        self.logs, self.linelen = [], len( line )
+        try :
+            resp = self.handle( json.decode( line ))
+            return [ json.encode([ 'log', m ]) + '\n' for m in self.logs ] + \
+                   [ json.encode( resp ) + '\n' ]
+        finally :
+            self.logs = None
+
+    def run( self, input=None, output=None ):
+        """Read commands from ``input`` and write responses to ``output``,
+        default stdin and stdout, until end of input."""
+        input, output = input or sys.stdin, output or sys.stdout
+        try :
+            fd = input.fileno()
+            read = lambda : os.read( fd, 65536 )
+        except (AttributeError, IOError, ValueError) :
+            read = lambda : input.read( 65536 )
+        buf = ''
+        while True :
+            data = read()
+            if not data :
+                break
+            lines = (buf + data).split( '\n' )
+            buf = lines.pop()
+            out = []
+            [ out.extend( self.respond( l )) for l in lines if l.strip() ]
+            if out :
+                output.write( ''.join( out ))
+                output.flush()
+
+
+def main( argv=None ):
+    """Command line entry point, ``couchpy-queryserver``."""
+    logging.basicConfig( stream=sys.stderr, level=logging.WARNING )
+    QueryServer().run( sys.stdin, sys.stdout )
+    return 0
+
+if __name__ == '__main__' :
+    sys.exit( main() )
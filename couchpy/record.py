@@ -0,0 +1,241 @@
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+"""Record HTTP traffic between couchpy and CouchDB server and replay it
+later, without the server. Useful to profile client side overhead, like JSON
+conversion, document objects and state transitions, without network and
+server noise.
+
+>>> rec = RecordingSession( 'traffic.jsonl.gz' )
+>>> couch = Client( 'http://localhost:5984', htsess=rec )
+>>> ... use the client ...
+>>> rec.close()
+
+and then,
+
+>>> couch = Client( 'http://localhost:5984',
+...                 htsess=ReplaySession( 'traffic.jsonl.gz' ))
+>>> ... repeat the same sequence of calls ...
+
+Both sessions have the same interface as :class:`couchpy.httpc.HttpSession`
+and can be passed as ``htsess`` to :class:`couchpy.rest.ReSTful` and
+:class:`couchpy.client.Client`.
+
+Traffic is saved as one JSON object per line, gzip compressed if the file
+name ends with ``.gz``. Every record contains request method and url,
+response status, headers, body, sizes of the blocks in which streamed
+bodies were received, or lines of chunked response body as they were
+delivered to ``chunk_cb``, exceptions raised for error responses, and the
+time taken for the request.
+"""
+
+import time, gzip, logging
+from   base64           import b64encode, b64decode
+from   collections      import deque
+from   httplib          import HTTPMessage
+
+try:
+    from cStringIO      import StringIO
+except ImportError:
+    from StringIO       import StringIO
+
+try:
+    from threading       import Lock
+except ImportError:
+    from dummy_threading import Lock
+
+from   couchpy          import CouchPyError
+from   couchpy.httpc    import BUFFER_SIZE, SpooledBody, iterlines
+from   couchpy.utils    import JSON
+import couchpy.httperror as httperror
+
+log = logging.getLogger( __name__ )
+
+def _openfile( filepath, mode ):
+    return gzip.open( filepath, mode ) if filepath.endswith('.gz') \
+           else open( filepath, mode )
+
+def _encodebody( record, body ):
+    """Save ``body`` as text if it is UTF-8, otherwise base64 encode it."""
+    try :
+        record['body'] = body.decode( 'utf-8' )
+    except UnicodeDecodeError :
+        record['body64'] = b64encode( body )
+
+def _decodebody( record ):
+    if 'body64' in record :
+        return b64decode( record['body64'] )
+    body = record.get( 'body', None )
+    return body.encode( 'utf-8' ) if body is not None else None
+
+
+class ReplayBody( object ):
+    """File-like response body for recorded responses, with the interface
+    of streamed response bodies. ``blocks`` is the list of sizes of the
+    blocks in which the body was received, if it was streamed, and
+    :func:`iterchunks` yields blocks of the same sizes. For chunked
+    responses whose lines were consumed by ``chunk_cb``, body is empty."""
+
+    def __init__( self, data, blocks=None ):
+        self.fd = StringIO( data )
+        self.blocks = blocks or []
+
+    def read( self, size=None ):
+        return self.fd.read() if size is None else self.fd.read( size )
+
+    def readline( self, size=-1 ):
+        return self.fd.readline( size )
+
+    def getvalue( self ):
+        return self.fd.getvalue()
+
+    def close( self ):
+        pass
+
+    def iterchunks( self ):
+        """Iterate over the rest of the body as blocks of bytes."""
+        for size in self.blocks :
+            block = self.fd.read( size )
+            if not block : return
+            yield block
+        while True :
+            block = self.fd.read( BUFFER_SIZE )
+            if not block : break
+            yield block
+
+    def iterlines( self ):
+        """Iterate over lines in the rest of the body, without line
+        terminators."""
+        return iterlines( self.iterchunks() )
+
+    __iter__ = iterlines
+
+
+class RecordingSession( object ):
+    """Wrap ``htsess``, an instance of :class:`couchpy.httpc.HttpSession`,
+    and record every request and response to ``filepath``. If ``htsess`` is
+    None a new session is created. Call :func:`RecordingSession.close` to
+    flush the recorded traffic."""
+
+    def __init__( self, filepath, htsess=None ):
+        from couchpy.httpc import HttpSession
+        self.htsess = htsess or HttpSession()
+        self.filepath = filepath
+        self.fd = _openfile( filepath, 'wb' )
+        self.json = JSON()
+        self.lock = Lock()
+        self.count = 0
+
+    def __getattr__( self, name ):
+        return getattr( self.htsess, name )
+
+    def request( self, method, url, body=None, headers=None, credentials=None,
+                 num_redirects=0, chunk_cb=None ) :
+        record = { 'method' : method.upper(), 'url' : url }
+        st = time.time()
+        try :
+            s, h, d = self.htsess.request(
+                            method, url, body=body, headers=headers,
+                            credentials=credentials,
+                            num_redirects=num_redirects )
+        except httperror.HTTPError, e :
+            record.update( elapsed=time.time() - st,
+                           error=[ type(e).__name__, list(e.args) ] )
+            self.save( record )
+            raise
+        record.update( status=s, headers=''.join( h.headers ))
+
+        blocks = None
+        if d is None :
+            data = None
+        elif chunk_cb and h.get( 'transfer-encoding', None ) == 'chunked' :
+            record['chunks'] = lines = []
+            for line in d :
+                lines.append( line )
+                chunk_cb( line )
+            data = ''
+        elif hasattr( d, 'iterchunks' ) :       # Streamed or spooled body
+            chunks = list( d.iterchunks() )
+            isinstance( d, SpooledBody ) and d.close()
+            record['blocks'] = blocks = map( len, chunks )
+            data = ''.join( chunks )
+            _encodebody( record, data )
+        else :
+            data = d.getvalue()
+            _encodebody( record, data )
+        record['elapsed'] = time.time() - st
+        self.save( record )
+        return s, h, \
+               (ReplayBody( data, blocks ) if data is not None else None)
+
+    def save( self, record ):
+        line = self.json.encode( record ) + '\n'
+        self.lock.acquire()
+        try :
+            self.fd.write( line )
+            self.count += 1
+        finally :
+            self.lock.release()
+
+    def close( self ):
+        """Flush recorded traffic and close the file."""
+        self.fd.close()
+
+
+class ReplaySession( object ):
+    """Serve responses recorded by :class:`RecordingSession` from
+    ``filepath``. Requests are matched by method and url, in the order they
+    were recorded. If ``realtime`` is True, every response is delayed by the
+    time taken for the original request, otherwise responses are returned
+    immediately."""
+
+    def __init__( self, filepath, realtime=False ):
+        self.filepath, self.realtime = filepath, realtime
+        self.records = {}       # (method, url) -> deque of records
+        self.lock = Lock()
+        json = JSON()
+        fd = _openfile( filepath, 'rb' )
+        try :
+            for line in fd :
+                record = json.decode( line )
+                key = ( record['method'], record['url'] )
+                self.records.setdefault( key, deque() ).append( record )
+        finally :
+            fd.close()
+
+    def request( self, method, url, body=None, headers=None, credentials=None,
+                 num_redirects=0, chunk_cb=None ) :
+        key = ( method.upper(), url )
+        self.lock.acquire()
+        try :
+            records = self.records.get( key, None )
+            if not records :
+                raise CouchPyError( 'No recorded response for %s %s' % key )
+            record = records.popleft()
+        finally :
+            self.lock.release()
+
+        self.realtime and time.sleep( record['elapsed'] )
+        if 'error' in record :
+            clsname, args = record['error']
+            cls = getattr( httperror, clsname, httperror.HTTPError )
+            raise cls( *[ tuple(a) if isinstance(a, list) else a
+                          for a in args ] )
+
+        h = HTTPMessage( StringIO( record['headers'].encode('utf-8') ))
+        if 'chunks' in record :
+            [ chunk_cb( line.encode('utf-8') ) for line in record['chunks']
+              if chunk_cb ]
+            data = ''
+        else :
+            data = _decodebody( record )
+        return record['status'], h, \
+               (ReplayBody( data, record.get( 'blocks', None ))
+                if data is not None else None)
+
+    def remaining( self ):
+        """Number of recorded responses not yet replayed."""
+        return sum([ len(records) for records in self.records.values() ])
@@ -0,0 +1,352 @@
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+"""Local read replica of a database. A :class:`Replica` follows the
+database's changes feed, with ``include_docs``, in a background thread and
+keeps the latest revision of every document in an embedded SQLite store,
+either in memory or on disk. Reads are served from the store without a
+request to the server, as long as the replica is not staler than
+``maxstale`` seconds, otherwise they fall back to the server. Writes are not
+intercepted, they go to the server as usual and reach the replica through the
+changes feed.
+
+>>> replica = db.Replica( path='/var/cache/contacts.db',
+...                       fields=['email', 'address.city'] ).start()
+>>> replica.get( 'joe' )
+{ u'_id' : u'joe', u'_rev' : u'3-...', u'email' : u'joe@example.com', ... }
+>>> replica.all_docs( startkey='j', endkey='k', include_docs=True )
+{ 'total_rows' : 120, 'offset' : 41, 'rows' : [ ... ] }
+>>> replica.lookup( 'address.city', 'Bangalore' )
+[ { u'_id' : u'joe', ... }, ... ]
+>>> replica.stop()
+
+Staleness is measured from the moment the replica last asked the server for
+changes and was answered with all of them. An idle replica polls the server
+every ``maxstale / 4`` seconds, so that it stays fresh. An on-disk replica
+remembers the update sequence it has caught up with, and resumes from it
+when it is started again.
+
+Fields listed in ``fields``, nested fields named with ``.``, are indexed in
+the store when their value is a string or a number, so that they can be
+looked up with :func:`Replica.lookup`.
+"""
+
+import time, logging, sqlite3
+
+try:
+    from threading       import Thread, Lock, Event
+except ImportError:
+    from dummy_threading import Thread, Lock, Event
+
+from   couchpy          import CouchPyError
+from   couchpy.httperror import ResourceNotFound
+from   couchpy.doc      import _getdoc
+from   couchpy.utils    import JSON
+
+log = logging.getLogger( __name__ )
+json = JSON()
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS docs "
+        "( id TEXT PRIMARY KEY, rev TEXT, body TEXT )",
+    "CREATE TABLE IF NOT EXISTS fields "
+        "( name TEXT, value, id TEXT )",
+    "CREATE INDEX IF NOT EXISTS fields_value ON fields ( name, value, id )",
+    "CREATE INDEX IF NOT EXISTS fields_id ON fields ( id )",
+    "CREATE TABLE IF NOT EXISTS meta ( key TEXT PRIMARY KEY, value TEXT )",
+]
+
+def _fieldvalue( doc, path ):
+    value = doc
+    for name in path.split('.') :
+        if not isinstance( value, dict ) :
+            return None
+        value = value.get( name, None )
+    if isinstance( value, bool ) :
+        return None
+    return value if isinstance( value, (basestring, int, long, float) ) \
+           else None
+
+
+class Replica( object ):
+    """Replica of database ``db``, stored in SQLite database file ``path``,
+    ``:memory:`` to keep it in memory.
+
+    ``fields``,
+        List of document fields to index, for :func:`Replica.lookup`.
+    ``maxstale``,
+        Maximum staleness, in seconds, of documents served by the replica.
+        When the replica is staler, reads are served by the server.
+    ``batch``,
+        Number of changes to fetch per request.
+    """
+
+    def __init__( self, db, path=':memory:', fields=[], maxstale=5.0,
+                  batch=500 ):
+        self.db, self.path, self.fields = db, path, list( fields )
+        self.maxstale, self.batch = maxstale, batch
+        self.conn = sqlite3.connect( path, check_same_thread=False )
+        self.conn.text_factory = unicode
+        self.lock = Lock()          # Guards the sqlite connection
+        self.stopped = Event()
+        self.thread = None
+        self.asof = None            # Server state reflected as of this time
+        self.errors = 0
+        self._setup()
+
+    def _setup( self ):
+        self.lock.acquire()
+        try :
+            [ self.conn.execute( sql ) for sql in SCHEMA ]
+            meta = dict( self.conn.execute( "SELECT key, value FROM meta" ))
+            fields = json.encode( sorted( self.fields ))
+            if meta.get( 'fields', fields ) != fields :
+                # Indexed fields changed, rebuild the field index.
+                self.conn.execute( "DELETE FROM fields" )
+                for _id, body in self.conn.execute(
+                                    "SELECT id, body FROM docs" ).fetchall() :
+                    self._index( _id, json.decode( body ))
+            self._setmeta( 'fields', fields )
+            self._setmeta( 'dbname', self.db.dbname )
+            self.conn.commit()
+            self.since = json.decode( meta['since'] ) if 'since' in meta else 0
+        finally :
+            self.lock.release()
+
+    def _setmeta( self, key, value ):
+        self.conn.execute( "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                           (key, value) )
+
+    def _index( self, _id, doc ):
+        for name in self.fields :
+            value = _fieldvalue( doc, name )
+            if value is not None :
+                self.conn.execute( "INSERT INTO fields VALUES (?, ?, ?)",
+                                   (name, value, _id) )
+
+    #---- Synchronization
+
+    def start( self, wait=True ):
+        """Start following the changes feed in a background thread. If
+        ``wait`` is True, catch up with the server before returning. Return
+        self."""
+        wait and self.sync()
+        self.stopped.clear()
+        self.thread = Thread( target=self._run )
+        self.thread.setDaemon( True )
+        self.thread.start()
+        return self
+
+    def stop( self ):
+        """Stop the background thread. The thread exits after its pending
+        request to the server completes."""
+        self.stopped.set()
+        self.thread and self.thread.join( self.maxstale )
+        self.thread = None
+
+    def close( self ):
+        """Stop synchronizing and close the store."""
+        self.stop()
+        self.lock.acquire()
+        try :
+            self.conn.close()
+        finally :
+            self.lock.release()
+
+    def sync( self ):
+        """Catch up with the server, in the calling thread. Return the number
+        of changes applied."""
+        count = 0
+        while True :
+            n = self.poll( feed='normal' )
+            count += n
+            if n < self.batch :
+                return count
+
+    def poll( self, feed='longpoll' ):
+        """Fetch one batch of changes, waiting for them, upto ``maxstale / 4``
+        seconds, if ``feed`` is ``longpoll``, and apply them to the store.
+        Return the number of changes."""
+        st = time.time()
+        query = { 'feed' : feed, 'since' : self.since, 'limit' : self.batch,
+                  'include_docs' : 'true' }
+        if feed == 'longpoll' :
+            query['timeout'] = int( self.maxstale * 250 )
+        d = self.db.changes( **query )
+        if d is None :
+            raise CouchPyError( 'Fetching changes for replica failed' )
+        results = d.get( 'results', [] )
+        self._apply( results, d.get( 'last_seq', self.since ))
+        if len( results ) < self.batch :   # Caught up with server state
+            self.asof = st
+        return len( results )
+
+    def _apply( self, results, last_seq ):
+        self.lock.acquire()
+        try :
+            for row in results :
+                _id, doc = row['id'], row.get( 'doc', None )
+                self.conn.execute( "DELETE FROM fields WHERE id=?", (_id,) )
+                if row.get( 'deleted', False ) or doc is None :
+                    self.conn.execute( "DELETE FROM docs WHERE id=?", (_id,) )
+                    continue
+                self.conn.execute( "INSERT OR REPLACE INTO docs VALUES "
+                                   "(?, ?, ?)",
+                                   (_id, doc['_rev'], json.encode( doc )) )
+                self._index( _id, doc )
+            self._setmeta( 'since', json.encode( last_seq ))
+            self.conn.commit()
+            self.since = last_seq
+        except :
+            self.conn.rollback()
+            raise
+        finally :
+            self.lock.release()
+
+    def _run( self ):
+        while not self.stopped.isSet() :
+            try :
+                self.poll()
+                self.errors = 0
+            except Exception, e :
+                self.errors += 1
+                log.error( 'Replica of %r failed to sync, %s' % (
+                           self.db.dbname, e ))
+                self.stopped.wait( min( self.maxstale, 0.1 * self.errors ))
+
+    def staleness( self ):
+        """Seconds since the replica was known to be in sync with the server,
+        None if it never was."""
+        return None if self.asof is None else time.time() - self.asof
+
+    def fresh( self, maxstale=None ):
+        """Whether replica is fresher than ``maxstale`` seconds, default is
+        the replica's ``maxstale``."""
+        maxstale = self.maxstale if maxstale is None else maxstale
+        return self.asof is not None and \
+               (time.time() - self.asof) <= maxstale
+
+    #---- Reads
+
+    def __len__( self ):
+        return self._query( "SELECT count(*) FROM docs" )[0][0]
+
+    def __contains__( self, _id ):
+        return bool( self._query( "SELECT 1 FROM docs WHERE id=?", (_id,) ))
+
+    def get( self, _id, default=None, maxstale=None ):
+        """Return document ``_id`` as a dictionary, ``default`` if it is
+        missing or deleted. If the replica is staler than ``maxstale``, the
+        document is fetched from the server."""
+        if not self.fresh( maxstale ) :
+            return self._serverget( _id, default )
+        rows = self._query( "SELECT body FROM docs WHERE id=?", (_id,) )
+        return json.decode( rows[0][0] ) if rows else default
+
+    def all_docs( self, keys=None, startkey=None, endkey=None, limit=None,
+                  skip=0, descending=False, inclusive_end=True,
+                  include_docs=False, maxstale=None ):
+        """Same as :func:`couchpy.database.Database.all_docs`, except that
+        query parameters are python values, not JSON strings. Return the
+        same structure as ``_all_docs``. If the replica is staler than
+        ``maxstale``, the query is made to the server."""
+        if not self.fresh( maxstale ) :
+            return self._serverall( keys, startkey, endkey, limit, skip,
+                                    descending, inclusive_end, include_docs )
+        col = "id, rev, body" if include_docs else "id, rev"
+        total = len( self )
+        if keys is not None :
+            rows = []
+            for key in keys :
+                r = self._query( "SELECT %s FROM docs WHERE id=?" % col,
+                                 (key,) )
+                rows.append( self._row( r[0], include_docs ) if r else
+                             { 'key' : key, 'error' : 'not_found' } )
+            return { 'total_rows' : total, 'offset' : 0, 'rows' : rows }
+
+        lo, hi = (endkey, startkey) if descending else (startkey, endkey)
+        loop, hiop = (">=" if inclusive_end else ">", "<=") if descending \
+                     else (">=", "<=" if inclusive_end else "<")
+        where, args = [], []
+        lo is not None and ( where.append( "id %s ?" % loop ) or
+                             args.append( lo ))
+        hi is not None and ( where.append( "id %s ?" % hiop ) or
+                             args.append( hi ))
+        where = (" WHERE " + " AND ".join( where )) if where else ""
+        sql = "SELECT %s FROM docs%s ORDER BY id %s LIMIT ? OFFSET ?" % (
+                    col, where, "DESC" if descending else "ASC" )
+        rows = self._query( sql, args + [ -1 if limit is None else limit,
+                                          skip ])
+        if descending :
+            above = self._query( "SELECT count(*) FROM docs WHERE id > ?",
+                                 (hi,) )[0][0] if hi is not None else 0
+            offset = above + skip
+        else :
+            below = self._query( "SELECT count(*) FROM docs WHERE id < ?",
+                                 (lo,) )[0][0] if lo is not None else 0
+            offset = below + skip
+        return { 'total_rows' : total, 'offset' : offset,
+                 'rows' : [ self._row( r, include_docs ) for r in rows ] }
+
+    def lookup( self, field, key=None, startkey=None, endkey=None,
+                limit=None, maxstale=None ):
+        """Return a list of documents whose indexed ``field`` is equal to
+        ``key``, or in the range ``startkey`` to ``endkey``, ordered by field
+        value and ``_id``. If the replica is staler than ``maxstale``,
+        documents are found using :func:`couchpy.database.Database.find`."""
+        if field not in self.fields :
+            raise CouchPyError( 'Field %r is not indexed by replica' % field )
+        if key is not None :
+            startkey = endkey = key
+        if not self.fresh( maxstale ) :
+            cond = {}
+            startkey is not None and cond.update({ '$gte' : startkey })
+            endkey is not None and cond.update({ '$lte' : endkey })
+            cond = cond or { '$exists' : True }
+            return list( self.db.find( { field : cond }, limit=limit ))
+        where, args = [ "f.name = ?" ], [ field ]
+        startkey is not None and ( where.append( "f.value >= ?" ) or
+                                   args.append( startkey ))
+        endkey is not None and ( where.append( "f.value <= ?" ) or
+                                 args.append( endkey ))
+        sql = "SELECT d.body FROM fields f JOIN docs d ON f.id = d.id " \
+              "WHERE %s ORDER BY f.value, f.id LIMIT ?" % " AND ".join(where)
+        rows = self._query( sql, args + [ -1 if limit is None else limit ])
+        return [ json.decode( r[0] ) for r in rows ]
+
+    def _row( self, r, include_docs ):
+        row = { 'id' : r[0], 'key' : r[0], 'value' : { 'rev' : r[1] }}
+        include_docs and row.update( doc=json.decode( r[2] ))
+        return row
+
+    def _query( self, sql, args=() ):
+        self.lock.acquire()
+        try :
+            return self.conn.execute( sql, args ).fetchall()
+        finally :
+            self.lock.release()
+
+    #---- Fall back to server
+
+    def _serverget( self, _id, default ):
+        db = self.db
+        try :
+            s, h, d = _getdoc( db.conn, db.paths + [_id], hthdrs=db.hthdrs )
+        except ResourceNotFound :
+            return default
+        return default if d is None else d
+
+    def _serverall( self, keys, startkey, endkey, limit, skip, descending,
+                    inclusive_end, include_docs ):
+        q = {}
+        startkey is not None and q.update( startkey=json.encode( startkey ))
+        endkey is not None and q.update( endkey=json.encode( endkey ))
+        limit is not None and q.update( limit=limit )
+        skip and q.update( skip=skip )
+        descending and q.update( descending='true' )
+        inclusive_end or q.update( inclusive_end='false' )
+        include_docs and q.update( include_docs='true' )
+        return self.db.all_docs( keys=keys, q=q )
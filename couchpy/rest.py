@@ -4,13 +4,27 @@
 
 # -*- coding: utf-8 -*-
 
-import urllib, logging, time
+import re, urllib, logging, time
 from   copy             import deepcopy
 from   urlparse         import urlsplit, urlunsplit
 
+try:
+    from cStringIO      import StringIO
+except ImportError:
+    from StringIO       import StringIO
+
 from   couchpy.utils    import JSON
+from   couchpy.httpc    import Deadline, SpooledBody, bodyvalue
 
 log = logging.getLogger( __name__ )
+json = JSON()
+
+# Quoted path segments and base-urls joined with quoted path segments are
+# remembered, so that urls for frequently accessed databases and documents
+# are not quoted again for every request. Caches are reset when full.
+URLCACHE_SIZE = 10000
+_quotecache = {}
+_pathcache = {}
 
 class ReSTful( object ) :
     """ReST-ful (Representational State Transfer) interface to CouchDB server.
@@ -32,13 +46,18 @@ class ReSTful( object ) :
         Dictionary of http-headers that will be used for all http-request
         made my this object. The header fields supplied here are overridable
         via method APIs (in Client, Database and Document instances).
+    ``deadline``,
+        Total time in seconds allowed for every request made by this object,
+        including redirects and retries. Refer to
+        :class:`couchpy.httpc.Deadline`.
     """
 
-    def __init__( self, url, htsess, headers=None ) :
+    def __init__( self, url, htsess, headers=None, deadline=None ) :
         self.url, self.credentials = _extract_credentials(url)
         self.htsess = htsess or self._httpsession()
         self.headers = headers or {}
-        self.is_jsonresp = headers.get('Accept', '') == 'application/json'
+        self.is_jsonresp = self.headers.get('Accept', '') == 'application/json'
+        self.deadline = deadline
 
     def __call__( self, *path, **kwargs ):
         """Return a clone of this object, with more specific url path-info, an
@@ -46,15 +65,22 @@ class ReSTful( object ) :
         """
         obj = type(self)( urljoin(self.url, *path),
                           kwargs.get( 'htsess', self.htsess ),
-                          kwargs.get( 'headers', deepcopy(self.headers) )
+                          kwargs.get( 'headers', dict(self.headers) ),
+                          kwargs.get( 'deadline', self.deadline )
                         )
-        obj.credentials = deepcopy( self.credentials )
+        obj.credentials = self.credentials      # Immutable tuple
         return obj
 
     def _jsonloads( self, hdr, data ) :
         if 'application/json' in hdr.get( 'content-type', '' ) :
-            val = data.getvalue()
-            data = JSON().decode( val ) if val else ''
+            if isinstance( data, SpooledBody ) :
+                # Spooled body is decoded from its mapping and then discarded
+                try     : val = _decodespooled( data )
+                finally : data.close()
+                data = val
+            else :
+                val = data.getvalue()
+                data = json.decode( val ) if val else ''
         return data
 
     def _httpsession( self ):
@@ -62,18 +88,22 @@ class ReSTful( object ) :
         return couchpy.httpc.HttpSession()
 
     def _request( self, method, paths, headers, body, _query, chunk_cb=None ):
-        if isinstance(headers, dict) :
-            all_headers = deepcopy( self.headers )
-            all_headers.update( headers )
+        # Header values are strings, a shallow copy is enough to keep the
+        # instance headers from being modified by the http session.
+        all_headers = dict( self.headers )
+        headers and all_headers.update( headers )
         paths = paths.split('/') if isinstance( paths, basestring ) else paths
-        paths = filter( None, paths )
         url = urljoin( self.url, *paths, _query=_query )
         st = time.time()
-        resp = self.htsess.request(
-                    method, url, body=body, headers=all_headers,
-                    credentials=self.credentials, chunk_cb=chunk_cb
-               )
-        log.info( "%6s %s %s (%s)" % (method, (time.time()-st), url, resp[0]) )
+        dl = Deadline( self.deadline ).start() if self.deadline else None
+        try :
+            resp = self.htsess.request(
+                        method, url, body=body, headers=all_headers,
+                        credentials=self.credentials, chunk_cb=chunk_cb
+                   )
+        finally :
+            dl and dl.stop()
+        log.info( "%6s %s %s (%s)", method, (time.time()-st), url, resp[0] )
         return resp
 
     def _simplecookie( self, cookie ):
@@ -105,12 +135,29 @@ class ReSTful( object ) :
         path-segments ``paths``. Optional ``_query``, which is list of
         key,value tuples to construct url-query.
 
+        If the http session was created with ``coalesce=True``, concurrent
+        identical requests share a single request to the server.
+
         Returns,
             HTTP response - status, headers, data
         """
+        singleflight = getattr( self.htsess, 'singleflight', None )
+        if singleflight is not None and chunk_cb is None and body is None :
+            paths = paths.split('/') if isinstance(paths, basestring) else paths
+            key = ( urljoin( self.url, *paths, _query=_query ),
+                    tuple( sorted( self.mixinhdrs( self.headers, hdrs ).items() )),
+                    self.credentials )
+            fn = lambda : self._get( paths, hdrs, _query, shared=True )
+            return singleflight.do( key, fn )
+        return self._get( paths, hdrs, _query, chunk_cb=chunk_cb, body=body )
+
+    def _get( self, paths, hdrs, _query, chunk_cb=None, body=None,
+              shared=False ):
         s, h, d = self._request( 'GET', paths, hdrs, body, _query,
                                  chunk_cb=chunk_cb )
         d = self._jsonloads( h, d )
+        if shared and hasattr( d, 'getvalue' ) :
+            d = StringIO( bodyvalue( d ))   # Buffer streamed response body
         return s, h, d
 
     def post( self, paths, hdrs, body, _query=[] ):
@@ -171,8 +218,9 @@ class ReSTful( object ) :
     #---- request.
 
     def mixinhdrs( self, *hthdrs ):
-        newhthdrs = dict()
-        [ newhthdrs.update(h) for h in hthdrs ]
+        newhthdrs = {}
+        for h in hthdrs :
+            h and newhthdrs.update( h )
         return newhthdrs
 
     def savecookie( self, hthdrs, cookie ):
@@ -231,12 +279,18 @@ def urljoin( base, *paths, **kwargs ):
     >>> urljoin('http://example.org/', 'foo', '/bar/')
     'http://example.org/foo/%2Fbar%2F'
     """
-    base = base[:-1] if base and base.endswith('/') else base
-    _query = kwargs.get( '_query', [] )
+    key = (base, paths)
+    url = _pathcache.get( key, None )
+    if url is None :
+        base = base[:-1] if base and base.endswith('/') else base
+        pathinfo = '/'.join([ _quote(s) for s in paths if s ])
+        url = '/'.join([ base, pathinfo ])
+        len(_pathcache) >= URLCACHE_SIZE and _pathcache.clear()
+        _pathcache[key] = url
 
-    # build pathinfo
-    pathinfo = '/'.join( _quote(s) for s in paths if s )
-    url = '/'.join([ base, pathinfo ])
+    _query = kwargs.get( '_query', [] )
+    if not _query :
+        return url
 
     # build the query string
     params = []
@@ -269,8 +323,14 @@ def _extract_credentials( url ):
     return urlunsplit(parts), credentials
 
 def _quote( s, safe='' ):
-    s = s.encode('utf-8') if isinstance( s, unicode ) else s
-    return urllib.quote(s, safe)
+    q = _quotecache.get( s, None ) if safe == '' else None
+    if q is None :
+        q = urllib.quote( s.encode('utf-8') if isinstance(s, unicode) else s,
+                          safe )
+        if safe == '' :
+            len(_quotecache) >= URLCACHE_SIZE and _quotecache.clear()
+            _quotecache[s] = q
+    return q
 
 def _urlencode( data ):
     data = data.items() if isinstance(data, dict) else data
@@ -279,5 +339,44 @@ def _urlencode( data ):
     query = '&'.join([ '%s=%s'%(k,v) for k, v in  params ])
     return urllib.quote(query, '&=\'"')
 
+_rowskey = re.compile( r'"([^"\\]+)"\s*:\s*\[$' )
+
+def _decodespooled( data ):
+    """Decode JSON body spooled to ``data``. CouchDB sends rows of views,
+    ``_all_docs`` and the changes feed on lines of their own, such bodies
+    are decoded a row at a time, so that the body is never copied into
+    memory as a whole. Other bodies are decoded as a whole."""
+    lines = data.iterlines()
+    head = next( lines, '' ).strip()
+    m = _rowskey.search( head )
+    if m is not None :
+        rows, tail = [], []
+        try :
+            for line in lines :
+                line = line.strip()
+                if line.startswith( ']' ) :
+                    tail = [ line ] + list( lines )
+                    break
+                line = line.strip( ',' )
+                line and rows.append( json.decode( line ))
+            d = json.decode( head + ''.join( tail )) if tail else None
+            if isinstance( d, dict ) and d.get( m.group(1) ) == [] :
+                d[ m.group(1) ] = rows
+                return d
+        except ValueError :
+            pass                # Not a row per line, decode as a whole.
+    data.seek( 0 )
+    val = data.getvalue()
+    return json.decode( val ) if val else ''
+
+def copyresponse( resp ):
+    """Copy of response ``resp``, a tuple of (status, headers, data),
+    returned to every caller of a coalesced request. Decoded JSON data is
+    deep-copied and file-like data is re-wrapped."""
+    s, h, d = resp
+    if hasattr( d, 'getvalue' ) :
+        return s, h, StringIO( d.getvalue() )
+    return s, h, deepcopy( d )
+
 def data2json( data ):
-    return JSON().encode( data or {} )
+    return json.encode( data or {} )
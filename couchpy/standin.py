@@ -0,0 +1,1509 @@
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+"""A lightweight, in-process HTTP server that stands in for CouchDB. It
+implements the subset of CouchDB API used by couchpy, so that test cases and
+benchmarks can be run without a live server and with repeatable
+performance characteristics. Everything is kept in memory.
+
+>>> server = StandinServer().start()
+>>> couch = Client( server.url )
+>>> couch.put( 'contacts' )
+<Database 'contacts'>
+>>> server.stop()
+
+Supported API,
+
+* ``/``, ``/_all_dbs``, ``/_dbs_info``, ``/_uuids``, ``/_session``,
+  ``/_config``, ``/_stats``, ``/_log``, ``/_active_tasks``, ``/_restart``.
+* Database create, delete, information, ``_all_docs``, ``_bulk_docs``,
+  ``_bulk_get``, ``_changes`` (normal, longpoll and continuous feeds),
+  ``_compact``, ``_view_cleanup``, ``_ensure_full_commit``, ``_security``,
+  ``_revs_limit``, ``_purge`` and ``_temp_view``.
+* Mango queries, ``_find``, ``_explain`` and json indexes with ``_index``.
+  Selectors support the combination operators and most condition operators,
+  ``$text`` and text indexes are not supported.
+* Document CRUD and COPY, including ``rev``, ``revs``, ``revs_info``,
+  ``conflicts`` and ``open_revs`` query parameters, local documents, design
+  documents, standalone and inline attachments. ``_bulk_docs`` accepts
+  ``new_edits=false`` so that conflicting revisions can be created.
+* Design document views, written in python. Map functions can either
+  ``emit( key, value )`` or ``yield key, value``. Reduce functions can be
+  python source or one of the builtins ``_sum``, ``_count`` and ``_stats``.
+  Views are compiled and run by :mod:`couchpy.queryserver`.
+  Views written in other languages can be backed by python callables using
+  :func:`StandinServer.addview`.
+
+There is no authentication and authorization, every user is treated as
+admin, like a freshly installed CouchDB server (admin party).
+
+To benchmark and regression-test latency, pooling and retry behaviour of
+:class:`couchpy.httpc.HttpSession`, every response can be delayed by
+``latency`` seconds and faults can be injected using
+:func:`StandinServer.inject`,
+
+>>> server = StandinServer( latency=0.002 ).start()
+>>> server.inject( path='^/contacts/', status=500, rate=0.1 )
+>>> server.inject( method='GET', reset=True, count=1 ) # Drop the connection
+"""
+
+import re, time, random, logging, urllib, base64, socket
+from   hashlib          import md5
+from   urlparse         import urlsplit, parse_qsl
+from   collections      import deque
+from   BaseHTTPServer   import HTTPServer, BaseHTTPRequestHandler
+from   SocketServer     import ThreadingMixIn
+
+try:
+    from threading       import Thread, RLock, Condition
+except ImportError:
+    from dummy_threading import Thread, RLock, Condition
+
+from   couchpy          import __version__
+from   couchpy.utils    import JSON, collatekey
+from   couchpy.uuids    import uuidgen
+from   couchpy.queryserver import QueryServer, QueryServerError
+
+log = logging.getLogger( __name__ )
+json = JSON()
+
+# Query parameters that are not JSON encoded by clients.
+RAWPARAMS = set([ 'rev', 'feed', 'style', 'filter', 'batch', 'stale',
+                  'startkey_docid', 'endkey_docid', 'new_edits', 'bookmark' ])
+
+class StandinError( Exception ):
+    """Raised by request handlers to respond with CouchDB style error."""
+    def __init__( self, status, error, reason='' ):
+        Exception.__init__( self, status, error, reason )
+        self.status, self.error, self.reason = status, error, reason
+
+
+def _revpos( rev ):
+    return int( rev.split('-', 1)[0] )
+
+def _encodable( body ):
+    """Document ``body`` with attachment data replaced by its digest."""
+    atts = body.get( '_attachments', None )
+    if not atts :
+        return body
+    return dict( body, _attachments=dict([
+                    (name, att['digest']) for name, att in atts.items() ]))
+
+def jsonbody( data ):
+    """Encode response ``data`` like CouchDB, rows of views and ``_all_docs``
+    and results of the changes feed on lines of their own."""
+    key = None
+    if isinstance( data, dict ) :
+        key = 'rows' if isinstance( data.get( 'rows' ), list ) else (
+              'results' if isinstance( data.get( 'results' ), list ) else None)
+    if key is None :
+        return json.encode( data ) + '\n'
+    rest = dict( data )
+    rows = ',\r\n'.join([ json.encode( row ) for row in rest.pop( key ) ])
+    rest = json.encode( rest )[1:-1]
+    if key == 'rows' :
+        return '{%s"rows":[\r\n%s\r\n]}\n' % (rest and (rest + ','), rows)
+    return '{"results":[\r\n%s\r\n]%s}\n' % (rows, rest and (',' + rest))
+
+def _newrev( pos, body, parent ):
+    data = json.encode( _encodable( body )) + (parent or '')
+    return '%d-%s' % (pos, md5( data ).hexdigest())
+
+# Mango selectors
+
+def _getfield( doc, path ):
+    """Return ``(found, value)`` for dotted field ``path`` in ``doc``."""
+    value = doc
+    for name in path.split('.') :
+        if isinstance( value, dict ) and name in value :
+            value = value[name]
+        else :
+            return False, None
+    return True, value
+
+def _jsontype( value ):
+    if value is None : return 'null'
+    if isinstance( value, bool ) : return 'boolean'
+    if isinstance( value, (int, long, float) ) : return 'number'
+    if isinstance( value, basestring ) : return 'string'
+    if isinstance( value, list ) : return 'array'
+    return 'object'
+
+def _cmp( a, b ):
+    return cmp( collatekey(a), collatekey(b) )
+
+_conditions = {
+    '$eq'  : lambda v, arg : _cmp( v, arg ) == 0,
+    '$ne'  : lambda v, arg : _cmp( v, arg ) != 0,
+    '$gt'  : lambda v, arg : _cmp( v, arg ) > 0,
+    '$gte' : lambda v, arg : _cmp( v, arg ) >= 0,
+    '$lt'  : lambda v, arg : _cmp( v, arg ) < 0,
+    '$lte' : lambda v, arg : _cmp( v, arg ) <= 0,
+    '$in'  : lambda v, arg : any([ _cmp( v, a ) == 0 for a in arg ]),
+    '$nin' : lambda v, arg : all([ _cmp( v, a ) != 0 for a in arg ]),
+    '$type'  : lambda v, arg : _jsontype( v ) == arg,
+    '$size'  : lambda v, arg : isinstance( v, list ) and len( v ) == arg,
+    '$mod'   : lambda v, arg : isinstance( v, (int, long) ) and \
+                               not isinstance( v, bool ) and \
+                               v % arg[0] == arg[1],
+    '$regex' : lambda v, arg : isinstance( v, basestring ) and \
+                               re.search( arg, v ) is not None,
+    '$all'   : lambda v, arg : isinstance( v, list ) and all([
+                    any([ _cmp( x, a ) == 0 for x in v ]) for a in arg ]),
+    '$elemMatch' : lambda v, arg : isinstance( v, list ) and any([
+                    _matchvalue( x, arg ) for x in v ]),
+    '$allMatch'  : lambda v, arg : isinstance( v, list ) and bool( v ) and \
+                    all([ _matchvalue( x, arg ) for x in v ]),
+}
+
+def _matchvalue( value, cond ):
+    """Match ``value`` against a field condition, or against a sub-selector
+    when value is an object."""
+    if not isinstance( cond, dict ) :
+        return _cmp( value, cond ) == 0
+    if cond and not [ op for op in cond if op.startswith('$') ] :
+        return isinstance( value, dict ) and matchselector( cond, value )
+    return matchselector( cond, value, field=True )
+
+def matchselector( selector, doc, field=False ):
+    """Return True if ``doc`` matches Mango ``selector``. If ``field`` is
+    True, ``doc`` is a field value and ``selector`` its condition."""
+    for key, arg in selector.items() :
+        if key == '$and' :
+            ok = all([ matchselector( s, doc, field ) for s in arg ])
+        elif key == '$or' :
+            ok = any([ matchselector( s, doc, field ) for s in arg ])
+        elif key == '$nor' :
+            ok = not any([ matchselector( s, doc, field ) for s in arg ])
+        elif key == '$not' :
+            ok = not matchselector( arg, doc, field )
+        elif field and key == '$exists' :
+            ok = arg
+        elif field and key in _conditions :
+            ok = _conditions[key]( doc, arg )
+        elif key.startswith('$') :
+            raise StandinError( 400, 'invalid_operator',
+                                'Invalid operator: %s' % key )
+        elif field :
+            ok = isinstance( doc, dict ) and matchselector({ key : arg }, doc )
+        else :
+            found, value = _getfield( doc, key )
+            if isinstance( arg, dict ) and '$exists' in arg :
+                ok = found == arg['$exists'] and ( not found or
+                        _matchvalue( value, dict([ (k, v) for k, v in
+                                     arg.items() if k != '$exists' ])) )
+            else :
+                ok = found and _matchvalue( value, arg )
+        if not ok :
+            return False
+    return True
+
+def selectorfields( selector ):
+    """Set of fields constrained by ``selector``, following ``$and``."""
+    fields = set()
+    for key, arg in selector.items() :
+        if key == '$and' :
+            [ fields.update( selectorfields(s) ) for s in arg ]
+        elif not key.startswith('$') :
+            fields.add( key )
+    return fields
+
+
+class _Doc( object ):
+    """Revision tree of a single document. Revision bodies are remembered
+    until the database is compacted, then only leaf revisions are kept."""
+
+    def __init__( self, _id ):
+        self.id, self.seq = _id, 0
+        self.bodies = {}        # rev -> document body
+        self.parents = {}       # rev -> parent rev
+        self.leaves = set()
+
+    def winner( self ):
+        return max( self.leaves, key=lambda r : (
+                        not self.bodies[r].get('_deleted', False),
+                        _revpos(r), r ))
+
+    def deleted( self ):
+        return self.bodies[ self.winner() ].get( '_deleted', False )
+
+    def conflicts( self ):
+        w = self.winner()
+        return sorted([ r for r in self.leaves if r != w and
+                        not self.bodies[r].get('_deleted', False) ],
+                      reverse=True )
+
+    def history( self, rev ):
+        revs = []
+        while rev :
+            revs.append( rev )
+            rev = self.parents.get( rev, None )
+        return revs
+
+    def add( self, rev, body, parent ):
+        self.bodies[rev], self.parents[rev] = body, parent
+        self.leaves.discard( parent )
+        self.leaves.add( rev )
+
+
+class _Database( object ):
+
+    def __init__( self, name ):
+        self.name = name
+        self.docs, self.local = {}, {}
+        self.seq, self.purge_seq = 0, 0
+        self.security, self.revs_limit = {}, 1000
+        self.viewcache = {}
+        self.start_time = '%d' % (time.time() * 1000000)
+
+    def info( self ):
+        live = [ d for d in self.docs.values() if not d.deleted() ]
+        return { 'db_name'              : self.name,
+                 'doc_count'            : len(live),
+                 'doc_del_count'        : len(self.docs) - len(live),
+                 'update_seq'           : self.seq,
+                 'purge_seq'            : self.purge_seq,
+                 'compact_running'      : False,
+                 'disk_size'            : sum([
+                        len( json.encode( _encodable(b) ))
+                        for d in self.docs.values() for b in d.bodies.values() ]),
+                 'instance_start_time'  : self.start_time,
+                 'disk_format_version'  : 5,
+                 'committed_update_seq' : self.seq }
+
+
+class StandinServer( ThreadingMixIn, HTTPServer ):
+    """In-process stand-in for CouchDB server, listening on ``host`` and
+    ``port``. If ``port`` is 0, an unused port is picked.
+
+    ``latency``,
+        Seconds to delay every response, or a callable accepting
+        ``(method, path)`` and returning the delay.
+    ``admins``,
+        Dictionary of admin users, returned by ``/_config/admins``.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__( self, host='127.0.0.1', port=0, latency=0, admins=None ):
+        HTTPServer.__init__( self, (host, port), StandinHandler )
+        self.url = 'http://%s:%s' % self.server_address[:2]
+        self.latency = latency
+        self.lock = RLock()
+        self.changed = Condition( self.lock )
+        self.dbs, self.sessions, self.faults = {}, {}, []
+        self.connections = set()
+        self.views = {}         # (db, ddoc, view) -> (mapfn, reducefn)
+        self.queryserver = QueryServer()    # Compiles python views
+        self.config = { 'uuids' : { 'algorithm' : 'utc_random' },
+                        'admins' : dict( admins or {} ),
+                        'couchdb' : { 'version' : __version__ } }
+        self.logs = deque( maxlen=5000 )
+        self.counters = {}
+        self.uuidgen = uuidgen( 'utc_random' )
+        self.thread = None
+
+    def start( self ):
+        """Start serving requests in a background thread. Return self."""
+        self.thread = Thread( target=self.serve_forever )
+        self.thread.setDaemon( True )
+        self.thread.start()
+        return self
+
+    def stop( self ):
+        """Stop serving requests and close the listening socket."""
+        self.shutdown()
+        self.server_close()
+        for conn in list( self.connections ) :   # Idle keep-alive connections
+            try :
+                conn.shutdown( socket.SHUT_RDWR )
+            except socket.error :
+                pass
+        deadline = time.time() + 1.0
+        while self.connections and time.time() < deadline :
+            time.sleep( 0.01 )
+        self.thread and self.thread.join()
+
+    def inject( self, path=None, method=None, status=500, rate=1.0,
+                count=None, reset=False, delay=0 ):
+        """Inject a fault for requests matching ``method`` and ``path``
+        regular expression (matched against url path with query). A matching
+        request fails with probability ``rate``, either by responding with
+        ``status`` or, if ``reset`` is True, by closing the connection without
+        a response. ``delay`` seconds is added to the latency of matching
+        requests. The fault is removed after it has triggered ``count`` times.
+        Return the fault dictionary, which counts ``hits``.
+        """
+        fault = { 'path'   : path and re.compile( path ),
+                  'method' : method,   'status' : status,
+                  'rate'   : rate,     'count'  : count,
+                  'reset'  : reset,    'delay'  : delay,
+                  'hits'   : 0 }
+        self.faults.append( fault )
+        return fault
+
+    def clearfaults( self ):
+        """Remove all injected faults."""
+        self.faults = []
+
+    def addview( self, dbname, ddoc, viewname, mapfn, reducefn=None ):
+        """Back view ``viewname`` of design document ``ddoc`` in database
+        ``dbname`` with python callables. ``mapfn(doc)`` must return a list
+        of ``(key, value)`` and ``reducefn(keys, values, rereduce)`` must
+        return the reduced value."""
+        self.views[ (dbname, ddoc, viewname) ] = (mapfn, reducefn)
+
+    def fault( self, method, path ):
+        for fault in self.faults :
+            if fault['method'] and fault['method'] != method :
+                continue
+            if fault['path'] and not fault['path'].search( path ) :
+                continue
+            if random.random() >= fault['rate'] :
+                continue
+            fault['hits'] += 1
+            if fault['count'] is not None and fault['hits'] >= fault['count'] :
+                self.faults.remove( fault )
+            return fault
+        return None
+
+    def handle_error( self, request, client_address ):
+        log.debug( 'Error handling request from %s', client_address,
+                   exc_info=True )
+
+    def count( self, name, incr=1 ):
+        self.counters[name] = self.counters.get( name, 0 ) + incr
+
+    def getdb( self, name ):
+        db = self.dbs.get( name, None )
+        if db is None :
+            raise StandinError( 404, 'not_found', 'no_db_file' )
+        return db
+
+
+class StandinHandler( BaseHTTPRequestHandler ):
+    """Request handler, dispatches requests to ``h_*`` methods."""
+
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1       # Buffer response writes, flushed after every request
+    server_version = 'CouchDB/%s (couchpy standin)' % __version__
+
+    def log_message( self, format, *args ):
+        pass
+
+    def setup( self ):
+        self.request.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+        BaseHTTPRequestHandler.setup( self )
+        self.server.connections.add( self.connection )
+
+    def finish( self ):
+        try :
+            BaseHTTPRequestHandler.finish( self )
+        except socket.error :
+            pass
+        self.server.connections.discard( self.connection )
+
+    def do_GET( self )    : self.dispatch( 'GET' )
+    def do_HEAD( self )   : self.dispatch( 'HEAD' )
+    def do_PUT( self )    : self.dispatch( 'PUT' )
+    def do_POST( self )   : self.dispatch( 'POST' )
+    def do_DELETE( self ) : self.dispatch( 'DELETE' )
+    def do_COPY( self )   : self.dispatch( 'COPY' )
+
+    def dispatch( self, method ):
+        server, st = self.server, time.time()
+        self.method = method
+        self.body = self.readbody()
+        fault = server.fault( method, self.path )
+        latency = server.latency(method, self.path) \
+                  if callable(server.latency) else server.latency
+        latency += fault['delay'] if fault else 0
+        latency and time.sleep( latency )
+        if fault and fault['reset'] :
+            self.close_connection = 1
+            return
+        parts = urlsplit( self.path )
+        self.segs = [ urllib.unquote(s) for s in parts.path.split('/') if s ]
+        self.query = self.parseqs( parts.query )
+        try :
+            if fault :
+                raise StandinError( fault['status'], 'injected_fault',
+                                    'Fault injected by standin server' )
+            server.lock.acquire()
+            try :
+                server.count( 'httpd.requests' )
+                server.count( 'httpd_request_methods.%s' % method )
+            finally :
+                server.lock.release()
+            self.route()
+        except StandinError, e :
+            self.respond( e.status, { 'error' : e.error, 'reason' : e.reason })
+        except Exception, e :
+            log.exception( e )
+            self.respond( 500, { 'error' : 'unknown_error', 'reason' : str(e) })
+        server.lock.acquire()
+        try :
+            server.count( 'couchdb.request_time', (time.time() - st) * 1000 )
+            server.logs.append(
+                '[%s] [info] [<0.%d.0>] %s - - %s %s %s\n' % (
+                time.strftime( '%a, %d %b %Y %H:%M:%S GMT', time.gmtime() ),
+                id(self) % 100000, self.client_address[0], method,
+                self.path, getattr(self, 'status', 500) ))
+        finally :
+            server.lock.release()
+
+    def readbody( self ):
+        # Like CouchDB, Content-Length is honoured even when the request also
+        # claims chunked transfer encoding.
+        length = self.headers.get( 'content-length', None )
+        if length is not None :
+            return self.rfile.read( int(length) ) if int(length) else ''
+        elif self.headers.get( 'transfer-encoding', '' ) == 'chunked' :
+            chunks = []
+            while True :
+                size = int( self.rfile.readline().strip(), 16 )
+                chunks.append( self.rfile.read(size) )
+                self.rfile.readline()
+                if size == 0 : break
+            return ''.join( chunks )
+        return ''
+
+    def parseqs( self, qs ):
+        query = {}
+        for key, value in parse_qsl( qs, keep_blank_values=True ) :
+            if key not in RAWPARAMS :
+                try :
+                    value = json.decode( value )
+                except Exception :
+                    pass
+            query[key] = value
+        return query
+
+    def jsonbody( self ):
+        try :
+            return json.decode( self.body ) if self.body else {}
+        except Exception :
+            raise StandinError( 400, 'bad_request', 'invalid UTF-8 JSON' )
+
+    def respond( self, status, data, ctype='application/json', headers={} ):
+        body = data if ctype != 'application/json' else jsonbody( data )
+        self.status = status
+        self.send_response( status )
+        self.send_header( 'Content-Type', ctype )
+        self.send_header( 'Content-Length', str(len(body)) )
+        self.send_header( 'Cache-Control', 'must-revalidate' )
+        [ self.send_header( k, v ) for k, v in headers.items() ]
+        self.end_headers()
+        self.method != 'HEAD' and self.wfile.write( body )
+
+    def startchunked( self, status=200 ):
+        self.status = status
+        self.send_response( status )
+        self.send_header( 'Content-Type', 'application/json' )
+        self.send_header( 'Transfer-Encoding', 'chunked' )
+        self.end_headers()
+
+    def writechunk( self, data ):
+        self.wfile.write( '%x\r\n%s\r\n' % (len(data), data) )
+        self.wfile.flush()
+
+    #---- Routing
+
+    def route( self ):
+        server, segs, method = self.server, self.segs, self.method
+        if len(segs) > 1 and segs[1].startswith( '_design/' ) :
+            segs[1:2] = segs[1].split( '/', 1 )
+        if not segs :
+            return self.h_root()
+        elif segs[0].startswith( '_' ) :
+            fn = getattr( self, 'h%s' % segs[0], None )
+            if fn is None :
+                raise StandinError( 400, 'illegal_database_name',
+                                    'Only lowercase characters allowed' )
+            return fn()
+        elif len(segs) == 1 :
+            return self.h_db( segs[0] )
+        server.lock.acquire()
+        try :
+            db = server.getdb( segs[0] )
+        finally :
+            server.lock.release()
+        if segs[1] == '_changes' :      # Might block, handled without lock.
+            return self.h_changes( db )
+        server.lock.acquire()
+        try :
+            if segs[1] == '_local' :
+                return self.h_localdoc( db, '/'.join( segs[2:] ))
+            elif segs[1] == '_design' and len(segs) > 3 :
+                return self.h_design( db, '_design/%s' % segs[2], segs[3:] )
+            elif segs[1] == '_design' :
+                return self.h_doc( db, '_design/%s' % segs[2] )
+            elif segs[1].startswith( '_' ) :
+                fn = getattr( self, 'hdb%s' % segs[1], None )
+                if fn is None :
+                    raise StandinError( 404, 'not_found', 'missing' )
+                return fn( db )
+            elif len(segs) > 2 :
+                return self.h_attachment( db, segs[1], '/'.join(segs[2:]) )
+            else :
+                return self.h_doc( db, segs[1] )
+        finally :
+            server.lock.release()
+
+    #---- Server API
+
+    def h_root( self ):
+        self.respond( 200, { 'couchdb' : 'Welcome', 'version' : __version__ })
+
+    def h_all_dbs( self ):
+        self.respond( 200, sorted( self.server.dbs.keys() ))
+
+    def h_dbs_info( self ):
+        server, rows = self.server, []
+        for key in self.jsonbody().get( 'keys', [] ) :
+            db = server.dbs.get( key, None )
+            rows.append( { 'key' : key, 'info' : db.info() } if db else
+                         { 'key' : key, 'error' : 'not_found' } )
+        self.respond( 200, rows )
+
+    def h_uuids( self ):
+        count = int( self.query.get( 'count', 1 ))
+        self.respond( 200, { 'uuids' : self.server.uuidgen.take( count ) })
+
+    def h_active_tasks( self ):
+        self.respond( 200, [] )
+
+    def h_restart( self ):
+        self.respond( 200, { 'ok' : True } )
+
+    def h_replicate( self ):
+        raise StandinError( 501, 'not_implemented', 'Replication' )
+
+    def h_stats( self ):
+        server, tree = self.server, {}
+        for name, value in server.counters.items() :
+            section, key = name.split( '.', 1 )
+            tree.setdefault( section, {} )[key] = { 'current' : value }
+        tree.setdefault( 'couchdb', {} )['open_databases'] = \
+                { 'current' : len( server.dbs ) }
+        if 'request_time' in tree['couchdb'] :
+            tree['couchdb']['request_time']['mean'] = \
+                tree['couchdb']['request_time']['current'] / \
+                (server.counters.get( 'httpd.requests' ) or 1)
+        if len(self.segs) > 1 :         # /_stats/<section>[/<key>]
+            section = tree.get( self.segs[1], {} )
+            if len(self.segs) > 2 :
+                section = { self.segs[2] : section.get( self.segs[2], {} ) }
+            tree = { self.segs[1] : section }
+        self.respond( 200, tree )
+
+    def h_log( self ):
+        server = self.server
+        bytes = int( self.query.get( 'bytes', 1000 ))
+        offset = int( self.query.get( 'offset', 0 ))
+        server.lock.acquire()
+        try :
+            text = ''.join( server.logs )
+        finally :
+            server.lock.release()
+        end = max( len(text) - offset, 0 )
+        self.respond( 200, text[ max(end-bytes, 0) : end ], ctype='text/plain' )
+
+    def h_config( self ):
+        config, segs = self.server.config, self.segs[1:]
+        if self.method == 'GET' :
+            value = config
+            for seg in segs :
+                if seg not in value :
+                    raise StandinError( 404, 'not_found', 'unknown_config_value' )
+                value = value[seg]
+            return self.respond( 200, value )
+        elif len(segs) != 2 :
+            raise StandinError( 405, 'method_not_allowed', self.method )
+        section = config.setdefault( segs[0], {} )
+        old = section.get( segs[1], '' )
+        if self.method == 'PUT' :
+            section[ segs[1] ] = self.jsonbody()
+        elif self.method == 'DELETE' :
+            section.pop( segs[1], None )
+        self.respond( 200, old )
+
+    def h_session( self ):
+        server = self.server
+        if self.method == 'POST' :
+            form = dict( parse_qsl( self.body ))
+            name = form.get( 'name', None )
+            cookie = base64.b64encode( '%s:%s' % (name, time.time()) )
+            server.sessions[ cookie ] = name
+            roles = self.roles( name )
+            return self.respond( 200, { 'ok' : True, 'name' : name,
+                                        'roles' : roles },
+                headers={ 'Set-Cookie' : 'AuthSession=%s; Version=1; Path=/; '
+                                         'HttpOnly' % cookie } )
+        elif self.method == 'DELETE' :
+            return self.respond( 200, { 'ok' : True },
+                headers={ 'Set-Cookie' : 'AuthSession=; Version=1; Path=/; '
+                                         'HttpOnly' } )
+        name = self.sessionuser()
+        self.respond( 200, {
+            'ok' : True,
+            'userCtx' : { 'name' : name, 'roles' : self.roles( name ) },
+            'info' : { 'authentication_db' : '_users',
+                       'authentication_handlers' : ['cookie', 'default'] }
+        })
+
+    def sessionuser( self ):
+        m = re.search( r'AuthSession=([^;, ]+)', self.headers.get('cookie', '') )
+        name = self.server.sessions.get( m.group(1), None ) if m else None
+        auth = self.headers.get( 'authorization', '' )
+        if name is None and auth.startswith( 'Basic ' ) :
+            name = base64.b64decode( auth[6:] ).split( ':', 1 )[0]
+        return name
+
+    def roles( self, name ):
+        admins = self.server.config['admins']
+        return [ '_admin' ] if (not admins) or (name in admins) else []
+
+    #---- Database API
+
+    def h_db( self, name ):
+        server = self.server
+        server.lock.acquire()
+        try :
+            if self.method in ('GET', 'HEAD') :
+                self.respond( 200, server.getdb( name ).info() )
+            elif self.method == 'PUT' :
+                if name in server.dbs :
+                    raise StandinError( 412, 'file_exists', 'The database '
+                                        'could not be created, the file '
+                                        'already exists.' )
+                server.dbs[name] = _Database( name )
+                self.respond( 201, { 'ok' : True } )
+            elif self.method == 'DELETE' :
+                server.getdb( name )
+                server.dbs.pop( name )
+                server.changed.notifyAll()
+                self.respond( 200, { 'ok' : True } )
+            elif self.method == 'POST' :
+                doc = self.jsonbody()
+                doc.setdefault( '_id', server.uuidgen.next() )
+                rev = self.update( server.getdb(name), doc )
+                status = 202 if self.query.get( 'batch', None ) == 'ok' else 201
+                self.respond( status, { 'ok' : True, 'id' : doc['_id'],
+                                        'rev' : rev } )
+            else :
+                raise StandinError( 405, 'method_not_allowed', self.method )
+        finally :
+            server.lock.release()
+
+    def hdb_compact( self, db ):
+        for doc in db.docs.values() :       # Keep only leaf revisions
+            for rev in doc.bodies.keys() :
+                rev in doc.leaves or doc.bodies.pop( rev )
+        self.respond( 202, { 'ok' : True } )
+
+    def hdb_view_cleanup( self, db ):
+        db.viewcache = {}
+        self.respond( 202, { 'ok' : True } )
+
+    def hdb_ensure_full_commit( self, db ):
+        self.respond( 201, { 'ok' : True, 'instance_start_time' :
+                             db.start_time })
+
+    def hdb_security( self, db ):
+        if self.method == 'PUT' :
+            db.security = self.jsonbody()
+            return self.respond( 200, { 'ok' : True } )
+        self.respond( 200, db.security )
+
+    def hdb_revs_limit( self, db ):
+        if self.method == 'PUT' :
+            db.revs_limit = int( self.jsonbody() )
+            return self.respond( 200, { 'ok' : True } )
+        self.respond( 200, db.revs_limit )
+
+    def hdb_purge( self, db ):
+        purged = {}
+        for _id, revs in self.jsonbody().items() :
+            doc = db.docs.get( _id, None )
+            if doc is None : continue
+            for rev in revs :
+                if rev in doc.leaves :
+                    doc.leaves.discard( rev )
+                    purged.setdefault( _id, [] ).append( rev )
+            keep = set( r for leaf in doc.leaves for r in doc.history(leaf) )
+            keep.difference_update( purged.get( _id, [] ))
+            for rev in doc.bodies.keys() :
+                rev in keep or doc.bodies.pop( rev )
+            if not doc.leaves :
+                db.docs.pop( _id )
+        db.purge_seq += 1
+        db.viewcache = {}
+        self.respond( 200, { 'purge_seq' : db.purge_seq, 'purged' : purged })
+
+    def hdb_bulk_docs( self, db ):
+        body = self.jsonbody()
+        new_edits = body.get( 'new_edits', True )
+        results = []
+        for doc in body.get( 'docs', [] ) :
+            doc.setdefault( '_id', self.server.uuidgen.next() )
+            try :
+                rev = self.update( db, doc, new_edits=new_edits )
+                new_edits and results.append({ 'id' : doc['_id'], 'rev' : rev })
+            except StandinError, e :
+                results.append({ 'id' : doc['_id'], 'error' : e.error,
+                                 'reason' : e.reason })
+        self.respond( 201, results )
+
+    def hdb_bulk_get( self, db ):
+        if self.method != 'POST' :
+            raise StandinError( 405, 'method_not_allowed',
+                                'Only POST allowed' )
+        q = self.query
+        results = []
+        for req in self.jsonbody().get( 'docs', [] ) :
+            _id, rev = req.get( 'id', None ), req.get( 'rev', None )
+            try :
+                doc = self.getrecord( db, _id )
+                if rev and q.get( 'latest', False ) :
+                    leaves = [ r for r in doc.leaves
+                               if rev in doc.history( r ) ]
+                    rev = leaves and max( leaves, key=_revpos ) or rev
+                rev = rev or doc.winner()
+                if rev not in doc.bodies :
+                    raise StandinError( 404, 'not_found', 'missing' )
+                body = self.docbody( doc, rev, q.get( 'attachments', False ))
+                self.docextras( doc, rev, body, q )
+                item = { 'ok' : body }
+            except StandinError, e :
+                item = { 'error' : { 'id' : _id, 'rev' : rev or 'undefined',
+                                     'error' : e.error, 'reason' : e.reason }}
+            results.append({ 'id' : _id, 'docs' : [ item ] })
+        self.respond( 200, { 'results' : results })
+
+    def hdb_all_docs( self, db ):
+        q = self.query
+        keys = self.jsonbody().get( 'keys', None ) if self.method == 'POST' \
+               else q.get( 'keys', None )
+        include_docs = q.get( 'include_docs', False )
+        rows = []
+        if keys is not None :
+            for key in keys :
+                doc = db.docs.get( key, None )
+                if doc is None :
+                    rows.append({ 'key' : key, 'error' : 'not_found' })
+                    continue
+                rev = doc.winner()
+                value = { 'rev' : rev }
+                doc.deleted() and value.update( deleted=True )
+                row = { 'id' : key, 'key' : key, 'value' : value }
+                if include_docs :
+                    row['doc'] = None if doc.deleted() else \
+                                 self.alldocsbody( doc, rev )
+                rows.append( row )
+            return self.respond( 200, { 'total_rows' : len(db.docs),
+                                        'offset' : 0, 'rows' : rows })
+        ids = sorted([ _id for _id, d in db.docs.items() if not d.deleted() ])
+        for _id in ids :
+            doc = db.docs[_id]
+            row = { 'id' : _id, 'key' : _id, 'value' : {'rev' : doc.winner()} }
+            include_docs and row.update(
+                                doc=self.alldocsbody( doc, doc.winner() ))
+            rows.append( row )
+        offset, rows = self.slicerows( rows, keyfn=lambda k : k )
+        self.respond( 200, { 'total_rows' : len(ids), 'offset' : offset,
+                             'rows' : rows })
+
+    def alldocsbody( self, doc, rev ):
+        body = self.docbody( doc, rev )
+        self.query.get( 'conflicts', False ) and \
+                self.docextras( doc, rev, body, { 'conflicts' : True })
+        return body
+
+    def hdb_temp_view( self, db ):
+        self.runview( db, None, self.jsonbody() )
+
+    #---- Mango queries
+
+    def hdb_index( self, db ):
+        if self.method == 'GET' :
+            indexes = self.mangoindexes( db )
+            return self.respond( 200, { 'total_rows' : len(indexes),
+                                        'indexes' : indexes })
+        elif self.method == 'POST' :
+            return self.createindex( db, self.jsonbody() )
+        elif self.method == 'DELETE' :
+            path = '/'.join( self.segs[2:] )
+            path = path[8:] if path.startswith( '_design/' ) else path
+            parts = path.split( '/' )
+            if len(parts) != 3 :
+                raise StandinError( 400, 'bad_request',
+                                    'Invalid index path, expected '
+                                    '_index/<ddoc>/<type>/<name>' )
+            return self.deleteindex( db, '_design/%s' % parts[0], parts[2] )
+        raise StandinError( 405, 'method_not_allowed',
+                            'Only GET,POST,DELETE allowed' )
+
+    def mangoindexes( self, db ):
+        """List of index definitions, starting with the special
+        ``_all_docs`` index."""
+        indexes = [{ 'ddoc' : None, 'name' : '_all_docs', 'type' : 'special',
+                     'def' : { 'fields' : [{ '_id' : 'asc' }] }}]
+        for _id in sorted( db.docs ) :
+            doc = db.docs[_id]
+            if not _id.startswith( '_design/' ) or doc.deleted() :
+                continue
+            ddoc = doc.bodies[ doc.winner() ]
+            if ddoc.get( 'language', None ) != 'query' :
+                continue
+            for name in sorted( ddoc.get( 'views', {} )) :
+                view = ddoc['views'][name]
+                indexes.append({ 'ddoc' : _id, 'name' : name, 'type' : 'json',
+                                 'def' : view['options']['def'] })
+        return indexes
+
+    def createindex( self, db, body ):
+        index, itype = body.get( 'index', None ), body.get( 'type', 'json' )
+        if not isinstance( index, dict ) or not index.get( 'fields', None ) :
+            raise StandinError( 400, 'missing_required_key',
+                                'Missing required key: fields' )
+        if itype != 'json' :
+            raise StandinError( 400, 'invalid_index_type',
+                                'Standin server supports json indexes only' )
+        fields = [ f if isinstance( f, dict ) else { f : 'asc' }
+                   for f in index['fields'] ]
+        idef = { 'fields' : fields }
+        if index.get( 'partial_filter_selector', None ) :
+            idef['partial_filter_selector'] = index['partial_filter_selector']
+        digest = md5( json.encode( idef )).hexdigest()
+        ddocid = body.get( 'ddoc', None ) or digest
+        ddocid = ddocid if ddocid.startswith( '_design/' ) \
+                 else '_design/%s' % ddocid
+        name = body.get( 'name', None ) or digest
+
+        doc = db.docs.get( ddocid, None )
+        if doc and not doc.deleted() :
+            ddoc = self.docbody( doc, doc.winner() )
+        else :
+            ddoc = { '_id' : ddocid, 'language' : 'query' }
+        views = ddoc.setdefault( 'views', {} )
+        if name in views and views[name]['options']['def'] == idef :
+            return self.respond( 200, { 'result' : 'exists', 'id' : ddocid,
+                                        'name' : name })
+        views[name] = { 'map' : { 'fields' : dict( f.items()[0]
+                                                   for f in fields ) },
+                        'reduce' : '_count',
+                        'options' : { 'def' : idef } }
+        self.update( db, ddoc )
+        self.respond( 200, { 'result' : 'created', 'id' : ddocid,
+                             'name' : name })
+
+    def deleteindex( self, db, ddocid, name ):
+        doc = db.docs.get( ddocid, None )
+        ddoc = doc and not doc.deleted() and self.docbody( doc, doc.winner() )
+        if not ddoc or name not in ddoc.get( 'views', {} ) :
+            raise StandinError( 404, 'not_found', 'Index not found' )
+        ddoc['views'].pop( name )
+        if not ddoc['views'] :
+            ddoc = { '_id' : ddocid, '_rev' : ddoc['_rev'], '_deleted' : True }
+        self.update( db, ddoc )
+        self.respond( 200, { 'ok' : True })
+
+    def mangoplan( self, db, body ):
+        """Pick the index for query ``body``. Return ``(index, order,
+        descending, warning)``, where ``order`` is the list of fields that
+        results are sorted by."""
+        selector = body.get( 'selector', None )
+        if not isinstance( selector, dict ) :
+            raise StandinError( 400, 'missing_required_key',
+                                'Missing required key: selector' )
+        sort = [ s if isinstance( s, dict ) else { s : 'asc' }
+                 for s in body.get( 'sort', None ) or [] ]
+        sortfields = [ s.keys()[0] for s in sort ]
+        directions = set([ s.values()[0] for s in sort ])
+        if len(directions) > 1 :
+            raise StandinError( 400, 'unsupported_mixed_sort',
+                                'Sorts currently only support a single '
+                                'direction for all fields.' )
+        descending = directions == set([ 'desc' ])
+
+        use_index = body.get( 'use_index', None )
+        if isinstance( use_index, basestring ) :
+            use_index = [ use_index ]
+        if use_index :
+            ddoc = use_index[0] if use_index[0].startswith( '_design/' ) \
+                   else '_design/%s' % use_index[0]
+            use_index = [ ddoc ] + list( use_index[1:] )
+
+        fields = selectorfields( selector )
+        usable, named = [], []
+        for index in self.mangoindexes( db ) :
+            ifields = [ f.keys()[0] for f in index['def']['fields'] ]
+            if index['type'] == 'special' :
+                if sortfields and sortfields != [ '_id' ] :
+                    continue
+            elif not set( ifields ) <= fields :
+                continue
+            elif sortfields and ifields[ :len(sortfields) ] != sortfields :
+                continue
+            if use_index and [ index['ddoc'], index['name'] ][
+                                    :len(use_index) ] == use_index :
+                named.append( index )
+            elif not index['def'].get( 'partial_filter_selector', None ) :
+                usable.append( index )
+
+        warning = None
+        if named :
+            usable = named
+        elif use_index :
+            warning = '%s was not used because it does not contain a valid ' \
+                      'index for this query.' % ', '.join( use_index )
+        if not usable :
+            raise StandinError( 400, 'no_usable_index',
+                                'No index exists for this sort, try indexing '
+                                'by the sort fields.' )
+        index = max( usable, key=lambda i : ( i['type'] != 'special',
+                                              len( i['def']['fields'] )))
+        if index['type'] == 'special' and not use_index :
+            warning = 'No matching index found, create an index to ' \
+                      'optimize query time.'
+        order = [ f.keys()[0] for f in index['def']['fields'] ]
+        return index, order, descending, warning
+
+    def hdb_explain( self, db ):
+        body = self.jsonbody()
+        index, order, descending, warning = self.mangoplan( db, body )
+        self.respond( 200, {
+            'dbname'   : db.name,
+            'index'    : index,
+            'selector' : body['selector'],
+            'opts'     : { 'use_index' : body.get( 'use_index', [] ),
+                           'bookmark'  : body.get( 'bookmark', 'nil' ),
+                           'limit'     : body.get( 'limit', 25 ),
+                           'skip'      : body.get( 'skip', 0 ),
+                           'sort'      : body.get( 'sort', {} ),
+                           'fields'    : body.get( 'fields', 'all_fields' ),
+                           'r'         : [ 49 ],
+                           'conflicts' : False },
+            'limit'    : body.get( 'limit', 25 ),
+            'skip'     : body.get( 'skip', 0 ),
+            'fields'   : body.get( 'fields', None ) or 'all_fields',
+        })
+
+    def hdb_find( self, db ):
+        st = time.time()
+        q = self.jsonbody()
+        index, order, descending, warning = self.mangoplan( db, q )
+        partial = index['def'].get( 'partial_filter_selector', None )
+        selector = q['selector']
+        rows, examined = [], 0
+        for _id, doc in db.docs.items() :
+            if doc.deleted() or _id.startswith( '_design/' ) :
+                continue
+            examined += 1
+            body = self.docbody( doc, doc.winner() )
+            values = [ _getfield( body, f ) for f in order ]
+            if not all([ found for found, v in values ]) :
+                continue            # Document not in the index
+            if partial and not matchselector( partial, body ) :
+                continue
+            if matchselector( selector, body ) :
+                key = [ [ v for found, v in values ], _id ]
+                rows.append( (collatekey( key ), key, body) )
+        rows.sort( reverse=descending )
+
+        bookmark = q.get( 'bookmark', None )
+        if bookmark and bookmark != 'nil' :
+            try :
+                after = collatekey( json.decode( base64.urlsafe_b64decode(
+                                                    str(bookmark) )))
+            except Exception :
+                raise StandinError( 400, 'invalid_bookmark',
+                                    'Invalid bookmark value: %s' % bookmark )
+            rows = [ r for r in rows
+                     if (r[0] < after if descending else r[0] > after) ]
+        skip, limit = q.get( 'skip', 0 ), q.get( 'limit', 25 )
+        rows = rows[ skip : skip + limit ]
+
+        fields = q.get( 'fields', None )
+        docs = []
+        for _, key, doc in rows :
+            if fields :
+                proj = {}
+                for f in fields :
+                    found, value = _getfield( doc, f )
+                    if not found : continue
+                    names, d = f.split('.'), proj
+                    for name in names[:-1] :
+                        d = d.setdefault( name, {} )
+                    d[ names[-1] ] = value
+                doc = proj
+            docs.append( doc )
+
+        resp = { 'docs' : docs }
+        resp['bookmark'] = \
+            base64.urlsafe_b64encode( json.encode( rows[-1][1] )) \
+            if rows else (bookmark or 'nil')
+        warning and resp.update( warning=warning )
+        if q.get( 'execution_stats', False ) :
+            resp['execution_stats'] = {
+                'total_keys_examined'       : 0,
+                'total_docs_examined'       : examined,
+                'total_quorum_docs_examined': 0,
+                'results_returned'          : len(docs),
+                'execution_time_ms'         : (time.time() - st) * 1000.0 }
+        self.respond( 200, resp )
+
+    #---- Changes
+
+    def changerow( self, db, doc, style, include_docs ):
+        w = doc.winner()
+        revs = [ w ] if style != 'all_docs' else \
+               [ w ] + [ r for r in sorted( doc.leaves ) if r != w ]
+        row = { 'seq' : doc.seq, 'id' : doc.id,
+                'changes' : [ { 'rev' : r } for r in revs ] }
+        doc.deleted() and row.update( deleted=True )
+        include_docs and row.update( doc=self.docbody( doc, w ))
+        return row
+
+    def changes( self, db, since, style, include_docs, limit ):
+        docs = sorted([ d for d in db.docs.values() if d.seq > since ],
+                      key=lambda d : d.seq )
+        docs = docs[:limit] if limit else docs
+        return [ self.changerow( db, d, style, include_docs ) for d in docs ]
+
+    def h_changes( self, db ):
+        server, q = self.server, self.query
+        feed = q.get( 'feed', 'normal' )
+        since = int( q.get( 'since', 0 ) or 0 )
+        style, include_docs = q.get( 'style', 'main_only' ), q.get( 'include_docs', False )
+        limit = q.get( 'limit', None )
+        heartbeat = q.get( 'heartbeat', None )
+        timeout = q.get( 'timeout', 60000 ) / 1000.0
+        deadline = time.time() + timeout
+
+        server.lock.acquire()
+        try :
+            rows = self.changes( db, since, style, include_docs, limit )
+            if feed == 'longpoll' :
+                while not rows and time.time() < deadline :
+                    server.changed.wait( deadline - time.time() )
+                    rows = self.changes( db, since, style, include_docs, limit )
+            if feed != 'continuous' :
+                last_seq = rows[-1]['seq'] if rows else since
+                return self.respond( 200, { 'results' : rows,
+                                            'last_seq' : last_seq })
+        finally :
+            server.lock.release()
+
+        # Continuous feed
+        self.startchunked()
+        count = 0
+        wait = (heartbeat / 1000.0) if heartbeat else timeout
+        while True :
+            for row in rows :
+                self.writechunk( json.encode(row) + '\n' )
+                since, count = row['seq'], count + 1
+            if (limit and count >= limit) or time.time() >= deadline :
+                break
+            server.lock.acquire()
+            try :
+                server.changed.wait( min( wait, max(deadline - time.time(), 0) ))
+                rows = self.changes( db, since, style, include_docs,
+                                     limit and (limit - count) )
+            finally :
+                server.lock.release()
+            if not rows and heartbeat :
+                self.writechunk( '\n' )
+        self.writechunk( json.encode({ 'last_seq' : since }) + '\n' )
+        self.writechunk( '' )
+
+    #---- Documents
+
+    def update( self, db, doc, new_edits=True ):
+        """Add ``doc`` as a new revision of the document, return the new
+        revision. With ``new_edits`` False, revision in ``doc`` is inserted
+        as it is, possibly creating conflicts."""
+        doc = dict( doc )
+        _id, rev = doc.pop( '_id' ), doc.pop( '_rev', None )
+        if _id.startswith( '_local/' ) :
+            return self.updatelocal( db, _id[7:], doc, rev )
+        revisions = doc.pop( '_revisions', None )
+        [ doc.pop( k ) for k in doc.keys()
+          if k.startswith('_') and k not in ('_deleted', '_attachments') ]
+        record = db.docs.get( _id, None ) or _Doc( _id )
+
+        if not new_edits :
+            if rev in record.bodies :
+                return rev
+            parent = None
+            if revisions and len( revisions.get('ids', []) ) > 1 :
+                parent = '%s-%s' % ( revisions['start'] - 1,
+                                     revisions['ids'][1] )
+            self.attachments( db, record, doc, parent )
+            record.add( rev, doc, parent )
+        else :
+            if record.leaves and rev is None :
+                # Like CouchDB 1.0, recreating a deleted document starts a
+                # new branch in the revision tree.
+                if not record.deleted() :
+                    raise StandinError( 409, 'conflict',
+                                        'Document update conflict.' )
+            elif rev is not None and rev not in record.leaves :
+                raise StandinError( 409, 'conflict',
+                                    'Document update conflict.' )
+            self.attachments( db, record, doc, rev )
+            newrev = _newrev( _revpos(rev) + 1 if rev else 1, doc, rev )
+            record.add( newrev, doc, rev )
+            rev = newrev
+
+        db.docs[_id] = record
+        db.seq += 1
+        record.seq = db.seq
+        db.viewcache = {}
+        self.server.changed.notifyAll()
+        return rev
+
+    def attachments( self, db, record, doc, parent ):
+        """Decode inline attachments and carry forward stubs from parent
+        revision."""
+        pos = _revpos( parent ) + 1 if parent else 1
+        atts = doc.get( '_attachments', None )
+        if not atts :
+            return
+        prev = record.bodies.get( parent, {} ).get( '_attachments', {} ) \
+               if parent else {}
+        for name, att in atts.items() :
+            if att.get( 'stub', False ) :
+                if name not in prev :
+                    raise StandinError( 412, 'missing_stub',
+                                        'Missing attachment %s' % name )
+                atts[name] = prev[name]
+            else :
+                data = base64.b64decode( att.get('data', '') )
+                atts[name] = {
+                    'content_type' : att.get( 'content_type',
+                                              'application/octet-stream' ),
+                    'data'   : data,
+                    'length' : len(data),
+                    'revpos' : pos,
+                    'digest' : 'md5-%s' % base64.b64encode( md5(data).digest() )
+                }
+
+    def docbody( self, doc, rev, attachments=False ):
+        body = dict( doc.bodies[rev] )
+        body['_id'], body['_rev'] = doc.id, rev
+        atts = {}
+        for name, att in body.get( '_attachments', {} ).items() :
+            att = dict( att )
+            data = att.pop( 'data' )
+            if attachments :
+                att['data'] = base64.b64encode( data )
+            else :
+                att['stub'] = True
+            atts[name] = att
+        atts and body.update( _attachments=atts )
+        return body
+
+    def getrecord( self, db, _id ):
+        doc = db.docs.get( _id, None )
+        if doc is None :
+            raise StandinError( 404, 'not_found', 'missing' )
+        return doc
+
+    def h_doc( self, db, _id ):
+        q, method = self.query, self.method
+        if method in ('GET', 'HEAD') :
+            doc = self.getrecord( db, _id )
+            if 'open_revs' in q :
+                return self.respond( 200, self.openrevs( doc, q ))
+            rev = q.get( 'rev', None ) or doc.winner()
+            if rev not in doc.bodies :
+                raise StandinError( 404, 'not_found', 'missing' )
+            if doc.bodies[rev].get( '_deleted', False ) and 'rev' not in q :
+                raise StandinError( 404, 'not_found', 'deleted' )
+            body = self.docbody( doc, rev, q.get( 'attachments', False ))
+            self.docextras( doc, rev, body, q )
+            return self.respond( 200, body, headers={ 'ETag' : '"%s"' % rev })
+        elif method == 'PUT' :
+            body = self.jsonbody()
+            body['_id'] = _id
+            'rev' in q and body.setdefault( '_rev', q['rev'] )
+            new_edits = q.get( 'new_edits', 'true' ) != 'false'
+            rev = self.update( db, body, new_edits=new_edits )
+            status = 202 if q.get( 'batch', None ) == 'ok' else 201
+            return self.respond( status, { 'ok' : True, 'id' : _id,
+                                           'rev' : rev },
+                                 headers={ 'ETag' : '"%s"' % rev })
+        elif method == 'DELETE' :
+            rev = q.get( 'rev', None ) or \
+                  self.headers.get( 'if-match', '' ).strip( '"' ) or None
+            if rev is None :
+                raise StandinError( 409, 'conflict', 'Document update conflict.')
+            self.getrecord( db, _id )
+            rev = self.update( db, { '_id' : _id, '_rev' : rev,
+                                     '_deleted' : True })
+            return self.respond( 200, { 'ok' : True, 'id' : _id, 'rev' : rev })
+        elif method == 'COPY' :
+            doc = self.getrecord( db, _id )
+            src = q.get( 'rev', None ) or doc.winner()
+            dest = self.headers.get( 'destination', '' )
+            destid, _, destrev = dest.partition( '?rev=' )
+            body = self.docbody( doc, src, attachments=True )
+            body['_id'] = destid
+            body.pop( '_rev' )
+            destrev and body.update( _rev=destrev )
+            rev = self.update( db, body )
+            return self.respond( 201, { 'ok' : True, 'id' : destid,
+                                        'rev' : rev })
+        raise StandinError( 405, 'method_not_allowed', method )
+
+    def docextras( self, doc, rev, body, q ):
+        if q.get( 'conflicts', False ) and doc.conflicts() :
+            body['_conflicts'] = doc.conflicts()
+        if q.get( 'revs', False ) :
+            history = doc.history( rev )
+            body['_revisions'] = {
+                'start' : _revpos( rev ),
+                'ids'   : [ r.split('-', 1)[1] for r in history ] }
+        if q.get( 'revs_info', False ) :
+            body['_revs_info'] = [
+                { 'rev' : r, 'status' : 'available' if r in doc.bodies
+                                        else 'missing' }
+                for r in doc.history( rev ) ]
+
+    def openrevs( self, doc, q ):
+        revs = q['open_revs']
+        revs = sorted( doc.leaves ) if revs == 'all' else revs
+        result = []
+        for rev in revs :
+            if rev in doc.bodies :
+                body = self.docbody( doc, rev, q.get( 'attachments', False ))
+                self.docextras( doc, rev, body, q )
+                result.append({ 'ok' : body })
+            else :
+                result.append({ 'missing' : rev })
+        return result
+
+    def updatelocal( self, db, _id, doc, rev ):
+        old = db.local.get( _id, None )
+        if old and old['_rev'] != rev :
+            raise StandinError( 409, 'conflict', 'Document update conflict.' )
+        if doc.get( '_deleted', False ) :
+            db.local.pop( _id, None )
+            return '0-0'
+        pos = int( old['_rev'].split('-', 1)[1] ) + 1 if old else 1
+        doc['_id'], doc['_rev'] = '_local/%s' % _id, '0-%d' % pos
+        db.local[_id] = doc
+        return doc['_rev']
+
+    def h_localdoc( self, db, _id ):
+        method = self.method
+        if method in ('GET', 'HEAD') :
+            doc = db.local.get( _id, None )
+            if doc is None :
+                raise StandinError( 404, 'not_found', 'missing' )
+            return self.respond( 200, doc )
+        elif method == 'PUT' :
+            body = self.jsonbody()
+            body['_id'] = '_local/%s' % _id
+            rev = self.update( db, body )
+        elif method == 'DELETE' :
+            rev = self.update( db, { '_id' : '_local/%s' % _id, '_deleted' : True,
+                                     '_rev' : self.query.get( 'rev', None ) })
+        elif method == 'COPY' :
+            doc = dict( db.local.get( _id ) or {} )
+            dest = self.headers.get( 'destination', '' )
+            doc['_id'] = dest
+            doc.pop( '_rev', None )
+            rev = self.update( db, doc )
+            return self.respond( 201, { 'ok' : True, 'id' : dest, 'rev' : rev })
+        else :
+            raise StandinError( 405, 'method_not_allowed', method )
+        self.respond( 201 if method == 'PUT' else 200,
+                      { 'ok' : True, 'id' : '_local/%s' % _id, 'rev' : rev } )
+
+    def h_attachment( self, db, _id, name ):
+        method, q = self.method, self.query
+        if method in ('GET', 'HEAD') :
+            doc = self.getrecord( db, _id )
+            rev = q.get( 'rev', None ) or doc.winner()
+            att = doc.bodies.get( rev, {} ).get( '_attachments', {} ).get( name )
+            if att is None or doc.bodies[rev].get( '_deleted', False ) :
+                raise StandinError( 404, 'not_found',
+                                    'Document is missing attachment' )
+            return self.respond( 200, att['data'], ctype=att['content_type'] )
+        elif method in ('PUT', 'DELETE') :
+            doc = db.docs.get( _id, None )
+            rev = q.get( 'rev', None )
+            body = self.docbody( doc, rev ) if doc and rev in doc.bodies else {}
+            atts = body.setdefault( '_attachments', {} )
+            if method == 'PUT' :
+                atts[name] = {
+                    'content_type' : self.headers.get( 'content-type',
+                                                'application/octet-stream' ),
+                    'data' : base64.b64encode( self.body ) }
+            elif name not in atts :
+                raise StandinError( 404, 'not_found',
+                                    'Document is missing attachment' )
+            else :
+                atts.pop( name )
+            body['_id'] = _id
+            rev and body.update( _rev=rev )
+            rev = self.update( db, body )
+            return self.respond( 201 if method == 'PUT' else 200,
+                                 { 'ok' : True, 'id' : _id, 'rev' : rev })
+        raise StandinError( 405, 'method_not_allowed', method )
+
+    #---- Design documents and views
+
+    def h_design( self, db, ddocid, segs ):
+        if segs[0] == '_view' and len(segs) == 2 :
+            return self.h_view( db, ddocid, segs[1] )
+        elif segs[0] == '_info' :
+            doc = self.getrecord( db, ddocid )
+            return self.respond( 200, {
+                'name' : ddocid.split('/', 1)[1],
+                'view_index' : {
+                    'compact_running' : False, 'updater_running' : False,
+                    'language' : doc.bodies[ doc.winner() ].get(
+                                            'language', 'javascript' ),
+                    'purge_seq' : db.purge_seq, 'waiting_commit' : False,
+                    'waiting_clients' : 0, 'signature' : doc.winner(),
+                    'update_seq' : db.seq, 'disk_size' : 0 }
+            })
+        return self.h_attachment( db, ddocid, '/'.join(segs) )
+
+    def h_view( self, db, ddocid, viewname ):
+        key = ( db.name, ddocid.split('/', 1)[1], viewname )
+        if key in self.server.views :
+            mapfn, reducefn = self.server.views[key]
+            self.respondview( db, key, mapfn, reducefn )
+        else :
+            doc = self.getrecord( db, ddocid )
+            if doc.deleted() :
+                raise StandinError( 404, 'not_found', 'deleted' )
+            ddoc = doc.bodies[ doc.winner() ]
+            view = ddoc.get( 'views', {} ).get( viewname, None )
+            if view is None :
+                raise StandinError( 404, 'not_found', 'missing_named_view' )
+            if ddoc.get( 'language', 'javascript' ) != 'python' :
+                raise StandinError( 500, 'unsupported_language',
+                                    'Standin server can run python views, '
+                                    'or use StandinServer.addview()' )
+            self.runview( db, key, view )
+
+    def runview( self, db, key, view ):
+        """Respond with rows of python ``view``, compiled by the server's
+        :class:`couchpy.queryserver.QueryServer`."""
+        qs = self.server.queryserver
+        try :
+            mapfn = qs.mapfun( view['map'] )
+            reducefn = view.get( 'reduce', None ) and \
+                       qs.reducefun( view['reduce'] )
+            self.respondview( db, key, mapfn, reducefn )
+        except QueryServerError, e :
+            status = 400 if e.error == 'compilation_error' else 500
+            raise StandinError( status, e.error, e.reason )
+
+    def viewrows( self, db, key, mapfn ):
+        rows = db.viewcache.get( key, None ) if key else None
+        if rows is None :
+            rows = []
+            for _id, doc in db.docs.items() :
+                if doc.deleted() or _id.startswith( '_design/' ) :
+                    continue
+                body = self.docbody( doc, doc.winner() )
+                doc.conflicts() and body.update( _conflicts=doc.conflicts() )
+                for k, v in mapfn( body ) :
+                    rows.append({ 'id' : _id, 'key' : k, 'value' : v })
+            rows.sort( key=lambda r : (collatekey(r['key']), r['id']) )
+            key and db.viewcache.update({ key : rows })
+        return rows
+
+    def respondview( self, db, key, mapfn, reducefn ):
+        q = self.query
+        rows = self.viewrows( db, key, mapfn )
+        keys = self.jsonbody().get( 'keys', None ) if self.method == 'POST' \
+               else q.get( 'keys', None )
+        if keys is not None :
+            keyset = [ collatekey(k) for k in keys ]
+            rows = [ r for k in keyset for r in rows
+                     if collatekey( r['key'] ) == k ]
+            offset = 0
+        else :
+            offset, rows = self.slicerows( rows, keyfn=collatekey,
+                                           paginate=False )
+        if reducefn and q.get( 'reduce', True ) :
+            return self.respond( 200, { 'rows' : self.reduce( rows, reducefn )})
+        if q.get( 'descending', False ) :
+            rows = rows[::-1]
+        skip, limit = q.get( 'skip', 0 ), q.get( 'limit', None )
+        rows = rows[ skip : (skip + limit) if limit is not None else None ]
+        if q.get( 'include_docs', False ) :
+            rows = [ dict( r, doc=self.docbody( db.docs[ r['id'] ],
+                                                db.docs[ r['id'] ].winner() ))
+                     for r in rows ]
+        total = len( self.viewrows( db, key, mapfn ))
+        self.respond( 200, { 'total_rows' : total, 'offset' : offset + skip,
+                             'rows' : rows })
+
+    def reduce( self, rows, reducefn ):
+        q = self.query
+        group_level = q.get( 'group_level', None )
+        group_level = None if q.get( 'group', False ) and group_level is None \
+                      else (group_level or 0)
+        def groupkey( key ) :
+            if group_level is None : return key
+            if group_level == 0 : return None
+            return key[:group_level] if isinstance( key, list ) else key
+        groups = []
+        for r in rows :
+            k = groupkey( r['key'] )
+            if groups and collatekey( groups[-1][0] ) == collatekey( k ) :
+                groups[-1][1].append( r )
+            else :
+                groups.append( (k, [ r ]) )
+        if not groups and group_level == 0 :
+            return []
+        result = []
+        for k, rs in groups :
+            value = reducefn( [ [r['key'], r['id']] for r in rs ],
+                              [ r['value'] for r in rs ], False )
+            result.append({ 'key' : k, 'value' : value })
+        return result[::-1] if q.get( 'descending', False ) else result
+
+    def slicerows( self, rows, keyfn, paginate=True ):
+        """Apply key range query parameters on ``rows`` sorted by key. If
+        ``paginate``, also apply descending, skip and limit."""
+        q = self.query
+        descending = q.get( 'descending', False )
+        startkey = q.get( 'startkey', q.get( 'start_key', None ))
+        endkey = q.get( 'endkey', q.get( 'end_key', None ))
+        inclusive_end = q.get( 'inclusive_end', True )
+        if 'key' in q :
+            startkey, endkey, inclusive_end = q['key'], q['key'], True
+        lo, hi = (endkey, startkey) if descending else (startkey, endkey)
+        loincl, hiincl = (inclusive_end, True) if descending \
+                         else (True, inclusive_end)
+        total = len( rows )
+        if lo is not None :
+            lo = keyfn( lo )
+            rows = [ r for r in rows if keyfn( r['key'] ) > lo or
+                                        (loincl and keyfn( r['key'] ) == lo) ]
+        below = total - len( rows )
+        if hi is not None :
+            hi = keyfn( hi )
+            rows = [ r for r in rows if keyfn( r['key'] ) < hi or
+                                        (hiincl and keyfn( r['key'] ) == hi) ]
+        offset = (total - below - len(rows)) if descending else below
+        if paginate :
+            rows = rows[::-1] if descending else rows
+            skip, limit = q.get( 'skip', 0 ), q.get( 'limit', None )
+            rows = rows[ skip : (skip + limit) if limit is not None else None ]
+            offset += skip
+        return offset, rows
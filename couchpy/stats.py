@@ -0,0 +1,313 @@
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+"""Background sampling of server statistics and active tasks. A
+:class:`StatsSampler` polls ``GET /_stats`` and ``GET /_active_tasks`` at a
+fixed interval and remembers the change in every counter, between samples,
+in a fixed capacity ring buffer, one :class:`Series` per counter. The
+buffers are backed by ``array`` objects, so memory use is 8 bytes per sample
+per counter and does not grow over time. Gauges, like
+``couchdb.open_databases``, and means of histograms, like
+``couchdb.request_time``, are not rates, only their current value is kept.
+
+>>> sampler = StatsSampler( couch, interval=5 ).start()
+>>> sampler.rate( 'httpd.requests' )            # Requests per second
+12.4
+>>> sampler.percentile( 'httpd.requests', 95 )  # 95th percentile of rate
+31.0
+>>> sampler.value( 'couchdb.open_databases' )   # Current value of gauge
+3
+>>> sampler.tasks()                             # Progress and ETA
+[ { 'type' : 'Database Compaction', 'progress' : 42, 'eta' : 130.5, ... } ]
+>>> sampler.stop()
+
+Statistics are named by joining the path of section and key with ``.``, like
+``couchdb.request_time``. To avoid downloading the entire statistics tree on
+every sample, pass a list of statistic names to sample via ``stats``.
+"""
+
+import re, time, logging
+from   array        import array
+
+try:
+    from threading       import Thread, Lock, Event
+except ImportError:
+    from dummy_threading import Thread, Lock, Event
+
+log = logging.getLogger( __name__ )
+
+class Series( object ):
+    """Ring buffer of ``capacity`` float samples. Once full, new samples
+    overwrite the oldest ones."""
+
+    def __init__( self, capacity ):
+        self.capacity = capacity
+        self.data = array( 'd', [0.0] ) * capacity
+        self.count = 0
+
+    def __len__( self ):
+        return min( self.count, self.capacity )
+
+    def append( self, value ):
+        self.data[ self.count % self.capacity ] = value
+        self.count += 1
+
+    def values( self, window=None ):
+        """List of samples in chronological order, only the last ``window``
+        samples if specified."""
+        n = len(self)
+        window = n if window is None else min( window, n )
+        end = self.count % self.capacity
+        if self.count < self.capacity :
+            vals = self.data[ :end ]
+        else :
+            vals = self.data[ end: ] + self.data[ :end ]
+        return vals[ n-window: ].tolist()
+
+    def last( self ):
+        return self.data[ (self.count-1) % self.capacity ] if self.count else None
+
+
+# CouchDB 1.x does not report the type of statistics, all others are counters
+KINDS_1X = {
+    'couchdb.open_databases' : 'gauge',
+    'couchdb.open_os_files'  : 'gauge',
+    'couchdb.request_time'   : 'histogram',
+}
+
+def flatten( tree, prefix='', kinds=None ):
+    """Flatten nested statistics ``tree`` into a dictionary of
+    ``{ 'section.key' : value }``. Handles ``current`` values reported by
+    CouchDB 1.x and ``value`` reported by CouchDB 2.x, for histograms the
+    arithmetic mean is used. If ``kinds`` dictionary is supplied, it is
+    updated with the kind of every statistic, one of ``counter``, ``gauge``
+    or ``histogram``."""
+    flat = {}
+    kinds = {} if kinds is None else kinds
+    for key, node in tree.items() :
+        name = '%s.%s' % (prefix, key) if prefix else key
+        if not isinstance( node, dict ) :
+            continue
+        elif 'current' in node :
+            kinds[name] = kind = KINDS_1X.get( name, 'counter' )
+            value = node.get( 'mean' ) if kind == 'histogram' else None
+            flat[name] = (node['current'] if value is None else value) or 0.0
+        elif 'value' in node :
+            value = node['value']
+            kinds[name] = node.get( 'type', 'counter' )
+            if isinstance( value, dict ) :
+                kinds[name] = 'histogram'
+                value = value.get( 'arithmetic_mean', 0.0 )
+            flat[name] = value or 0.0
+        else :
+            flat.update( flatten( node, name, kinds ))
+    return flat
+
+def percentile( values, p ):
+    """Return ``p``-th percentile of ``values`` using linear interpolation."""
+    if not values :
+        return None
+    values = sorted( values )
+    k = (len(values) - 1) * (p / 100.0)
+    lo, hi = int(k), min( int(k) + 1, len(values) - 1 )
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+_progress_re = [
+    re.compile( r'\((\d+)%\)' ),
+    re.compile( r'(\d+) of (\d+)' ),
+]
+def taskprogress( task ):
+    """Return progress of an active ``task`` in percent, or None if not
+    known. Uses ``progress`` field, if available, otherwise parse the
+    ``status`` string of older servers, like,
+    ``Copied 0 of 18369 changes (0%)``."""
+    if isinstance( task.get('progress', None), (int, long, float) ) :
+        return float( task['progress'] )
+    status = task.get( 'status', '' ) or ''
+    m = _progress_re[0].search( status )
+    if m :
+        return float( m.group(1) )
+    m = _progress_re[1].search( status )
+    if m and int(m.group(2)) :
+        return 100.0 * int(m.group(1)) / int(m.group(2))
+    return None
+
+def taskid( task ):
+    return ( task.get('type'), task.get('pid'),
+             task.get('task', task.get('database', None)) )
+
+
+class StatsSampler( object ):
+    """Poll server statistics and active tasks via ``client`` every
+    ``interval`` seconds.
+
+    ``capacity``,
+        Number of samples to remember per statistic.
+    ``stats``,
+        Optional list of statistics to sample, like ``['httpd.requests',
+        'couchdb.request_time']``. Each one is fetched from
+        ``/_stats/<section>/<key>``. By default entire statistics tree is
+        fetched.
+    ``tasks``,
+        Boolean, whether to sample ``/_active_tasks`` as well.
+    """
+
+    def __init__( self, client, interval=5.0, capacity=720, stats=None,
+                  tasks=True ):
+        self.client, self.interval, self.capacity = client, interval, capacity
+        self.stats, self.sampletasks = stats, tasks
+        self.times = Series( capacity )   # Duration of every sample interval
+        self.series = {}                  # counter -> Series of deltas
+        self.current = {}                 # statname -> last absolute value
+        self.kinds = {}                   # statname -> counter, gauge, ...
+        self.activetasks = {}             # taskid -> task with progress
+        self.lasttime = None
+        self.lock, self.stopped = Lock(), Event()
+        self.thread = None
+
+    def start( self ):
+        """Start sampling in a background thread. Return self."""
+        self.stopped.clear()
+        self.thread = Thread( target=self._run )
+        self.thread.setDaemon( True )
+        self.thread.start()
+        return self
+
+    def stop( self ):
+        """Stop the background thread."""
+        self.stopped.set()
+        self.thread and self.thread.join()
+        self.thread = None
+
+    def _run( self ):
+        while not self.stopped.isSet() :
+            try :
+                self.sample()
+            except Exception, e :
+                log.error( 'Sampling server statistics failed, %s' % e )
+            self.stopped.wait( self.interval )
+
+    def sample( self ):
+        """Take one sample of statistics and active tasks."""
+        kinds = {}
+        now, flat = time.time(), self._fetchstats( kinds )
+        tasks = self.client.active_tasks() if self.sampletasks else None
+        self.lock.acquire()
+        try :
+            self.kinds.update( kinds )
+            if self.lasttime is not None :
+                self.times.append( now - self.lasttime )
+                for name, value in flat.items() :
+                    if kinds[name] != 'counter' :
+                        continue
+                    series = self.series.get( name, None )
+                    if series is None :
+                        series = self.series[name] = Series( self.capacity )
+                        [ series.append(0.0) for i in range(len(self.times)-1) ]
+                    series.append( value - self.current.get(name, value) )
+            self.current.update( flat )
+            self.lasttime = now
+            tasks is None or self._updatetasks( now, tasks )
+        finally :
+            self.lock.release()
+
+    def _fetchstats( self, kinds ):
+        if self.stats is None :
+            return flatten( self.client.stats() or {}, kinds=kinds )
+        flat = {}
+        for name in self.stats :
+            tree = self.client.stats( *name.split('.') ) or {}
+            flat.update( flatten( tree, kinds=kinds ))
+        return flat
+
+    def _updatetasks( self, now, tasks ):
+        active = {}
+        for task in tasks or [] :
+            tid, task = taskid( task ), dict( task )
+            prev = self.activetasks.get( tid, {} )
+            task['progress'] = progress = taskprogress( task )
+            task['started'] = prev.get( 'started', (now, progress) )
+            task['eta'] = None
+            t0, p0 = task['started']
+            if progress is not None and p0 is not None and progress > p0 :
+                rate = (progress - p0) / (now - t0)
+                task['eta'] = (100.0 - progress) / rate
+            active[tid] = task
+        self.activetasks = active
+
+    #---- Query sampled data
+
+    def names( self ):
+        """List of sampled statistic names."""
+        return sorted( self.current.keys() )
+
+    def counters( self ):
+        """List of sampled counter names, statistics that have a rate."""
+        return sorted( self.series.keys() )
+
+    def gauges( self ):
+        """List of sampled statistic names that are not counters, gauges and
+        means of histograms."""
+        return sorted([ name for name, kind in self.kinds.items()
+                        if kind != 'counter' ])
+
+    def deltas( self, name, window=None ):
+        """List of changes in counter ``name`` between samples."""
+        self.lock.acquire()
+        try :
+            series = self.series.get( name, None )
+            return series.values( window ) if series else []
+        finally :
+            self.lock.release()
+
+    def rates( self, name, window=None ):
+        """List of per-second rates of counter ``name`` for every sample."""
+        self.lock.acquire()
+        try :
+            series = self.series.get( name, None )
+            if series is None :
+                return []
+            deltas, times = series.values( window ), self.times.values( window )
+        finally :
+            self.lock.release()
+        return [ (d / t if t else 0.0) for d, t in zip( deltas, times ) ]
+
+    def rate( self, name, window=None ):
+        """Average per-second rate of counter ``name``, over the last
+        ``window`` samples or all remembered samples. None if ``name`` is not
+        a counter."""
+        self.lock.acquire()
+        try :
+            series = self.series.get( name, None )
+            if series is None :
+                return None
+            deltas, times = series.values( window ), self.times.values( window )
+        finally :
+            self.lock.release()
+        return sum(deltas) / sum(times) if sum(times) else 0.0
+
+    def percentile( self, name, p, window=None ):
+        """``p``-th percentile of per-second rate of counter ``name``."""
+        return percentile( self.rates( name, window ), p )
+
+    def value( self, name ):
+        """Last absolute value of statistic ``name``, the current value of
+        gauges like ``couchdb.open_databases`` and the mean of histograms
+        like ``couchdb.request_time``."""
+        return self.current.get( name, None )
+
+    def tasks( self ):
+        """List of active tasks, each task dictionary is updated with
+        ``progress`` in percent and ``eta`` in seconds, computed from the
+        progress made since the task was first sampled. Either can be None if
+        not known."""
+        return self.activetasks.values()
+
+    def top( self, count=20, window=None ):
+        """List of (name, rate) tuples, for ``count`` counters with highest
+        rate."""
+        rates = [ (name, self.rate(name, window)) for name in self.counters() ]
+        return sorted( rates, key=lambda x : -x[1] )[:count]
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+import logging
+from   copy                 import deepcopy
+
+from   couchpy.bench        import Bench, compare, report
+
+log = logging.getLogger( __name__ )
+
+def test_bench( url ) :
+    print "Testing benchmarks ..."
+    results = Bench( url, scale=0.01 ).run()
+    names = results['results'].keys()
+    for name in [ 'doc.get', 'doc.put', 'bulkdocs.1000', 'all_docs', 'view',
+                  'changes', 'attachment.put', 'micro.urljoin' ] :
+        assert name in names
+    assert results['results']['doc.get']['unit'] == 'ms'
+    assert 'p95' in results['results']['doc.get']
+
+    print "Testing compare() ..."
+    slower = deepcopy( results )
+    slower['results']['doc.get']['value'] *= 2
+    rows = dict([ (r[0], r) for r in compare( results, slower ) ])
+    assert rows['doc.get'][4] == True and rows['doc.put'][4] == False
+    assert 'doc.get' in report( slower, results )
+
+if __name__ == '__main__' :
+    url = None      # Use the stand-in server
+    test_bench( url )
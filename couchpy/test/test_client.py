@@ -7,12 +7,22 @@
 # -*- coding: utf-8 -*-
 
 import sys, logging, time, pprint
-from   random               import choice
-from   couchpy.client       import Client
+from   collections          import OrderedDict
+from   random               import choice, shuffle
+from   threading            import Thread
+from   couchpy              import CouchPyError
+from   couchpy.client       import Client, Log
 from   couchpy.database     import Database
+from   couchpy.httpc        import SingleFlight
+from   couchpy.utils        import collatekey
 
 log = logging.getLogger( __name__ )
 
+secobj = {
+  "admins": { "names": [ 'joe' ], "roles": [] },
+  "readers":{ "names": [ 'joe' ], "roles": []}
+}
+
 def test_info( url ) :
     print "Testing client ..."
     c = Client( url=url )
@@ -134,10 +144,199 @@ def test_basics( url ) :
     ca.delete( 'testdb1' )
     ca.delete( 'testdb2' )
 
+def test_logtail( url ) :
+    print "Testing Log iterator ..."
+    ca = Client( url=url )
+    ca.login( 'pratap', 'pratap' )
+    msgs = list( ca.Log( bytes=2000 ))
+    assert msgs
+    assert all([ msg.level and msg.pid and msg.timestamp for msg in msgs ])
+
+    logtail = ca.Log( bytes=2000, follow=True, interval=0.1 )
+    logtail.poll()
+    ca.put( 'testlogdb' ) ; ca.delete( 'testlogdb' )
+    time.sleep(1)
+    msgs = logtail.poll() + ( logtail.pending and [ logtail.pending ] or [] )
+    assert any([ 'testlogdb' in msg.message for msg in msgs ])
+    logtail.close()
+
+    class FakeLog( object ) :               # Same windows as GET /_log
+        text = ''
+        def log( self, bytes=None, offset=None, hthdrs={} ) :
+            end = len( self.text ) - (offset or 0)
+            return self.text[ max( end - bytes, 0 ) : end ]
+    line = '[Thu, 01 Dec 2011 10:12:13 GMT] [info] [<0.1.0>] %s\n'
+    fake = FakeLog()
+    fake.text = line % 'start'
+    logtail = Log( fake, bytes=4096, follow=True, interval=0.01, grace=0.2 )
+    assert [ m.message for m in logtail.poll() ] == []  # start is pending
+    fake.text += line % 'crash' + 'trace 1\n'
+    assert [ m.message for m in logtail.poll() ] == [ 'start' ]
+    fake.text += 'trace 2\n'               # Continuation on a later poll
+    assert logtail.poll() == [] and logtail.pending.message == \
+                'crash\ntrace 1\ntrace 2'
+    st = time.time()
+    assert logtail.next().message == 'crash\ntrace 1\ntrace 2'
+    assert time.time() - st >= 0.1          # Flushed after grace period
+    # Repeated log text, longer than the first anchor, is located once the
+    # anchor is lengthened to a unique line.
+    fake.text += ''.join([ line % ('filler %s' % i) for i in range(40) ])
+    fake.text += line % 'unique' + line % 'same' * 10
+    logtail = Log( fake, bytes=1024, follow=True, grace=0 )
+    logtail.poll()
+    fake.text += line % 'same' * 3
+    msgs = logtail.poll() + [ logtail.pending ]
+    assert [ m.message for m in msgs ] == [ 'same' ] * 4
+    assert logtail.size is None             # Log is larger than the window
+
+def test_scatterview( url ) :
+    print "Testing scatterview() method ..."
+    ca = Client( url=url )
+    ca.login( 'pratap', 'pratap' )
+    ddoc = {
+        '_id'   : '_design/tenant',
+        'views' : {
+            'bycolor' : {
+                'map'    : "function(doc) { emit(doc.color, 1); }",
+                'reduce' : "_sum",
+            }
+        }
+    }
+    names = [ 'tenant_%s' % i for i in range(5) ]
+    for name in names :
+        ca.delete( name ) if name in ca else None
+        db = ca.put( name )
+        db.bulkdocs([ ddoc, { 'color' : 'red' }, { 'color' : 'blue' } ])
+    ca.put( 'tenant_x' ) if 'tenant_x' not in ca else None  # no design doc
+
+    d = ca.scatterview( 'tenant', 'bycolor', regexp='tenant_', gather='merge',
+                        query={ 'reduce' : False } )
+    assert len(d['rows']) == 10
+    assert [ r['key'] for r in d['rows'] ] == ['blue'] * 5 + ['red'] * 5
+    assert sorted( set([ r['db'] for r in d['rows'] ]) ) == names
+    assert d['errors'].keys() == [ 'tenant_x' ]
+
+    d = ca.scatterview( 'tenant', 'bycolor', regexp='tenant_[0-9]',
+                        gather='reduce', query={ 'group' : True } )
+    assert d['rows'] == [ { 'key' : 'blue', 'value' : 5 },
+                          { 'key' : 'red', 'value' : 5 } ]
+
+    rs = ca.scatterview( 'tenant', 'bycolor', regexp='tenant_[0-9]',
+                         gather='stream', concurrency=2 )
+    assert sorted([ dbname for dbname, d, err in rs ]) == names
+    [ ca.delete( name ) for name in names + [ 'tenant_x' ] ]
+
+def test_collation( url ) :
+    print "Testing view collation of keys ..."
+    # Order of CouchDB's view collation specification.
+    keys = [ None, False, True, 1, 2, 3.0, 4, '_', '-', '~', '$', '0', '9',
+             'a', 'A', u'\xe1', u'\xc1', 'aa', 'b', 'B', 'ba', 'bb',
+             [ 'a' ], [ 'b' ], [ 'b', 'c' ], [ 'b', 'c', 'a' ], [ 'b', 'd' ],
+             [ 'b', 'd', 'e' ], { 'a' : 1 }, { 'a' : 2 }, { 'b' : 1 },
+             { 'b' : 2 }, OrderedDict([ ('b', 2), ('a', 1) ]),
+             OrderedDict([ ('b', 2), ('c', 2) ]) ]
+    for i in range(10) :
+        shuffled = keys[:]
+        shuffle( shuffled )
+        assert sorted( shuffled, key=collatekey ) == keys
+    assert collatekey( u'\xe1' ) == collatekey( u'a\u0301' )
+    assert collatekey( '\xc3\xa1' ) == collatekey( u'\xe1' )
+
+    print "Testing scatterview() merge and rereduce with python views ..."
+    ca = Client( url=url )
+    ca.login( 'pratap', 'pratap' )
+    mapfn = "def fun( doc ):\n    emit( doc['color'], doc['n'] )\n"
+    ddoc = { '_id' : '_design/tenant', 'language' : 'python', 'views' : {
+                'bycolor' : { 'map' : mapfn },
+                'stats' : { 'map' : mapfn, 'reduce' : '_stats' }}}
+    names = [ 'tenant_a', 'tenant_b' ]
+    for i, name in enumerate( names ) :
+        ca.delete( name ) if name in ca else None
+        ca.put( name ).bulkdocs([ ddoc ] + [ { 'color' : c, 'n' : i }
+                                    for c in [ 'Red', 'blue', 'red', 'Blue' ]])
+    d = ca.scatterview( 'tenant', 'bycolor', regexp='tenant_',
+                        gather='merge' )
+    assert [ r['key'] for r in d['rows'] ] == \
+                [ 'blue', 'blue', 'Blue', 'Blue', 'red', 'red', 'Red', 'Red' ]
+    d = ca.scatterview( 'tenant', 'stats', regexp='tenant_',
+                        gather='reduce', query={ 'group' : True },
+                        rereduce='_stats' )
+    assert [ r['key'] for r in d['rows'] ] == [ 'blue', 'Blue', 'red', 'Red' ]
+    assert d['rows'][0]['value'] == { 'sum' : 1, 'count' : 2, 'min' : 0,
+                                      'max' : 1, 'sumsqr' : 1 }
+    d = ca.scatterview( 'tenant', 'stats', regexp='tenant_',
+                        gather='reduce', rereduce='_stats' )
+    assert d['rows'][0]['value']['count'] == 8
+    try :       # Values are summed by default, _stats must be asked for
+        ca.scatterview( 'tenant', 'stats', regexp='tenant_', gather='reduce' )
+        assert False
+    except CouchPyError :
+        pass
+    [ ca.delete( name ) for name in names ]
+
+def test_bulkadmin( url ) :
+    print "Testing bulk administration methods ..."
+    ca = Client( url=url )
+    ca.login( 'pratap', 'pratap' )
+    names = [ 'admin_%s' % i for i in range(5) ]
+    [ ca.put( name ) for name in names if name not in ca ]
+
+    report = ca.dbsinfo( regexp='admin_' )
+    assert sorted( report['ok'].keys() ) == names
+    assert report['count'] == 5 and report['errors'] == {}
+    for name, info in report['ok'].items() :
+        assert info['db_name'] == name
+        assert 'disk_size' in info and 'doc_count' in info
+    report = ca.dbsinfo( names=names+['admin_none'] )
+    assert report['errors'].keys() == [ 'admin_none' ]
+
+    assert sorted( ca.setsecurity( secobj, regexp='admin_' )['ok'] ) == names
+    assert ca.Database( names[0] ).security() == secobj
+    assert sorted( ca.setrevslimit( 111, names=names )['ok'] ) == names
+    assert ca.Database( names[-1] ).revslimit() == 111
+    assert sorted( ca.compactdbs( regexp='admin_' )['ok'] ) == names
+    assert sorted( ca.viewcleanups( regexp='admin_' )['ok'] ) == names
+    [ ca.delete( name ) for name in names ]
+
+def test_coalesce( url ) :
+    print "Testing single-flight coalescing ..."
+    sf, calls, results = SingleFlight( list ), [], []
+    def slowcall() :
+        calls.append( 1 ) ; time.sleep( 0.2 ) ; return [ 'x' ]
+    threads = [ Thread( target=lambda : results.append( sf.do( 'k', slowcall )))
+                for i in range(5) ]
+    [ t.start() for t in threads ] ; [ t.join() for t in threads ]
+    assert len(calls) == 1 and results == [ ['x'] ] * 5
+    assert len( set([ id(r) for r in results ])) == 5
+    assert sf.stats() == { 'leaders' : 1, 'coalesced' : 4, 'inflight' : 0 }
+
+    ca = Client( url=url )
+    ca.login( 'pratap', 'pratap' )
+    ca.delete( 'coalescedb' ) if 'coalescedb' in ca else None
+    db = ca.put( 'coalescedb' )
+    db.Document({ '_id' : 'hot', 'tags' : [ 'a', 'b' ] }).post()
+    c = Client( url=url, config={ 'client.coalesce' : True } )
+    docs = []
+    def fetch() :
+        s, h, d = c.conn.get( [ 'coalescedb', 'hot' ], {}, None )
+        docs.append( d )
+        d['tags'].append( 'mine' )
+    threads = [ Thread( target=fetch ) for i in range(10) ]
+    [ t.start() for t in threads ] ; [ t.join() for t in threads ]
+    assert all([ d['tags'] == [ 'a', 'b', 'mine' ] for d in docs ])
+    stats = c.conn.htsess.singleflight.stats()
+    assert stats['leaders'] + stats['coalesced'] == 10
+    ca.delete( 'coalescedb' )
+
 if __name__ == '__main__' :
     url = 'http://localhost:5984/'
     c = Client( url=url )
     print 'CouchDB version %s' % c.version()
     test_info( url )
     test_basics( url )
+    test_logtail( url )
+    test_scatterview( url )
+    test_collation( url )
+    test_bulkadmin( url )
+    test_coalesce( url )
     print
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+import logging, time
+
+from   couchpy.client       import Client
+from   couchpy.cluster      import ClusterSession
+from   couchpy.standin      import StandinServer
+
+log = logging.getLogger( __name__ )
+
+def test_routing( urls ) :
+    print "Testing cluster routing policies ..."
+    for policy in ClusterSession.policies :
+        c = Client( url=urls, config={ 'cluster.policy' : policy } )
+        [ c.all_dbs() for i in range(30) ]
+        nodes = c.conn.htsess.nodes()
+        assert sum([ n['requests'] for n in nodes ]) == 30
+        if policy == 'roundrobin' :
+            assert [ n['requests'] for n in nodes ] == [ 10, 10, 10 ]
+        if policy == 'ewma' :
+            assert all([ n['ewma'] is not None for n in nodes ])
+
+    print "Testing write pinning ..."
+    c = Client( url=urls )
+    c.put( 'clusterdb' )
+    assert 'clusterdb' in Client( url=urls[0] ).all_dbs()
+    Client( url=urls[0] ).delete( 'clusterdb' )
+    # Read-only POST requests are balanced like GET requests.
+    sess = c.conn.htsess
+    first = sess.nodelist[0]
+    for path in [ '/db/_find', '/db/_all_docs', '/db/_bulk_get?revs=true',
+                  '/db/_design%2Fpy/_view/byage', '/db/_design/py/_view/v',
+                  '/_dbs_info' ] :
+        nodes = [ sess.choose( 'POST', {}, None, path=path )
+                  for i in range(3) ]
+        assert len( set( nodes )) == 3
+    for path in [ '/db', '/db/_bulk_docs', '/db/_find/x', '/db/_purge' ] :
+        assert sess.choose( 'POST', {}, None, path=path ) is first
+    assert sess.choose( 'PUT', {}, None, path='/db/_find' ) is first
+
+def test_failover( urls, servers ) :
+    print "Testing failover and recovery ..."
+    c = Client( url=urls, config={ 'cluster.probe_interval' : 0.1 } )
+    host, port = servers[1].server_address[:2]
+    servers[1].stop()
+    [ c.all_dbs() for i in range(10) ]
+    nodes = c.conn.htsess.nodes()
+    assert nodes[1]['up'] == False and nodes[1]['failures'] == 1
+
+    servers[1] = StandinServer( host, port ).start()
+    time.sleep( 0.2 ) ; c.all_dbs() ; time.sleep( 0.2 )
+    assert c.conn.htsess.nodes()[1]['up'] == True
+    [ c.all_dbs() for i in range(6) ]
+    assert c.conn.htsess.nodes()[1]['requests'] > 1
+
+if __name__ == '__main__' :
+    # Multiple CouchDB nodes are simulated using stand-in servers.
+    servers = [ StandinServer().start() for i in range(3) ]
+    urls = [ s.url for s in servers ]
+    test_routing( urls )
+    test_failover( urls, servers )
+    [ s.stop() for s in servers ]
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+import logging, time
+
+from   couchpy.client       import Client
+from   couchpy.conflicts    import Resolver, LastWriterWins, ThreeWayMerge
+from   couchpy.standin      import StandinServer
+
+log = logging.getLogger( __name__ )
+
+def conflict( c, db, _id, fields, branch, ts ):
+    """Create document ``_id`` with ``fields``, then a branch of revision 2
+    with ``branch`` changes, conflicting with revision 2 that updates
+    ``x``. Return the revisions."""
+    doc = db.Document( dict( fields, _id=_id )).post()
+    rev1 = doc._rev
+    doc['x'], doc['ts'] = 'server', ts
+    doc.put()
+    body = dict( fields, _id=_id, _rev='2-%s' % ('0' * 32), ts=ts + 1,
+                 _revisions={ 'start' : 2,
+                              'ids' : [ '0' * 32, rev1.split('-')[1] ]})
+    body.update( branch )
+    c.conn.post( [ db.dbname, '_bulk_docs' ], {},
+                 { 'new_edits' : False, 'docs' : [ body ] })
+    return rev1, doc._rev, body['_rev']
+
+def leaves( db, _id ):
+    doc = db.Document( _id ).fetch( conflicts='true' )
+    return [ doc['_rev'] ] + doc.get( '_conflicts', [] )
+
+def test_resolver( url ):
+    c = Client( url=url )
+    [ db.delete() for db in c.databases ]
+    db = c.put( 'testdb' )
+    fields = { 'x' : 0, 'y' : 0, 'z' : 0 }
+    for i in range(12) :
+        conflict( c, db, 'd%02d' % i, fields, { 'y' : i, 'x' : 'branch' }, i )
+    db.bulkdocs([ { '_id' : 'clean%s' % i } for i in range(5) ])
+
+    print "Testing scan with three-way merge ..."
+    resolver = Resolver( db, strategy=ThreeWayMerge(), batch=5 )
+    found = list( resolver.scan() )
+    assert len( found ) == 12 and len( found[0][1] ) == 2
+    report = resolver.run( 'scan' )
+    assert report['found'] == 12 and report['resolved'] == 12
+    assert report['tombstoned'] == 12 and report['backlog'] == 0
+    assert report['failed'] == 0 and report['rate'] > 0
+    doc = db.Document( 'd07' ).fetch( conflicts='true' )
+    assert '_conflicts' not in doc and doc['_rev'].startswith( '3-' )
+    # x changed by both branches, winner kept. y changed by one branch.
+    assert (doc['x'], doc['y'], doc['z']) == ('server', 7, 0)
+    assert list( resolver.scan() ) == []
+
+    print "Testing on-conflict callback with the changes feed ..."
+    conflict( c, db, 'e', fields, { 'x' : 'branch', 'w' : 1 }, 0 )
+    onconflict = lambda field, values, base : \
+                    '|'.join( sorted( map( str, values )))
+    d = Resolver( db, strategy=ThreeWayMerge( onconflict )).run( 'changes' )
+    assert d['resolved'] == 1 and d['found'] >= 1
+    doc = db.Document( 'e' ).fetch()
+    assert doc['x'] == 'branch|server' and doc['w'] == 1
+
+    print "Testing last-writer-wins with the conflicts view ..."
+    conflict( c, db, 'f', fields, { 'y' : 'branch' }, 0 )
+    conflict( c, db, 'g', fields, { 'y' : 'branch' }, 0 )
+    resolver = Resolver( db, strategy=LastWriterWins( 'ts' ))
+    resolver.installview( language='python' )
+    resolver.installview( language='python' )      # Already installed
+    assert sorted([ _id for _id, revs in resolver.view() ]) == [ 'f', 'g' ]
+    d = resolver.run( 'view' )
+    assert d['resolved'] == 2 and list( resolver.view() ) == []
+    doc = db.Document( 'f' ).fetch()
+    assert doc['y'] == 'branch' and doc['x'] == 0    # Branch has later ts
+
+    print "Testing attachment stubs of losing revisions are dropped ..."
+    data = { 'content_type' : 'text/plain', 'data' : 'aGVsbG8=' }
+    conflict( c, db, 'att', fields,
+              { 'y' : 'branch', '_attachments' : { 'b.txt' : data }}, 0 )
+    d = Resolver( db, strategy=LastWriterWins( 'ts' )).run( 'scan' )
+    assert d['resolved'] == 1 and d['failed'] == 0
+    doc = db.Document( 'att' ).fetch()
+    assert doc['y'] == 'branch' and '_attachments' not in doc
+    assert len( leaves( db, 'att' )) == 1
+
+    print "Testing a failed batch is found again in the changes feed ..."
+    conflict( c, db, 'fail', fields, { 'y' : 'branch' }, 0 )
+    def failing( docs, ancestor ) :
+        raise ValueError( 'merge failed' )
+    resolver = Resolver( db, strategy=failing )
+    try    : resolver.run( 'changes' )
+    except ValueError : pass
+    else   : assert False
+    assert resolver.since == 0 and resolver.pendingsince is None
+    resolver.strategy = LastWriterWins( 'ts' )
+    assert resolver.run( 'changes' )['resolved'] == 1
+    assert resolver.since > 0 and len( leaves( db, 'fail' )) == 1
+
+    print "Testing deleted leaves and declined merges are skipped ..."
+    rev1, rev2, branch = conflict( c, db, 'h', fields, {}, 0 )
+    db.Document( 'h' ).fetch( rev=branch ).delete()
+    conflict( c, db, 'k', fields, {}, 0 )
+    resolver = Resolver( db, strategy=lambda docs, ancestor : None )
+    resolver.resolve([ ('h', [ rev2, branch ]), ('k', leaves( db, 'k' )) ])
+    d = resolver.report()
+    assert d['skipped'] == 2 and d['resolved'] == 0
+    assert len( leaves( db, 'k' )) == 2
+
+    print "Testing background resolution from the changes feed ..."
+    resolver = Resolver( db, timeout=0.2 ).start()
+    conflict( c, db, 'm', fields, { 'y' : 1 }, 0 )
+    deadline = time.time() + 3
+    while len( leaves( db, 'm' )) > 1 and time.time() < deadline :
+        time.sleep( 0.02 )
+    resolver.stop()
+    assert leaves( db, 'm' ) == [ db.Document( 'm' ).fetch()['_rev'] ]
+    assert db.Document( 'm' ).fetch()['x'] == 'server'
+    assert len( leaves( db, 'k' )) == 1
+
+if __name__ == '__main__' :
+    server = StandinServer().start()
+    test_resolver( server.url )
+    server.stop()
@@ -11,7 +11,7 @@ from   copy                 import deepcopy
 from   random               import choice
 
 from   couchpy.client       import Client
-from   couchpy.database     import Database
+from   couchpy.database     import Database, _unknownendpoint
 from   couchpy.doc          import Document
 from   couchpy.httperror    import *
 
@@ -190,6 +190,228 @@ def test_changes( url ):
     d = db.changes(feed='normal', since=1, include_docs='true')
     assert all([ 'doc' in x for x in d['results'] ])
 
+def test_bulkget( url ):
+    ca = Client( url=url )
+    ca.login( 'pratap', 'pratap' )
+    [ db.delete() for db in ca.databases ]
+
+    db = ca.put( 'testdb' )
+    db.bulkdocs([ { '_id' : 'doc%03d' % i, 'n' : i } for i in range(120) ])
+    doc = db.Document( 'doc000' ).fetch()
+    rev1 = doc._rev
+    doc.n = 1000
+    doc.put()
+
+    pairs = [ 'doc%03d' % i for i in range(1, 120) ] + \
+            [ ('doc000', rev1), { 'id' : 'doc000' }, ('nodoc', None),
+              ('doc001', '9-abc') ]
+    for supported in [ None, False ] :
+        print "Testing bulk_get(), _bulk_get supported %r ..." % supported
+        c = Client( url=url )
+        c._bulk_get_supported = supported
+        cdb = c.Database( 'testdb' )
+        cdb.BULK_GET_BATCH = 50
+        results = list( cdb.bulk_get( pairs, revs=True ))
+        assert c._bulk_get_supported == (supported is None)
+        assert len( results ) == len( pairs )
+        ok = [ r['docs'][0]['ok'] for r in results if 'ok' in r['docs'][0] ]
+        errors = [ r['docs'][0]['error'] for r in results
+                   if 'error' in r['docs'][0] ]
+        assert sorted([ d['n'] for d in ok ]) == range(120) + [ 1000 ]
+        assert all([ '_revisions' in d for d in ok ])
+        assert sorted([ (e['id'], e['error']) for e in errors ]) == \
+                [ ('doc001', 'not_found'), ('nodoc', 'not_found') ]
+    assert list( db.bulk_get( [] )) == []
+
+    print "Testing bulk_get() errors are not taken for a missing endpoint ..."
+    c = Client( url=url )
+    try    : list( c.Database( 'nodb' ).bulk_get([ 'doc000' ]))
+    except ResourceNotFound : pass
+    else   : assert False
+    assert c._bulk_get_supported == None
+    notfound = lambda reason : ResourceNotFound(( 'not_found', reason ))
+    assert _unknownendpoint( notfound( 'missing' ), dblevel=True )
+    assert not _unknownendpoint( notfound( 'no_db_file' ), dblevel=True )
+    assert not _unknownendpoint(
+            notfound( 'Database does not exist.' ), dblevel=True )
+    assert _unknownendpoint( notfound( 'no_db_file' ))
+    assert _unknownendpoint( ResourceNotAllowed(( 'method_not_allowed', '' )))
+    assert _unknownendpoint( BadRequest(( 'illegal_docid', '' )))
+    assert not _unknownendpoint( BadRequest(( 'bad_request', '' )))
+
+def test_upsert( url ):
+    from couchpy.mixins import MixinDB
+    ca = Client( url=url )
+    ca.login( 'pratap', 'pratap' )
+    [ db.delete() for db in ca.databases ]
+
+    db = ca.put( 'testdb' )
+    db.bulkdocs([ { '_id' : 'u%d' % i, 'n' : i, 'old' : True }
+                  for i in range(5) ])
+    db.Document( 'u4' ).fetch().delete()
+
+    print "Testing upsert() without merge ..."
+    docs = [ { '_id' : 'u%d' % i, 'n' : i * 10 } for i in range(3, 8) ]
+    results = db.upsert( docs )
+    assert [ r['id'] for r in results ] == [ 'u3', 'u4', 'u5', 'u6', 'u7' ]
+    assert all([ 'rev' in r for r in results ])
+    assert results[0]['rev'].startswith( '2-' )
+    doc = db.Document( 'u3' ).fetch()
+    assert doc['n'] == 30 and 'old' not in doc
+
+    print "Testing upsert() with merge and conflict retry ..."
+    other = Client( url=url ).Database( 'testdb' )
+    calls = []
+    def merge( dbdoc, doc ) :
+        calls.append( doc['_id'] )
+        if doc['_id'] == 'u1' and calls.count( 'u1' ) == 1 :
+            d = other.Document( 'u1' ).fetch()   # Concurrent update
+            d['concurrent'] = True
+            d.put()
+        return dict( dbdoc or {}, **doc )
+    docs = [ { '_id' : 'u%d' % i, 'm' : i } for i in [ 0, 1, 2, 9 ] ]
+    results = db.upsert( docs, merge=merge )
+    assert all([ 'rev' in r for r in results ])
+    assert calls == [ 'u0', 'u1', 'u2', 'u9', 'u1' ]    # Only u1 retried
+    doc = db.Document( 'u1' ).fetch()
+    assert doc['m'] == 1 and doc['old'] and doc['concurrent']
+    assert db.Document( 'u9' ).fetch()['m'] == 9
+
+    print "Testing upsert() gives up after retries ..."
+    def conflict( dbdoc, doc ) :
+        d = other.Document( 'u0' ).fetch()
+        d['x'] = d.get( 'x', 0 ) + 1
+        d.put()
+        return doc
+    r = db.upsert( [ { '_id' : 'u0' } ], merge=conflict, retries=1 )
+    assert r[0]['error'] == 'conflict'
+
+    print "Testing Document objects and MixinDB.deleteupdate() ..."
+    doc = db.Document( 'u2' ).fetch()
+    doc['n'] = 'updated'
+    assert 'rev' in db.upsert( [ doc ] )[0]
+    assert doc.n == 'updated' and doc._rev.startswith( '3-' )
+    assert doc._rev == db.Document( 'u2' ).fetch()._rev
+    class MixedDB( Database, MixinDB ) : pass
+    mdb = MixedDB( Client( url=url ), 'testdb' )  # Not in opendbs yet
+    r = mdb.deleteupdate( [ { 'name' : 'u8', 'n' : 8 } ],
+                          key=lambda d : d['name'] )
+    assert r[0]['id'] == 'u8'
+    assert db.Document( 'u8' ).fetch()['n'] == 8
+    doc = mdb.Document( 'u8' ).fetch()
+    doc['n'] = 9
+    r = mdb.deleteupdate( [ doc, { 'name' : 'u9', 'n' : 9 } ],
+                          key=lambda d : d['name'] )
+    assert [ x['id'] for x in r ] == [ 'u8', 'u9' ]
+    assert doc._rev == r[0]['rev'] and doc._rev.startswith( '2-' )
+    assert db.Document( 'u8' ).fetch()['n'] == 9
+
+def test_many( url ):
+    ca = Client( url=url )
+    ca.login( 'pratap', 'pratap' )
+    [ db.delete() for db in ca.databases ]
+
+    db = ca.put( 'testdb' )
+    db.ALL_DOCS_BATCH = 40
+    db.bulkdocs([ { '_id' : 'm%03d' % i, 'n' : i } for i in range(100) ])
+    db.Document( 'm000' ).fetch().delete()
+
+    print "Testing exists_many() and current_revs() ..."
+    ids = [ 'm%03d' % i for i in range(0, 120, 2) ]
+    exists = db.exists_many( ids )
+    assert sorted( exists.keys() ) == sorted( ids )
+    assert [ _id for _id in ids if exists[_id] ] == \
+                [ 'm%03d' % i for i in range(2, 100, 2) ]
+    revs = db.current_revs( ids )
+    assert sorted( revs ) == [ 'm%03d' % i for i in range(2, 100, 2) ]
+    assert revs['m002'] == db.Document( 'm002' ).fetch()._rev
+    assert db.current_revs( [] ) == {} and db.exists_many( [] ) == {}
+    exists = db.exists_many( iter( ids ))      # ids as a generator
+    assert sorted( exists.keys() ) == sorted( ids ) and exists['m002']
+
+    print "Testing delete_many() ..."
+    results = db.delete_many( _id for _id in ids )
+    assert len( results ) == 49 and all([ 'rev' in r for r in results ])
+    assert len( db ) == 50
+    assert not any( db.exists_many( ids ).values() )
+    assert db.exists_many([ 'm001' ]) == { 'm001' : True }
+
+def test_find( url ):
+    ca = Client( url=url )
+    ca.login( 'pratap', 'pratap' )
+    [ db.delete() for db in ca.databases ]
+
+    db = ca.put( 'testdb' )
+    db.bulkdocs([ { '_id' : 'post%02d' % i, 'type' : 'post', 'year' : 2000+i,
+                    'tags' : ['couch', 'odd' if i % 2 else 'even'],
+                    'author' : { 'name' : 'joe%s' % (i % 3) } }
+                  for i in range(30) ] + [{ '_id' : 'page', 'type' : 'page' }])
+
+    print "Testing find() with selector operators ..."
+    ids = lambda docs : [ doc['_id'] for doc in docs ]
+    assert len( list( db.find({ 'type' : 'post' }) )) == 30
+    assert ids( db.find({ 'year' : { '$gte' : 2027 }}) ) == \
+                    [ 'post27', 'post28', 'post29' ]
+    assert ids( db.find({ 'author.name' : 'joe1', 'year' : {'$lt' : 2010} })) \
+                    == [ 'post01', 'post04', 'post07' ]
+    assert ids( db.find({ '$or' : [ { 'year' : 2001 }, { '_id' : 'page' } ]})) \
+                    == [ 'page', 'post01' ]
+    assert ids( db.find({ 'tags' : { '$all' : ['odd'] },
+                          'year' : { '$in' : [2001, 2002, 2003] }})) == \
+                    [ 'post01', 'post03' ]
+    assert ids( db.find({ 'year' : { '$exists' : False }})) == [ 'page' ]
+    assert ids( db.find({ 'tags' : { '$elemMatch' : { '$eq' : 'even' }},
+                          'year' : { '$not' : { '$gt' : 2002 }}})) == \
+                    [ 'post00', 'post02' ]
+
+    print "Testing find() with fields, skip and limit ..."
+    docs = list( db.find({ 'type' : 'post' }, fields=['_id', 'author.name'],
+                         skip=3, limit=2 ))
+    assert docs == [ { '_id' : 'post03', 'author' : { 'name' : 'joe0' }},
+                     { '_id' : 'post04', 'author' : { 'name' : 'joe1' }} ]
+
+    print "Testing find() paging by bookmark ..."
+    docs = list( db.find({ 'type' : 'post' }, batch=7, limit=25 ))
+    assert ids( docs ) == [ 'post%02d' % i for i in range(25) ]
+    gen = db.find({ 'type' : 'post' }, batch=4 )
+    assert gen.next()['_id'] == 'post00'    # Lazy, first batch only
+
+    print "Testing indexes and sort ..."
+    try :
+        list( db.find({ 'year' : { '$gt' : 2000 }}, sort=['year'] ))
+        assert False
+    except BadRequest :
+        pass
+    d = db.createindex( ['year'], name='by-year', ddoc='posts' )
+    assert d['result'] == 'created' and d['id'] == '_design/posts'
+    assert db.createindex( ['year'], name='by-year', ddoc='posts'
+                         )['result'] == 'exists'
+    indexes = db.indexes()
+    assert [ (i['ddoc'], i['name']) for i in indexes ] == \
+                [ (None, '_all_docs'), ('_design/posts', 'by-year') ]
+    docs = list( db.find({ 'year' : { '$gt' : 2020 }},
+                         sort=[{ 'year' : 'desc' }], batch=3 ))
+    assert ids( docs ) == [ 'post%02d' % i for i in range(29, 20, -1) ]
+    assert db.explain({ 'year' : { '$gt' : 2020 }})['index']['name'] == \
+                'by-year'
+    assert db.explain({ 'type' : 'post' })['index']['name'] == '_all_docs'
+
+    print "Testing partial indexes ..."
+    db.createindex( ['year'], name='odd', ddoc='posts',
+                    partial_filter_selector={ 'tags' : { '$all' : ['odd'] }})
+    docs = db.find({ 'year' : { '$gt' : 2020 }}, use_index=['posts', 'odd'])
+    assert ids( docs ) == [ 'post21', 'post23', 'post25', 'post27', 'post29' ]
+
+    print "Testing deleteindex() ..."
+    assert db.deleteindex( '_design/posts', 'odd' )['ok'] == True
+    assert db.deleteindex( 'posts', 'by-year' )['ok'] == True
+    assert len( db.indexes() ) == 1
+    try :
+        db.deleteindex( 'posts', 'by-year' )
+        assert False
+    except ResourceNotFound :
+        pass
+
 def continuous_changes( url ):
     c = Client( url=url )
     db = c.Database( 'testdb' )
@@ -205,4 +427,8 @@ if __name__ == '__main__' :
     print 'CouchDB version %s' % c.version()
     test_basics( url )
     test_changes( url )
+    test_bulkget( url )
+    test_upsert( url )
+    test_many( url )
+    test_find( url )
     #continuous_changes( url )
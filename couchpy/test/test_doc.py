@@ -7,6 +7,7 @@
 # -*- coding: utf-8 -*-
 
 import sys, os, pprint, logging
+from   threading    import Thread
 from   os.path      import join, abspath, basename, splitext
 from   copy         import deepcopy
 from   random       import choice
@@ -18,6 +19,7 @@ from   couchpy.doc       import Document, LocalDocument, ImmutableDocument
 from   couchpy.doc       import Attachment, Views, View, Query
 from   couchpy.doc       import ST_ACTIVE_INVALID, ST_ACTIVE_VALID
 from   couchpy.httperror import *
+from   couchpy.utils     import parallel
 
 log = logging.getLogger( __name__ )
 files = map(
@@ -382,6 +384,77 @@ def test_designdoc( url ):
     assert view2.query == qdict1
 
 
+def test_threads( url ):
+    print "Testing shared object model across threads ..."
+    ca = Client( url=url, )
+    ca.login( 'pratap', 'pratap' )
+    [ db.delete() for db in ca.databases ]
+    c = Client( url=url, )
+    c.login( 'pratap', 'pratap' )
+    ids = [ 'doc%s' % (i % 10) for i in range(200) ]
+    for x in range(5) :
+        c.put( 'testdb' )
+        # Threads instantiating the same database and documents, get the
+        # same objects.
+        dbs = [ r for i, r, e in parallel(
+                    lambda i : c.Database('testdb'), range(50), 16 ) ]
+        assert len( set( map( id, dbs ))) == 1
+        db = dbs[0]
+        docs = [ (i, r) for i, r, e in parallel(
+                    lambda i : db.Document( i ), ids, 16 ) ]
+        assert len( set([ id(d) for i, d in docs ])) == 10
+        assert all([ d._id == i for i, d in docs ])
+        active = db.singleton_docs['active']
+        assert sorted( active.keys() ) == sorted( set(ids) )
+
+        # Instantiating the database again, from two threads, leaves the
+        # shared instance and its documents undisturbed. Instances with
+        # their own headers are not shared.
+        conn, hdbs = db.conn, []
+        threads = [ Thread( target=lambda i : hdbs.append( c.Database(
+                                'testdb', hthdrs={ 'X-Thread' : str(i) })),
+                            args=( i, )) for i in range(2) ]
+        [ t.start() for t in threads ] ; [ t.join() for t in threads ]
+        assert db.singleton_docs['active'] is active
+        assert sorted( active.keys() ) == sorted( set(ids) )
+        assert db.conn is conn and 'X-Thread' not in db.hthdrs
+        assert sorted([ d.hthdrs['X-Thread'] for d in hdbs ]) == [ '0', '1' ]
+        assert all([ d is not db for d in hdbs ])
+
+        # Concurrent posts of distinct documents
+        newids = [ 'new%s' % i for i in range(100) ]
+        errs = [ e for i, r, e in parallel(
+                    lambda i : db.Document({ '_id' : i }).post(), newids, 16 )
+                 if e ]
+        assert errs == []
+        assert set( newids ) <= set( active.keys() )
+        assert len( db.all_docs()['rows'] ) == 100
+        c.delete( 'testdb' )
+        assert c.Database( 'testdb' ) is not db
+
+    # Database created again, by another client, has no stale documents.
+    db = c.put( 'testdb' )
+    rev = db.Document({ '_id' : 'a', 'v' : 1 }).post()._rev
+    ca.delete( 'testdb' )
+    doc = c.put( 'testdb' ).Document({ '_id' : 'a', 'v' : 2 }).post()
+    assert doc._rev.startswith( '1-' ) and doc._rev != rev
+    assert db.Document( 'a' ).v == 1
+    ca.delete( 'testdb' )
+
+    print "Testing per-thread object model ..."
+    c = Client( url=url, config={ 'client.threadlocal' : True } )
+    ca.put( 'testdb' )
+    results = []
+    opendb = lambda : results.append(
+                        (c.Database('testdb'), c.Database('testdb')) )
+    threads = [ Thread( target=opendb ) for i in range(4) ]
+    [ t.start() for t in threads ] ; [ t.join() for t in threads ]
+    opendb()
+    assert all([ a is b for a, b in results ])
+    assert len( set([ id(a) for a, b in results ])) == 5
+    assert all([ a.conn.htsess is c.conn.htsess for a, b in results ])
+    ca.delete( 'testdb' )
+
 if __name__ == '__main__' :
     url = 'http://localhost:5984/'
     c = Client( url=url, )
@@ -396,3 +469,5 @@ if __name__ == '__main__' :
     test_immutdoc( url )
     print ''
     test_designdoc( url )
+    print ''
+    test_threads( url )
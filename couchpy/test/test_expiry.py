@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+import logging, time
+
+from   couchpy.client       import Client
+from   couchpy.standin      import StandinServer
+
+log = logging.getLogger( __name__ )
+
+def sessions( n, expires, prefix='s' ):
+    return [ { '_id' : '%s%03d' % (prefix, i), 'user' : 'u%s' % i,
+               'expires' : expires + i } for i in range(n) ]
+
+def test_sweeper( url ):
+    c = Client( url=url )
+    [ db.delete() for db in c.databases ]
+    db = c.put( 'testdb' )
+    now = time.time()
+    db.bulkdocs( sessions( 25, now - 100 ) + sessions( 5, now + 3600, 'f' ) +
+                 [ { '_id' : 'keep' }, { '_id' : 'str', 'expires' : 'x' } ])
+
+    print "Testing view deployment ..."
+    sweeper = db.ExpirySweeper( language='python', batch=10, rate=None )
+    assert sweeper.deploy() == True
+    assert sweeper.deploy() == False                # Already deployed
+    other = db.ExpirySweeper( field='ttl', language='python' )
+    assert other.deploy() == True
+    ddoc = db.DesignDocument( '_design/expiry' ).fetch()
+    assert sorted( ddoc['views'].keys() ) == [ 'expires', 'ttl' ]
+
+    print "Testing backlog ..."
+    count, lag = sweeper.backlog( now )
+    assert count == 25 and 99 < lag <= 100
+    report = sweeper.report()
+    assert report['backlog'] == 25 and report['lag'] == lag
+
+    print "Testing sweep in batches ..."
+    assert sweeper.sweep( now ) == 25
+    d = sweeper.report()
+    assert d['deleted'] == 25 and d['batches'] == 3 and d['sweeps'] == 1
+    assert d['failed'] == 0 and d['purged'] == 0
+    assert sweeper.backlog( now ) == (0, None)
+    ids = [ r['id'] for r in db.all_docs()['rows'] ]
+    assert 'keep' in ids and 'str' in ids and 'f004' in ids
+    assert 's000' not in ids and len( ids ) == 8
+
+    print "Testing failures are counted and skipped ..."
+    db.bulkdocs( sessions( 3, now - 50, 'c' ))
+    view = sweeper.view()
+    stale = dict([ (r['id'], r['value'])
+                   for r in view.fetch( reduce='false' )['rows'] ])
+    doc = db.Document( 'c001' ).fetch()
+    doc['user'] = 'renewed'                 # Updated after the view was read
+    doc.put()
+    real = sweeper.view
+    class Stale( object ) :
+        def fetch( self, **q ) :
+            d = real().fetch( **q )
+            [ r.__setitem__( 'value', stale.get( r['id'], r['value'] ))
+              for r in d['rows'] ]
+            return d
+    sweeper.view = lambda : Stale()
+    assert sweeper.sweep( now ) == 2
+    assert sweeper.report()['failed'] == 1
+    del sweeper.view
+    assert sweeper.backlog( now )[0] == 1
+    assert sweeper.sweep( now ) == 1
+
+    print "Testing purge ..."
+    db.bulkdocs( sessions( 4, now - 10, 'p' ))
+    sweeper = db.ExpirySweeper( language='python', purge=True, rate=None )
+    assert sweeper.sweep( now ) == 4 and sweeper.report()['purged'] == 4
+    d = db.all_docs( keys=[ 'p000', 's000' ] )
+    assert [ r.get( 'error' ) for r in d['rows'] ] == [ 'not_found', None ]
+
+    print "Testing rate limiting ..."
+    db.bulkdocs( sessions( 20, now - 30, 'r' ))
+    sweeper = db.ExpirySweeper( language='python', batch=5, rate=100,
+                                duty=None )
+    st = time.time()
+    assert sweeper.sweep( now ) == 20
+    assert time.time() - st >= 0.15             # 3 throttled batches of 5
+    sweeper = db.ExpirySweeper( rate=None, duty=0.2 )
+    st = time.time()
+    sweeper.throttle( 10, 0.02 )                # 4 times the busy time
+    assert 0.08 <= time.time() - st < 0.5
+
+    print "Testing background sweeps ..."
+    db.bulkdocs( sessions( 6, time.time() - 10, 'b' ))
+    sweeper = db.ExpirySweeper( language='python', interval=0.05 ).start()
+    deadline = time.time() + 3
+    while sweeper.report()['deleted'] < 6 and time.time() < deadline :
+        time.sleep( 0.02 )
+    sweeper.stop()
+    d = sweeper.report()
+    assert d['deleted'] == 6 and d['sweeps'] >= 1 and d['backlog'] is not None
+
+if __name__ == '__main__' :
+    server = StandinServer().start()
+    test_sweeper( server.url )
+    server.stop()
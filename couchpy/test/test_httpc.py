@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+import logging, os, tempfile
+
+try:
+    from cStringIO      import StringIO
+except ImportError:
+    from StringIO       import StringIO
+
+from   couchpy.client       import Client
+from   couchpy.httpc        import ChunkedReader, SpooledBody, iterlines, spool
+from   couchpy.rest         import _decodespooled
+from   couchpy.standin      import StandinServer, jsonbody
+from   couchpy.utils        import JSON
+
+log = logging.getLogger( __name__ )
+json = JSON()
+
+def chunked( chunks, trailers='' ) :
+    body = ''.join([ '%x\r\n%s\r\n' % (len(c), c) for c in chunks ])
+    return body + '0\r\n' + trailers + '\r\n'
+
+def test_chunkedreader() :
+    print "Testing chunked transfer decoder ..."
+    chunks = [ '{"seq":1}\n{"seq"', ':2}\n', '\n', 'x' * 100000, '\r\n' ]
+    fp = StringIO( chunked( chunks, 'X-Trailer: 1\r\n' ) + 'next' )
+    reader = ChunkedReader( fp, bufsize=16 )
+    assert ''.join( reader.iterchunks() ) == ''.join( chunks )
+    assert fp.read() == 'next'      # Trailers consumed, nothing more
+
+    lines = list( iterlines([ 'a\nb', 'c', 'd\n', '\n', 'e\r\nf' ]))
+    assert lines == [ 'a', 'bcd', '', 'e', 'f' ]
+    assert list( iterlines([ '\n' ])) == [ '' ]     # Heartbeat
+
+def test_streaming( url ) :
+    print "Testing streamed changes ..."
+    c = Client( url=url )
+    db = c.put( 'streaming' )
+    db.bulkdocs([ { 'name' : 'user%s' % i, 'bio' : 'x' * (i * 100) }
+                  for i in range(200) ])
+    lines = []
+    db.changes( feed='continuous', since=0, timeout=100, include_docs='true',
+                callback=lambda line : lines.append( line ))
+    docs = [ line['doc'] for line in lines if line and 'doc' in line ]
+    assert len(docs) == 200
+    assert sorted([ len(d['bio']) for d in docs ]) == range( 0, 20000, 100 )
+    assert isinstance( c.all_dbs(), list )  # Connection is reusable
+    c.delete( 'streaming' )
+
+def test_spool( url ) :
+    print "Testing spooled responses ..."
+    body = spool( iter([ 'a' * 10, 'b\n' ]), 20 )
+    assert body == 'a' * 10 + 'b\n'
+    body = spool( iter([ 'a' * 10, 'b\n', 'c' * 10 ]), 20 )
+    assert isinstance( body, SpooledBody ) and len(body) == 22
+    assert body.read( 5 ) == 'aaaaa' and body.tell() == 5
+    assert list( body ) == [ 'aaaaab', 'c' * 10 ]
+    assert body[10:12] == 'b\n' and body.getvalue()[-1] == 'c'
+    body.close()
+
+    # Row per line bodies are decoded a row at a time, others as a whole.
+    data = { 'total_rows' : 3, 'offset' : 0,
+             'rows' : [ { 'id' : 'r%s' % i, 'value' : ',]\n' }
+                        for i in range(3) ]}
+    body = spool( iter([ jsonbody( data ) ]), 10 )
+    body.getvalue = None                # Body is not copied as a whole
+    assert _decodespooled( body ) == data
+    body.close()
+    data = { 'results' : [ { 'seq' : 1 } ], 'last_seq' : 1 }
+    body = spool( iter([ jsonbody( data ) ]), 10 )
+    assert _decodespooled( body ) == data
+    body.close()
+    for text in [ json.encode( data ), '{"a":{"rows":[\n{"x":1}\n]}}' ] :
+        body = spool( iter([ text ]), 10 )
+        assert _decodespooled( body ) == json.decode( text )
+        body.close()
+
+    c = Client( url=url, config={ 'client.spool_threshold' : 4096 } )
+    db = c.put( 'spooled' )
+    db.bulkdocs([ { '_id' : 'doc%03d' % i, 'bio' : 'x' * 100 }
+                  for i in range(200) ])
+    s, h, d = c.conn.htsess.request(
+                    'GET', url + '/spooled/_all_docs?include_docs=true' )
+    assert isinstance( d, SpooledBody ) and len(d) > 200 * 100
+    d.close()
+    d = db.all_docs( include_docs='true' )
+    assert [ r['doc']['bio'] for r in d['rows'] ] == [ 'x' * 100 ] * 200
+    assert isinstance( db(), dict )     # Small responses are not spooled
+
+    fd, filepath = tempfile.mkstemp( suffix='.bin' )
+    data = os.urandom( 100000 )
+    os.write( fd, data ) ; os.close( fd )
+    try :
+        doc = db.Document({ '_id' : 'attachdoc' }).post()
+        doc.Attachment( filepath=filepath,
+                        content_type='application/octet-stream' ).put()
+        # Spooled attachment body is closed once it is read.
+        closed, close = [], SpooledBody.close
+        SpooledBody.close = lambda self : closed.append( self ) or close(self)
+        try :
+            att = doc.Attachment( filename=os.path.basename(filepath) ).get()
+        finally :
+            SpooledBody.close = close
+        assert att.data == data
+        assert len( closed ) == 1 and closed[0].fd.closed
+    finally :
+        os.remove( filepath )
+
+    body = c.log( stream=True )
+    assert hasattr( body, 'read' ) and all([ line for line in body ])
+    c.delete( 'spooled' )
+
+if __name__ == '__main__' :
+    test_chunkedreader()
+    server = StandinServer().start()
+    test_streaming( server.url )
+    test_spool( server.url )
+    server.stop()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+import logging, time, os, tempfile
+
+from   couchpy.client       import Client
+from   couchpy.standin      import StandinServer
+
+log = logging.getLogger( __name__ )
+
+byorder = """
+def fun( doc ):
+    if doc.get( 'type' ) == 'order' :
+        emit( [ doc['customer'], doc['date'] ], doc['total'] )
+"""
+
+byname = """
+def fun( doc ):
+    if doc.get( 'type' ) == 'user' :
+        emit( doc['name'], 1 )
+"""
+
+def waitfor( fn, timeout=2 ):
+    deadline = time.time() + timeout
+    while not fn() and time.time() < deadline :
+        time.sleep( 0.01 )
+    return fn()
+
+def orders( n, start=0 ):
+    return [ { '_id' : 'o%03d' % i, 'type' : 'order', 'total' : i,
+               'customer' : 'c%s' % (i % 3), 'date' : '2012-01-%02d' % i }
+             for i in range( start, start + n ) ]
+
+def test_matview( url ):
+    c = Client( url=url )
+    [ db.delete() for db in c.databases ]
+    db = c.put( 'testdb' )
+    db.bulkdocs( orders( 30 ) + [ { '_id' : 'x', 'type' : 'note' } ])
+    ddoc = db.DesignDocument({ '_id' : '_design/py', 'language' : 'python',
+        'views' : { 'byorder' : { 'map' : byorder, 'reduce' : '_sum' }}})
+    ddoc.post()
+    sview = ddoc.views()['byorder']
+
+    print "Testing view matches server view ..."
+    view = db.MaterializedView( byorder, '_sum', batch=7 ).start()
+    assert len( view ) == 30
+    q = { 'startkey' : ['c1', {}], 'endkey' : ['c1'], 'descending' : True,
+          'limit' : 3, 'skip' : 1, 'reduce' : False }
+    d = view.fetch( **q )
+    ref = sview.fetch( startkey='["c1",{}]', endkey='["c1"]',
+                       descending='true', limit=3, skip=1, reduce='false' )
+    assert d == ref and d['offset'] == 11
+    assert [ r['value'] for r in d['rows'] ] == [ 25, 22, 19 ]
+    ref = sview.fetch( group_level=1 )
+    assert view.fetch( group_level=1 ) == ref
+    assert ref['rows'][0] == { 'key' : ['c0'], 'value' : sum(range(0,30,3)) }
+    assert view.fetch()['rows'] == [ { 'key' : None, 'value' : 435 } ]
+    d = view.fetch( keys=[ ['c2', '2012-01-05'], ['c0', '2012-01-00'] ],
+                    reduce=False )
+    assert [ r['id'] for r in d['rows'] ] == [ 'o005', 'o000' ]
+    d = view.fetch( startkey=['c0'], endkey=['c0', '2012-01-06'],
+                    inclusive_end=False, reduce=False )
+    assert [ r['id'] for r in d['rows'] ] == [ 'o000', 'o003' ]
+    d = view.fetch( key=['c0', '2012-01-06'], reduce=False )
+    assert [ r['id'] for r in d['rows'] ] == [ 'o006' ]
+
+    print "Testing incremental updates ..."
+    doc = db.Document( 'o004' ).fetch()
+    doc['customer'] = 'c0'
+    doc.put()
+    db.Document( 'o005' ).fetch().delete()
+    db.bulkdocs( orders( 2, start=30 ))
+    assert waitfor( lambda : len( view ) == 31 )
+    time.sleep( 0.05 )
+    d = view.fetch( startkey=['c0'], endkey=['c0', {}], reduce=False )
+    assert 'o004' in [ r['id'] for r in d['rows'] ]
+    assert [ r['id'] for r in d['rows'] ][-1] == 'o030'
+    assert view.fetch( key=['c2', '2012-01-05'], reduce=False )['rows'] == []
+    assert view.fetch( group_level=1 ) == sview.fetch( group_level=1 )
+    view.stop()
+
+    print "Testing mixed case keys collate like CouchDB ..."
+    names = [ 'b', 'B', 'a', 'A', 'ba', 'Ab', 'aa', 'a', 'B' ]
+    db.bulkdocs([ { '_id' : 'u%s' % i, 'type' : 'user', 'name' : name }
+                  for i, name in enumerate( names ) ])
+    ddoc = db.DesignDocument({ '_id' : '_design/names', 'language' : 'python',
+        'views' : { 'byname' : { 'map' : byname, 'reduce' : '_count' }}})
+    ddoc.post()
+    sview = ddoc.views()['byname']
+    view = db.MaterializedView( byname, '_count' )
+    view.sync()
+    d = view.fetch( reduce=False )
+    assert [ r['key'] for r in d['rows'] ] == \
+           [ 'a', 'a', 'A', 'aa', 'Ab', 'b', 'B', 'B', 'ba' ]
+    assert d == sview.fetch( reduce='false' )
+    d = view.fetch( startkey='A', endkey='b', reduce=False )
+    assert [ r['key'] for r in d['rows'] ] == [ 'A', 'aa', 'Ab', 'b' ]
+    assert d['offset'] == 2
+    d = view.fetch( group=True )
+    assert d['rows'] == [ { 'key' : k, 'value' : n } for k, n in
+            [ ('a', 2), ('A', 1), ('aa', 1), ('Ab', 1), ('b', 1), ('B', 2),
+              ('ba', 1) ]]
+    assert d == sview.fetch( group='true' )
+
+    print "Testing callables and a document seen twice in a batch ..."
+    def bycustomer( doc ) :
+        return [ (doc['customer'], 1) ] if 'customer' in doc else []
+    view = db.MaterializedView( bycustomer )
+    row = { 'id' : 'y', 'doc' : { '_id' : 'y', 'customer' : 'cz' }}
+    view.apply( [ row, row, { 'id' : 'y', 'deleted' : True }, row ], 1 )
+    assert len( view ) == 1
+    view.apply( [ dict( row, doc={ '_id' : 'y' }) ], 2 )
+    assert len( view ) == 0 and view.docrows == {}
+
+    print "Testing checkpoints replay only new changes ..."
+    fd, path = tempfile.mkstemp( suffix='.json' )
+    os.close( fd ) ; os.remove( path )
+    try :
+        view = db.MaterializedView( byorder, checkpoint=path ).start()
+        view.stop()
+        rows, since = view.fetch()['rows'], view.since
+        db.bulkdocs( orders( 3, start=40 ))
+        view = db.MaterializedView( byorder, checkpoint=path )
+        assert view.since == since and view.fetch()['rows'] == rows
+        assert view.sync() == 3 and len( view ) == 34
+        view = db.MaterializedView( byorder, '_count', checkpoint=path )
+        assert view.since == 0 and len( view ) == 0     # Different functions
+    finally :
+        os.remove( path )
+
+if __name__ == '__main__' :
+    server = StandinServer().start()
+    test_matview( server.url )
+    server.stop()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+import logging, sys, os, subprocess
+from   StringIO             import StringIO
+
+from   couchpy.client       import Client
+from   couchpy.httperror    import *
+from   couchpy.queryserver  import QueryServer
+from   couchpy.standin      import StandinServer
+from   couchpy.utils        import JSON
+
+log = logging.getLogger( __name__ )
+json = JSON()
+
+bytag = """
+def fun( doc ):
+    for tag in doc.get( 'tags', [] ) :
+        emit( tag, doc['n'] )
+"""
+
+byn = """
+def fun( doc ):
+    yield doc['n'], None
+"""
+
+total = """
+def fun( keys, values, rereduce ):
+    return sum( values )
+"""
+
+validate = """
+def fun( newdoc, olddoc, userctx, secobj ):
+    if 'n' not in newdoc :
+        raise Forbidden( 'n is required' )
+    if userctx.get( 'name' ) is None :
+        raise Unauthorized( 'login please' )
+"""
+
+filters = """
+def fun( doc, req ):
+    return doc['n'] > int( req['query']['min'] )
+"""
+
+updates = """
+def fun( doc, req ):
+    doc['n'] += 1
+    return doc, 'incremented'
+"""
+
+def test_protocol():
+    qs = QueryServer()
+    print "Testing map functions ..."
+    assert qs.handle([ 'reset', { 'reduce_limit' : True }]) == True
+    assert qs.handle([ 'add_fun', bytag ]) == True
+    assert qs.handle([ 'add_fun', byn ]) == True
+    doc = { '_id' : 'a', 'n' : 2, 'tags' : [ 'x', 'y' ]}
+    assert qs.handle([ 'map_doc', doc ]) == \
+                [ [ ('x', 2), ('y', 2) ], [ (2, None) ] ]
+    fn = qs.mapfns[0]
+    qs.handle([ 'reset' ])
+    qs.handle([ 'add_fun', bytag ])
+    assert qs.mapfns == [ fn ]          # Compiled once, cached
+    assert qs.handle([ 'map_doc', { '_id' : 'b', 'tags' : ['z'] }]) == [ [] ]
+
+    print "Testing reduce and rereduce ..."
+    kvs = [ [ ['x', 'a'], 2 ], [ ['y', 'a'], 3 ], [ ['y', 'b'], 5 ] ]
+    assert qs.handle([ 'reduce', [ total, '_count', '_sum' ], kvs ]) == \
+                [ True, [ 10, 3, 10 ] ]
+    d = qs.handle([ 'reduce', [ '_stats' ], kvs ])[1][0]
+    assert d == { 'sum' : 10, 'count' : 3, 'min' : 2, 'max' : 5,
+                  'sumsqr' : 38 }
+    assert qs.handle([ 'rereduce', [ '_stats' ], [ d, d ]])[1][0]['count'] == 6
+    assert qs.handle([ 'rereduce', [ '_count', total ], [ 3, 4 ]]) == \
+                [ True, [ 7, 7 ]]
+    assert qs.handle([ 'reduce', [ '_sum' ],
+                       [ [None, [1, 2]], [None, [3]], [None, 4] ] ]) == \
+                [ True, [ [8, 2] ]]
+    assert qs.handle([ 'rereduce', [ '_sum' ],
+                       [ { 'a' : 1 }, { 'a' : 2, 'b' : 1 } ]]) == \
+                [ True, [ { 'a' : 3, 'b' : 1 } ]]
+    assert qs.handle([ 'reduce', [ '_sum' ], [ [None, 'x'] ]])[:2] == \
+                [ 'error', 'builtin_reduce_error' ]
+
+    print "Testing errors ..."
+    assert qs.handle([ 'add_fun', 'x = 1' ])[:2] == \
+                [ 'error', 'compilation_error' ]
+    assert qs.handle([ 'add_fun', 'def fun( doc ) :\n  emit(' ])[:2] == \
+                [ 'error', 'compilation_error' ]
+    assert qs.handle([ 'nosuch' ])[:2] == [ 'error', 'unknown_command' ]
+
+    print "Testing design document functions ..."
+    ddoc = { '_id' : '_design/py', 'language' : 'python',
+             'validate_doc_update' : validate,
+             'filters' : { 'min' : filters },
+             'updates' : { 'inc' : updates },
+             'shows' : { 'n' : "def fun( doc, req ):\n"
+                               "    return { 'json' : doc['n'] }" },
+             'views' : { 'byn' : { 'map' : byn }}}
+    assert qs.handle([ 'ddoc', 'new', '_design/py', ddoc ]) == True
+    call = lambda path, args : qs.handle([ 'ddoc', '_design/py', path, args ])
+    user = { 'name' : 'joe', 'roles' : [] }
+    assert call( ['validate_doc_update'], [{ 'n' : 1 }, None, user, {}] ) == 1
+    assert call( ['validate_doc_update'], [{}, None, user, {}] ) == \
+                { 'forbidden' : 'n is required' }
+    assert call( ['validate_doc_update'],
+                 [{ 'n' : 1 }, None, { 'name' : None }, {}] ) == \
+                { 'unauthorized' : 'login please' }
+    docs = [ { 'n' : 1 }, { 'n' : 5 }, { 'x' : 1 } ]
+    assert call( ['filters', 'min'], [ docs[:2], { 'query' : { 'min' : '2' }}]
+               ) == [ True, [ False, True ]]
+    assert call( ['views', 'byn', 'map'], [ docs[:2] ]) == [ True, [True]*2 ]
+    assert call( ['updates', 'inc'], [ { 'n' : 1 }, {} ]) == \
+                [ 'up', { 'n' : 2 }, { 'body' : 'incremented' }]
+    assert call( ['shows', 'n'], [ { 'n' : 7 }, {} ]) == \
+                [ 'resp', { 'json' : 7 }]
+    assert call( ['lists', 'x'], [] )[:2] == [ 'error', 'not_found' ]
+    assert qs.handle([ 'ddoc', '_design/no', ['shows', 'n'], [{}, {}] ])[:2] \
+                == [ 'error', 'query_protocol_error' ]
+
+def test_stream():
+    print "Testing line protocol ..."
+    lines = [ [ 'reset' ], [ 'add_fun', bytag ],
+              [ 'map_doc', { '_id' : 'a', 'n' : 1, 'tags' : ['t'] }],
+              [ 'map_doc', { '_id' : 'b', 'n' : 1, 'tags' : 'uv' }],
+              [ 'map_doc', { '_id' : 'c', 'n' : 1, 'tags' : None }],
+              [ 'reduce', [ '_sum' ], [ [ ['t', 'a'], 1 ] ]] ]
+    input = ''.join([ json.encode( l ) + '\n' for l in lines ])
+    output = StringIO()
+    QueryServer().run( StringIO( input ), output )
+    out = [ json.decode( l ) for l in output.getvalue().splitlines() ]
+    assert out[:4] == [ True, True, [[['t', 1]]], [[['u', 1], ['v', 1]]] ]
+    assert out[4][0] == 'log' and 'doc._id c' in out[4][1]
+    assert out[5:] == [ [[]], [ True, [1] ] ]
+
+    print "Testing couchpy-queryserver process ..."
+    env = dict( os.environ, PYTHONPATH=os.pathsep.join( sys.path ))
+    p = subprocess.Popen([ sys.executable, '-m', 'couchpy.queryserver' ],
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         env=env )
+    for l, expected in zip( lines[:3], out[:3] ) :
+        p.stdin.write( json.encode( l ) + '\n' )
+        p.stdin.flush()
+        assert json.decode( p.stdout.readline() ) == expected
+    p.stdin.close()
+    assert p.wait() == 0
+
+def test_standin( url ):
+    print "Testing stand-in views run by query server ..."
+    c = Client( url=url )
+    [ db.delete() for db in c.databases ]
+    db = c.put( 'testdb' )
+    db.bulkdocs([ { 'n' : i, 'tags' : [ 't%s' % (i % 2) ]}
+                  for i in range(10) ])
+    ddoc = db.DesignDocument({ '_id' : '_design/py', 'language' : 'python',
+                               'views' : { 'bytag' : { 'map' : bytag,
+                                                       'reduce' : '_stats' },
+                                           'bad' : { 'map' : 'x = 1' }}})
+    ddoc.post()
+    views = ddoc.views()
+    d = views['bytag'].fetch( group='true' )
+    assert [ (r['key'], r['value']['sum']) for r in d['rows'] ] == \
+                [ ('t0', 20), ('t1', 25) ]
+    try :
+        views['bad'].fetch()
+        assert False
+    except BadRequest :
+        pass
+
+if __name__ == '__main__' :
+    test_protocol()
+    test_stream()
+    server = StandinServer().start()
+    test_standin( server.url )
+    server.stop()
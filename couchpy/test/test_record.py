@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+import logging, os, tempfile, time
+
+from   couchpy.client       import Client
+from   couchpy.httpc        import iterlines
+from   couchpy.httperror    import ResourceNotFound
+from   couchpy.record       import RecordingSession, ReplaySession
+
+log = logging.getLogger( __name__ )
+
+def workload( c, filepath ):
+    [ c.delete( db ) for db in c.all_dbs() if db == 'recorddb' ]
+    db = c.put( 'recorddb' )
+    doc = db.Document({ '_id' : 'joe', 'name' : 'joe' }).post()
+    doc.Attachment( filepath=filepath ).put()
+    att = doc.Attachment( filename=os.path.basename(filepath) ).get()
+    db.bulkdocs([ { 'val' : i } for i in range(10) ])
+    doc = db.Document( 'joe' ).fetch()
+    try    : db.Document( 'nobody' ).fetch()
+    except ResourceNotFound : pass
+    lines = []
+    db.changes( feed='continuous', since=0, timeout=100,
+                callback=lambda line : line and lines.append( line ))
+    rows = db.all_docs( include_docs='true' )['rows']
+    c.delete( 'recorddb' )
+    return doc.name, att.data, len(lines), len(rows)
+
+def test_record( url ) :
+    print "Testing RecordingSession and ReplaySession ..."
+    fd, filepath = tempfile.mkstemp( suffix='.jsonl.gz' )
+    os.close( fd )
+    fd, attachpath = tempfile.mkstemp( suffix='.bin' )
+    os.write( fd, '\xff\xfe' * 100000 )
+    os.close( fd )
+    try :
+        rec = RecordingSession( filepath )
+        c = Client( url, htsess=rec )
+        c.login( 'pratap', 'pratap' )
+        recorded = workload( c, attachpath )
+        rec.close()
+        assert rec.count > 10
+
+        replay = ReplaySession( filepath )
+        c = Client( url, htsess=replay )
+        c.login( 'pratap', 'pratap' )
+        assert workload( c, attachpath ) == recorded
+        assert replay.remaining() == 0
+
+        print "Testing replayed responses ..."
+        c = Client( url )
+        c.login( 'pratap', 'pratap' )
+        db = c.put( 'recorddb' )
+        doc = db.Document({ '_id' : 'joe' }).post()
+        doc.Attachment( filepath=attachpath ).put()
+        db.bulkdocs([ { 'val' : i } for i in range(10) ])
+        dburl = url.rstrip( '/' ) + '/recorddb/'
+        urls = [ dburl + 'joe/' + os.path.basename( attachpath ),
+                 dburl + '_changes?feed=continuous&timeout=100' ]
+        rec = RecordingSession( filepath )
+        recorded = []
+        for u in urls :
+            s, h, d = rec.request( 'GET', u )
+            recorded.append( (s, h.headers, list( d.iterchunks() )) )
+        rec.close()
+        c.delete( 'recorddb' )
+        s, h, chunks = recorded[0]
+        assert s == 200 and len( chunks ) > 1
+        assert ''.join( chunks ) == '\xff\xfe' * 100000
+
+        replay = ReplaySession( filepath, realtime=True )
+        elapsed = replay.records[ ('GET', urls[0]) ][0]['elapsed']
+        st = time.time()
+        s, h, d = replay.request( 'GET', urls[0] )
+        assert time.time() - st >= elapsed
+        assert (s, h.headers, list( d.iterchunks() )) == recorded[0]
+        s, h, d = replay.request( 'GET', urls[1] )
+        assert (s, h.headers) == recorded[1][:2]
+        lines = list( iterlines( recorded[1][2] ))
+        assert d.readline() == lines[0] + '\n'
+        assert list( d ) == lines[1:] and len( lines ) > 10
+        assert replay.remaining() == 0
+    finally :
+        os.remove( filepath )
+        os.remove( attachpath )
+
+if __name__ == '__main__' :
+    url = 'http://localhost:5984/'
+    test_record( url )
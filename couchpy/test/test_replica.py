@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+import logging, time, os, tempfile
+
+from   couchpy              import CouchPyError
+from   couchpy.client       import Client
+from   couchpy.standin      import StandinServer
+
+log = logging.getLogger( __name__ )
+
+def waitfor( replica, fn, timeout=2 ):
+    deadline = time.time() + timeout
+    while not fn() and time.time() < deadline :
+        time.sleep( 0.01 )
+    return fn()
+
+def test_replica( url ):
+    c = Client( url=url )
+    [ db.delete() for db in c.databases ]
+    db = c.put( 'testdb' )
+    cities = [ 'Bangalore', 'Chennai', 'Mysore' ]
+    db.bulkdocs([ { '_id' : 'doc%02d' % i, 'n' : i,
+                    'address' : { 'city' : cities[i % 3] }}
+                  for i in range(30) ])
+
+    print "Testing initial sync ..."
+    replica = db.Replica( fields=['n', 'address.city'], maxstale=1.0,
+                          batch=7 ).start()
+    assert len( replica ) == 30 and 'doc05' in replica
+    assert replica.get( 'doc05' )['n'] == 5
+    assert replica.get( 'missing', 'x' ) == 'x'
+    assert replica.staleness() < 1.0
+
+    print "Testing all_docs ..."
+    ref = db.all_docs( q={ 'startkey' : '"doc10"', 'endkey' : '"doc14"',
+                           'include_docs' : 'true' })
+    d = replica.all_docs( startkey='doc10', endkey='doc14', include_docs=True )
+    assert d == ref and d['offset'] == 10 and len( d['rows'] ) == 5
+    d = replica.all_docs( startkey='doc14', endkey='doc10', descending=True,
+                          limit=2, skip=1 )
+    assert [ r['id'] for r in d['rows'] ] == [ 'doc13', 'doc12' ]
+    assert d['offset'] == 16
+    d = replica.all_docs( startkey='doc28', inclusive_end=False,
+                          endkey='doc29' )
+    assert [ r['id'] for r in d['rows'] ] == [ 'doc28' ]
+    d = replica.all_docs( keys=[ 'doc01', 'nodoc' ] )
+    assert d['rows'][0]['value']['rev'].startswith( '1-' )
+    assert d['rows'][1] == { 'key' : 'nodoc', 'error' : 'not_found' }
+
+    print "Testing lookup on indexed fields ..."
+    docs = replica.lookup( 'address.city', 'Mysore' )
+    assert [ x['n'] for x in docs ] == range( 2, 30, 3 )
+    docs = replica.lookup( 'n', startkey=10, endkey=12 )
+    assert [ x['_id'] for x in docs ] == [ 'doc10', 'doc11', 'doc12' ]
+    assert len( replica.lookup( 'n', startkey=25, limit=2 )) == 2
+    try :
+        replica.lookup( 'address' )
+        assert False
+    except CouchPyError :
+        pass
+
+    print "Testing writes reach the replica through changes ..."
+    doc = db.Document( 'doc05' ).fetch()
+    doc['address'] = { 'city' : 'Delhi' }
+    doc.put()
+    db.Document( 'doc06' ).fetch().delete()
+    db.Document({ '_id' : 'doc30', 'n' : 30 }).post()
+    assert waitfor( replica, lambda : 'doc30' in replica )
+    assert waitfor( replica, lambda : 'doc06' not in replica )
+    assert replica.get( 'doc05' )['_rev'] == doc._rev
+    assert [ x['_id'] for x in replica.lookup( 'address.city', 'Delhi' ) ] \
+                == [ 'doc05' ]
+    assert replica.lookup( 'n', 6 ) == []
+    assert len( replica ) == 30
+
+    print "Testing stale replica falls back to server ..."
+    replica.stop()
+    db.Document({ '_id' : 'doc31', 'n' : 31 }).post()
+    assert replica.get( 'doc31' ) is None
+    assert replica.get( 'doc31', maxstale=60 ) is None
+    replica.asof -= 2
+    assert not replica.fresh()
+    assert replica.get( 'doc31' )['n'] == 31
+    assert replica.get( 'doc06' ) is None
+    d = replica.all_docs( startkey='doc30', include_docs=True )
+    assert [ r['id'] for r in d['rows'] ] == [ 'doc30', 'doc31' ]
+    assert [ x['n'] for x in replica.lookup( 'n', startkey=30 ) ] == [30, 31]
+    assert replica.sync() == 1 and replica.fresh()
+    assert 'doc31' in replica
+    replica.close()
+
+    print "Testing on-disk replica resumes from its last sequence ..."
+    fd, path = tempfile.mkstemp( suffix='.db' )
+    os.close( fd )
+    try :
+        replica = db.Replica( path=path, fields=['n'] ).start( wait=True )
+        replica.close()
+        db.Document({ '_id' : 'doc32', 'n' : 32 }).post()
+        replica = db.Replica( path=path, fields=['n', 'address.city'] )
+        assert len( replica ) == 31
+        assert len( replica.lookup( 'address.city', 'Chennai' )) == 10
+        assert replica.sync() == 1 and len( replica ) == 32
+        replica.close()
+    finally :
+        os.remove( path )
+
+if __name__ == '__main__' :
+    server = StandinServer().start()
+    test_replica( server.url )
+    server.stop()
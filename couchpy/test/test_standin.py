@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+import logging, time, socket
+
+from   couchpy.client       import Client
+from   couchpy.httpc        import HttpSession, Deadline
+from   couchpy.httperror    import ServerError, DeadlineExceeded
+from   couchpy.standin      import StandinServer
+
+log = logging.getLogger( __name__ )
+
+pyddoc = {
+    '_id'      : '_design/py',
+    'language' : 'python',
+    'views'    : {
+        'byage' : {
+            'map'    : "def fun( doc ):\n    emit( doc['age'], 1 )",
+            'reduce' : '_count',
+        },
+        'names' : {
+            'map'    : "def fun( doc ):\n    yield [doc['age'], doc['name']], None",
+        },
+    },
+}
+
+def test_crud( server ) :
+    print "Testing database and document API ..."
+    c = Client( url=server.url )
+    db = c.put( 'standin' )
+    assert 'standin' in c and db()['doc_count'] == 0
+    doc = db.Document({ '_id' : 'joe', 'name' : 'joe', 'age' : 30 }).post()
+    assert doc._rev.startswith( '1-' )
+    doc.age = 31
+    doc.put()
+    assert doc._rev.startswith( '2-' )
+    assert db.Document( 'joe' ).fetch().age == 31
+    docs = [ { '_id' : 'user%s' % i, 'name' : 'user%s' % i, 'age' : 20+i%5 }
+             for i in range(20) ]
+    assert len( db.bulkdocs( docs )) == 20
+    assert db()['doc_count'] == 21
+    d = db.all_docs( startkey='"user10"', endkey='"user12"' )
+    assert [ r['id'] for r in d['rows'] ] == ['user10', 'user11', 'user12']
+    d = db.all_docs( keys=['joe', 'nobody'], include_docs='true' )
+    assert d['rows'][0]['doc']['age'] == 31
+    assert d['rows'][1]['error'] == 'not_found'
+
+    print "Testing changes feed ..."
+    d = db.changes( feed='normal', since=0 )
+    assert d['last_seq'] == 22 and len(d['results']) == 21
+    lines = []
+    db.changes( feed='continuous', since=20, timeout=100,
+                callback=lambda line : lines.append( line ))
+    assert len( filter( None, lines )) == 3
+
+    print "Testing conflicts ..."
+    conn = c.conn
+    conn.post( ['standin', '_bulk_docs'], {}, {
+        'new_edits' : False,
+        'docs' : [ { '_id' : 'joe', '_rev' : '2-aaaa', 'age' : 40 } ] })
+    doc = db.Document( 'joe' ).fetch( conflicts='true' )
+    assert len( doc['_conflicts'] ) == 1
+    c.delete( 'standin' )
+
+def test_views( server ) :
+    print "Testing python views ..."
+    c = Client( url=server.url )
+    db = c.put( 'standin' )
+    db.bulkdocs([ { 'name' : 'user%s' % i, 'age' : 20+i%5 } for i in range(20) ])
+    ddoc = db.DesignDocument( pyddoc ).post()
+    views = ddoc.views()
+    d = views['byage'].fetch()
+    assert d['rows'] == [ { 'key' : None, 'value' : 20 } ]
+    d = views['byage'].fetch( group='true' )
+    assert [ r['value'] for r in d['rows'] ] == [ 4, 4, 4, 4, 4 ]
+    d = views['byage'].fetch( reduce='false', startkey='21', endkey='22',
+                              limit=5 )
+    assert len( d['rows'] ) == 5 and d['total_rows'] == 20
+    d = views['names'].fetch( keys=[[22, 'user2']] )
+    assert d['rows'][0]['key'] == [22, 'user2']
+    server.addview( 'standin', 'py', 'custom', lambda doc : [(doc['name'], 1)],
+                    lambda keys, values, rereduce : sum(values) )
+    s, h, d = c.conn.get( ['standin', '_design', 'py', '_view', 'custom'],
+                          {}, None )
+    assert d['rows'][0]['value'] == 20
+    c.delete( 'standin' )
+
+def test_faults( server ) :
+    print "Testing latency and fault injection ..."
+    c = Client( url=server.url )
+    server.latency = 0.05
+    st = time.time() ; c.all_dbs()
+    assert time.time() - st >= 0.05
+    server.latency = 0
+
+    fault = server.inject( path='^/_all_dbs', status=503, count=1 )
+    try    : c.all_dbs()
+    except ServerError : pass
+    else   : assert False
+    assert fault['hits'] == 1 and server.faults == []
+    # Dropped connection is retried by HttpSession
+    fault = server.inject( method='GET', reset=True, count=1 )
+    assert isinstance( c.all_dbs(), list ) and fault['hits'] == 1
+
+    # A failed /_dbs_info batch is reported for its databases, it does not
+    # abort the call nor mark /_dbs_info as unsupported.
+    names = [ 'faults_%s' % i for i in range(4) ]
+    [ c.put( name ) for name in names ]
+    c.DBS_INFO_BATCH = 2
+    fault = server.inject( path='^/_dbs_info', status=500, count=1 )
+    report = c.dbsinfo( names=names )
+    assert len( report['ok'] ) == 2 and len( report['errors'] ) == 2
+    assert fault['hits'] == 1 and c._dbs_info_supported == True
+    [ c.delete( name ) for name in names ]
+
+def test_deadlines( server ) :
+    print "Testing timeouts and deadlines ..."
+    def slow( c, delay=0.5, **kwargs ) :
+        server.inject( path='^/_all_dbs', delay=delay, count=1, **kwargs )
+        st = time.time()
+        try    : c.all_dbs()
+        except DeadlineExceeded : pass
+        else   : assert False
+        assert time.time() - st < delay
+        server.clearfaults()
+
+    slow( Client( url=server.url, config={ 'client.deadline' : 0.2 } ))
+    c = Client( url=server.url )
+    dl = Deadline( 0.2 ).start()
+    try     : slow( c )
+    finally : dl.stop()
+    assert isinstance( c.all_dbs(), list )      # Deadline does not linger
+
+    # Read timeout, without deadline, is a plain socket timeout.
+    c = Client( url=server.url, config={ 'client.timeout' : 0.2 } )
+    server.inject( path='^/_all_dbs', delay=0.5, count=1 )
+    try    : c.all_dbs()
+    except socket.timeout : pass
+    else   : assert False
+    server.clearfaults()
+
+    # Database level deadline, carried by its documents.
+    c = Client( url=server.url )
+    c.put( 'standin' )
+    db = c.Database( 'standin', deadline=0.2 )
+    db.Document({ '_id' : 'joe' }).post()
+    server.inject( path='^/standin/joe', delay=0.5, count=1 )
+    try    : db.Document( 'joe' ).fetch()
+    except DeadlineExceeded : pass
+    else   : assert False
+    server.clearfaults()
+    # Shared instance, and its documents, are not bound to the deadline.
+    shared = c.Database( 'standin' )
+    assert shared is not db and shared.conn is c.conn
+    assert shared.Document( 'joe' ) is not db.Document( 'joe' )
+    server.latency = 0.3
+    try     : assert shared.Document( 'joe' ).fetch()['_id'] == 'joe'
+    finally : server.latency = 0
+    c.delete( 'standin' )
+
+    # Retry delays are not slept beyond the deadline.
+    c = Client( url=server.url, htsess=HttpSession( retry_delays=[2] ))
+    dl = Deadline( 0.3 ).start()
+    try     : slow( c, reset=True )
+    finally : dl.stop()
+
+if __name__ == '__main__' :
+    server = StandinServer().start()
+    test_crud( server )
+    test_views( server )
+    test_faults( server )
+    test_deadlines( server )
+    server.stop()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+import logging, time
+
+from   couchpy.client       import Client
+from   couchpy.stats        import Series, StatsSampler, flatten, percentile, \
+                                   taskprogress
+
+log = logging.getLogger( __name__ )
+
+def test_series() :
+    print "Testing ring buffer and helpers ..."
+    s = Series( 4 )
+    assert s.values() == [] and s.last() is None
+    [ s.append(i) for i in range(4) ]                   # Exactly full
+    assert s.values() == [ 0.0, 1.0, 2.0, 3.0 ] and s.values( 1 ) == [ 3.0 ]
+    s = Series( 4 )
+    [ s.append(i) for i in range(6) ]
+    assert s.values() == [ 2.0, 3.0, 4.0, 5.0 ]
+    assert s.values( 2 ) == [ 4.0, 5.0 ] and len(s) == 4
+
+    assert percentile( [1, 2, 3, 4, 5], 50 ) == 3
+    assert percentile( [1, 2, 3, 4, 5], 100 ) == 5
+    tree = { 'httpd' : { 'requests' : { 'current' : 10 } },
+             'couchdb' : { 'httpd' : { 'requests' : { 'value' : 4 } } } }
+    assert flatten( tree ) == { 'httpd.requests' : 10,
+                                'couchdb.httpd.requests' : 4 }
+    kinds, tree = {}, {
+        'couchdb' : {
+            'open_databases' : { 'current' : 3 },
+            'request_time' : { 'current' : 900, 'mean' : 4.5 },
+            'open_os_files' : { 'value' : 7, 'type' : 'gauge' },
+            'db_open_time' : { 'value' : { 'arithmetic_mean' : 2.5 },
+                               'type' : 'histogram' }}}
+    assert flatten( tree, kinds=kinds ) == {
+        'couchdb.open_databases' : 3, 'couchdb.request_time' : 4.5,
+        'couchdb.open_os_files' : 7, 'couchdb.db_open_time' : 2.5 }
+    assert kinds == { 'couchdb.open_databases' : 'gauge',
+                      'couchdb.request_time' : 'histogram',
+                      'couchdb.open_os_files' : 'gauge',
+                      'couchdb.db_open_time' : 'histogram' }
+    assert taskprogress({ 'status' : 'Copied 0 of 18369 changes (20%)' }) == 20
+    assert taskprogress({ 'status' : 'Processed 50 of 200 changes' }) == 25
+    assert taskprogress({ 'progress' : 42 }) == 42
+
+def test_sampler( url ) :
+    print "Testing StatsSampler ..."
+    c = Client( url=url )
+    sampler = StatsSampler( c, interval=0.5, capacity=10 ).start()
+    for i in range(20) :
+        c.all_dbs()
+        time.sleep(0.1)
+    sampler.stop()
+    assert 'httpd.requests' in sampler.names()
+    assert sampler.rate( 'httpd.requests' ) > 0
+    assert len( sampler.deltas( 'httpd.requests' )) <= 10
+    assert sampler.percentile( 'httpd.requests', 95 ) >= \
+           sampler.percentile( 'httpd.requests', 5 )
+
+    [ db.delete() for db in c.databases ]
+    c.put( 'statsdb' )
+    sampler = StatsSampler( c, tasks=False )
+    sampler.sample() ; c.all_dbs() ; sampler.sample()
+    assert 'couchdb.open_databases' in sampler.names()
+    assert sampler.gauges() == [ 'couchdb.open_databases',
+                                 'couchdb.request_time' ]
+    assert 'couchdb.open_databases' not in sampler.counters()
+    assert sampler.rate( 'couchdb.open_databases' ) is None
+    assert sampler.value( 'couchdb.open_databases' ) == 1
+    assert 'couchdb.open_databases' not in dict( sampler.top() )
+    assert 0 < sampler.value( 'couchdb.request_time' ) < 1000  # Mean in ms
+    c.delete( 'statsdb' )
+
+    sampler = StatsSampler( c, stats=['httpd.requests'], tasks=False )
+    sampler.sample() ; c.all_dbs() ; sampler.sample()
+    assert sampler.names() == [ 'httpd.requests' ]
+
+if __name__ == '__main__' :
+    url = 'http://localhost:5984/'
+    test_series()
+    test_sampler( url )
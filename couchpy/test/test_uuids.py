@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+import logging, time
+
+from   couchpy.client       import Client
+from   couchpy.uuids        import uuidgen, SequentialUUIDs, ServerUUIDs
+
+log = logging.getLogger( __name__ )
+
+def test_local() :
+    print "Testing local uuid generators ..."
+    for algorithm in [ 'random', 'sequential', 'utc_random' ] :
+        uuids = uuidgen( algorithm ).take( 1000 )
+        assert len( set(uuids) ) == 1000
+        assert all([ len(x) == 32 and int(x, 16) >= 0 for x in uuids ])
+
+    uuids = uuidgen( 'sequential' ).take( 1000 )
+    prefix = uuids[0][:26]
+    samepfx = [ x for x in uuids if x[:26] == prefix ]
+    assert samepfx == sorted( samepfx )
+
+    gen = SequentialUUIDs()
+    gen.seq = SequentialUUIDs.MAXSEQ
+    a, b = gen.take( 2 )
+    assert a[:26] != prefix and a[:26] == b[:26] and a < b
+
+    uuids = uuidgen( 'utc_random' ).take( 100 )
+    assert [ x[:14] for x in uuids ] == sorted([ x[:14] for x in uuids ])
+    now = int( time.time() * 1000000 )
+    assert abs( int(uuids[-1][:14], 16) - now ) < 10000000
+
+    uuids = uuidgen( 'utc_id', suffix='node1' ).take( 2 )
+    assert all([ x.endswith('node1') and len(x) == 19 for x in uuids ])
+
+def test_server( url ) :
+    print "Testing server uuid pool ..."
+    c = Client( url=url )
+    gen = ServerUUIDs( c, batch=100, lowmark=20 )
+    uuids = gen.take( 150 )
+    assert len( set(uuids) ) == 150
+    time.sleep(1)
+    assert len( gen.pool ) >= 20
+
+def test_autoid( url ) :
+    print "Testing client assigned document ids ..."
+    ca = Client( url=url, config={ 'couchdb.uuids.algorithm' : 'sequential' })
+    ca.login( 'pratap', 'pratap' )
+    ca.delete( 'testdb' ) if 'testdb' in ca else None
+    db = ca.put( 'testdb' )
+    doc = db.Document({ 'name' : 'joe' }).post()
+    assert len( doc._id ) == 32 and doc._rev.startswith( '1-' )
+    assert doc._id in db
+    docs = [ { 'name' : 'joe%s' % i } for i in range(10) ]
+    result = db.bulkdocs( docs )
+    assert [ d['_id'] for d in docs ] == [ r['id'] for r in result ]
+    assert [ d['_id'] for d in docs ] == sorted([ d['_id'] for d in docs ])
+
+    cs = Client( url=url, config={ 'uuids.source' : 'none' })
+    assert cs.uuidgen is None
+    ca.delete( 'testdb' )
+
+if __name__ == '__main__' :
+    url = 'http://localhost:5984/'
+    test_local()
+    test_server( url )
+    test_autoid( url )
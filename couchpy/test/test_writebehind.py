@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+import logging, time
+
+try:
+    from threading      import Thread
+except ImportError:
+    from dummy_threading import Thread
+
+from   couchpy              import CouchPyError
+from   couchpy.client       import Client
+from   couchpy.doc          import ST_ACTIVE_VALID
+from   couchpy.httperror    import *
+from   couchpy.standin      import StandinServer
+
+log = logging.getLogger( __name__ )
+
+def test_writebehind( url ):
+    c = Client( url=url )
+    [ db.delete() for db in c.databases ]
+    db = c.put( 'testdb' )
+
+    print "Testing flush on count ..."
+    wb = db.WriteBehind( count=10, delay=None )
+    docs = [ db.Document({ 'n' : i }) for i in range(25) ]
+    futures = [ wb.post( doc ) for doc in docs ]
+    assert wb.flushes == 2 and len(wb) == 5
+    assert all([ f.done() for f in futures[:20] ])
+    assert not any([ f.done() for f in futures[20:] ])
+    assert wb.flush() == 5 and wb.flushes == 3
+    assert len( db ) == 25
+    for doc, f in zip( docs, futures ) :
+        assert f.result() == doc._rev and doc._rev.startswith( '1-' )
+        assert doc._x_state == ST_ACTIVE_VALID
+
+    print "Testing buffered updates go through state machine ..."
+    for doc in docs[:5] :
+        doc['n'] += 100
+    futures = [ wb.put( doc ) for doc in docs[:5] ]
+    wb.flush()
+    assert all([ f.result().startswith( '2-' ) for f in futures ])
+    assert db.Document( docs[0]._id ).fetch()['n'] == 100
+    try :
+        wb.put( docs[6] )           # Not dirtied
+        assert False
+    except CouchPyError :
+        pass
+
+    print "Testing per document errors ..."
+    stale = { '_id' : docs[0]._id, '_rev' : futures[0].result()[:2] + 'x' }
+    f1, f2 = wb.post({ 'n' : 'new' }), wb.put( stale )
+    wb.flush()
+    assert f1.result().startswith( '1-' )
+    assert isinstance( f2.exception(), ResourceConflict )
+    try :
+        f2.result()
+        assert False
+    except ResourceConflict :
+        pass
+
+    print "Testing flush on size and delay ..."
+    wb = db.WriteBehind( count=1000, size=200, delay=None )
+    [ wb.post({ 'pad' : 'x' * 60 }) for i in range(3) ]
+    assert wb.flushes == 1 and len(wb) == 1     # ~115 bytes per document
+    wb = db.WriteBehind( count=1000, delay=0.05 )
+    called = []
+    f = wb.post({ 'n' : 'timer' })
+    f.add_done_callback( called.append )
+    assert f.result( timeout=2 ).startswith( '1-' ) and wb.flushes == 1
+    time.sleep( 0.01 )
+    assert called == [ f ]
+    wb.close()
+    try :
+        wb.post({ 'n' : 'closed' })
+        assert False
+    except CouchPyError :
+        pass
+
+    print "Testing concurrent producers ..."
+    n = len( db )
+    wb = db.WriteBehind( count=50, delay=0.05 )
+    def produce() :
+        [ wb.post({ 'n' : i }) for i in range(100) ]
+    threads = [ Thread( target=produce ) for i in range(4) ]
+    [ t.start() for t in threads ]
+    [ t.join() for t in threads ]
+    wb.close()
+    assert len( db ) == n + 400
+    assert wb.flushes <= 12
+
+    print "Testing failed flush resolves every future ..."
+    with db.WriteBehind( delay=None ) as wb :
+        futures = [ wb.post({ 'n' : i }) for i in range(3) ]
+        db.delete()
+    assert all([ isinstance( f.exception(), HTTPError ) for f in futures ])
+
+if __name__ == '__main__' :
+    server = StandinServer().start()
+    test_writebehind( server.url )
+    server.stop()
@@ -10,8 +10,21 @@ implementation in the listed order of priority.
 
 * python-cjson C implementation of JSON encoder and decoder
 * json JSON encoder and decoder from python standard-library
+
+Also provides helpers that are shared across couchpy modules, like
+:func:`parallel` to fan out requests with bounded concurrency,
+:func:`collatekey` to sort JSON values in CouchDB's collation order and
+``builtin_reduces``, CouchDB's builtin reduce functions.
 """
 
+import unicodedata
+from   Queue        import Queue, Full
+
+try:
+    from threading       import Thread, Lock, Event
+except ImportError:
+    from dummy_threading import Thread, Lock, Event
+
 try :
     import cjson
     class JSON( object ):
@@ -118,3 +131,218 @@ def etx2html( etxconfig={}, etxloc=None, etxtext=None, **kwargs ) :
     etxconfig.update( kwargs )
     t = ETXTranslate( etxloc=etxloc, etxtext=etxtext, etxconfig=etxconfig )
     return t( context={} )
+
+
+def parallel( fn, items, concurrency=8 ):
+    """Apply ``fn`` on every element in ``items`` using a bounded pool of
+    ``concurrency`` threads. This is a generator, yielding a tuple of
+    ``(item, result, error)`` for every element in the order they complete.
+    Exceptions raised by ``fn`` are captured as ``error`` and does not abort
+    the run. ``items`` is consumed lazily and at most ``2 * concurrency``
+    results are kept in memory until they are consumed.
+
+    If the generator is closed before exhausting it, remaining items are
+    abandoned and worker threads exit after finishing their current call.
+    """
+    items = iter( items )
+    concurrency = max( 1, int(concurrency or 1) )
+    results = Queue( concurrency * 2 )
+    lock, stop, done = Lock(), Event(), object()
+
+    def put( r ):
+        while not stop.isSet() :
+            try :
+                results.put( r, True, 0.1 )
+                return
+            except Full :
+                pass
+
+    def worker():
+        while not stop.isSet() :
+            lock.acquire()
+            try :
+                try :
+                    item = items.next()
+                except StopIteration :
+                    break
+            finally :
+                lock.release()
+            try :
+                r = ( item, fn(item), None )
+            except Exception, e :
+                r = ( item, None, e )
+            put( r )
+        put( done )
+
+    threads = [ Thread( target=worker ) for i in range(concurrency) ]
+    [ t.setDaemon(True) for t in threads ]
+    [ t.start() for t in threads ]
+    try :
+        live = len(threads)
+        while live :
+            r = results.get()
+            if r is done :
+                live -= 1
+            else :
+                yield r
+    finally :
+        stop.set()
+
+# Punctuation and symbols in the order of Unicode collation, as used by ICU
+# and CouchDB. They sort before digits, which sort before letters.
+_PUNCTUATION = u'_-,;:!?.\'"()[]{}@*/\\&#%`^+<=>|~$'
+_primaries, _cases = {}, {}    # Weights of characters not changed by NFD
+
+# Sort keys of frequently collated strings are remembered, the cache is
+# reset when full.
+STRINGKEYS_SIZE = 10000
+_stringkeys = {}
+
+def _charweight( c ):
+    """Return (primary, tertiary) collation weights of character ``c``."""
+    cat = unicodedata.category( c )
+    if c in _PUNCTUATION :
+        primary = (1 << 21) + _PUNCTUATION.index( c )
+    elif cat[0] in 'CZ' :           # Spaces and control characters
+        primary = ord( c )
+    elif cat == 'Nd' :
+        primary = (2 << 21) + unicodedata.decimal( c )
+    elif cat[0] == 'L' :
+        primary = (3 << 21) + ord( c.lower()[0] )
+    else :                          # Other punctuation and symbols
+        primary = (1 << 21) + len( _PUNCTUATION ) + ord( c )
+    case = int( c.isupper() )
+    if not unicodedata.combining( c ) and \
+            unicodedata.normalize( 'NFD', c ) == c :
+        _primaries[c], _cases[c] = primary, case
+    return primary, case
+
+def _stringkey( s ):
+    """Sort key for string ``s``, approximating ICU's default collation.
+    Strings are compared by letters ignoring case and accents, then by
+    accents, then by case, lowercase first."""
+    key = _stringkeys.get( s, None )
+    if key is None :
+        if len( _stringkeys ) >= STRINGKEYS_SIZE :
+            _stringkeys.clear()
+        key = _stringkeys[s] = _collatestring( s )
+    return key
+
+def _collatestring( s ):
+    if isinstance( s, str ) :
+        s = s.decode( 'utf-8', 'replace' )
+    try :
+        return ( tuple( map( _primaries.__getitem__, s )), (),
+                 tuple( map( _cases.__getitem__, s )) )
+    except KeyError :
+        pass
+    primaries, accents, cases = [], [], []
+    for c in unicodedata.normalize( 'NFD', s ) :
+        if primaries and unicodedata.combining( c ) :
+            accents[-1] += c
+            continue
+        primary, case = _charweight( c )
+        primaries.append( primary )
+        accents.append( u'' )
+        cases.append( case )
+    accents = tuple( accents ) if any( accents ) else ()
+    return ( tuple( primaries ), accents, tuple( cases ))
+
+def collatekey( value ):
+    """Return a sort key for JSON converted ``value`` that follows CouchDB's
+    view collation, ``null < false < true < numbers < strings < arrays <
+    objects``. Arrays are compared element by element. Objects are compared
+    by their (key, value) pairs, in iteration order, like CouchDB does in
+    the order of the JSON text. Python 2 dictionaries do not remember that
+    order, objects with more than one key sort like CouchDB only when passed
+    as ordered mappings.
+
+    Strings are compared like ICU, used by CouchDB, in Unicode collation
+    order, ``"a" < "A" < "aa" < "b"``, punctuation before digits before
+    letters, case and accents compared only between otherwise equal strings.
+    This follows the default collation for Latin text, it is not a complete
+    implementation of ICU, strings in other scripts are ordered by their
+    code points.
+    """
+    if value is None :
+        return (0,)
+    elif value is False :
+        return (1,)
+    elif value is True :
+        return (2,)
+    elif isinstance( value, (int, long, float) ) :
+        return (3, value)
+    elif isinstance( value, basestring ) :
+        return (4, _stringkey( value ))
+    elif isinstance( value, (list, tuple) ) :
+        return (5, [ collatekey(v) for v in value ])
+    elif isinstance( value, dict ) :
+        return (6, [ (collatekey(k), collatekey(v))
+                     for k, v in value.items() ])
+    else :
+        return (7, value)
+
+
+class ReduceError( ValueError ):
+    """Raised by builtin reduce functions for values they cannot reduce."""
+
+_numbers = (int, long, float)
+
+def _sumvalue( a, b ):
+    if isinstance( a, bool ) or isinstance( b, bool ) :
+        pass
+    elif isinstance( a, _numbers ) and isinstance( b, _numbers ) :
+        return a + b
+    elif isinstance( a, dict ) and isinstance( b, dict ) :
+        total = dict( a )
+        for k, v in b.items() :
+            total[k] = _sumvalue( total[k], v ) if k in total else v
+        return total
+    else :
+        a = [ a ] if isinstance( a, _numbers ) else a
+        b = [ b ] if isinstance( b, _numbers ) else b
+        if isinstance( a, list ) and isinstance( b, list ) :
+            a, b = a + [0] * (len(b) - len(a)), b + [0] * (len(a) - len(b))
+            return [ _sumvalue( x, y ) for x, y in zip( a, b ) ]
+    raise ReduceError(
+            '_sum function requires that map values be numbers, arrays of '
+            'numbers, or objects, not %s' % JSON().encode( b ))
+
+def reducesum( values ):
+    """Same as CouchDB's builtin ``_sum`` reduce, for both reduce and
+    rereduce."""
+    if not values :
+        return 0
+    total = values[0]
+    if not isinstance( total, dict ) :
+        total = _sumvalue( 0, total )       # Validate the first value
+    for value in values[1:] :
+        total = _sumvalue( total, value )
+    return total
+
+def reducestats( values ):
+    """Same as CouchDB's builtin ``_stats`` reduce, for both reduce and
+    rereduce."""
+    values = [ v for v in values ]
+    if values and isinstance( values[0], dict ) :   # rereduce
+        return { 'sum'    : sum([ v['sum'] for v in values ]),
+                 'count'  : sum([ v['count'] for v in values ]),
+                 'min'    : min([ v['min'] for v in values ]),
+                 'max'    : max([ v['max'] for v in values ]),
+                 'sumsqr' : sum([ v['sumsqr'] for v in values ]) }
+    for v in values :
+        if isinstance( v, bool ) or not isinstance( v, _numbers ) :
+            raise ReduceError(
+                '_stats function requires that map values be numbers, not '
+                '%s' % JSON().encode( v ))
+    return { 'sum' : sum(values), 'count' : len(values),
+             'min' : min(values or [0]), 'max' : max(values or [0]),
+             'sumsqr' : sum([ v*v for v in values ]) }
+
+# Builtin reduce functions, called as ``fn( keys, values, rereduce )``.
+builtin_reduces = {
+    '_sum'   : lambda keys, values, rereduce : reducesum( values ),
+    '_count' : lambda keys, values, rereduce : \
+                    sum( values ) if rereduce else len( values ),
+    '_stats' : lambda keys, values, rereduce : reducestats( values ),
+}
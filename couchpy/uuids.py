@@ -0,0 +1,205 @@
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+"""Universally unique identifiers for documents, generated without a server
+round trip. Local generators follow the same semantics as CouchDB's
+``uuids/algorithm`` server setting,
+
+* ``random``, 32 hex digits of random data.
+* ``sequential``, 26 hex digits of random prefix followed by 6 hex digits of
+  a counter, incremented by a random amount for every id. The prefix is
+  renewed when the counter overflows. Ids are monotonically increasing
+  within a prefix, which keeps B-tree inserts local.
+* ``utc_random``, 14 hex digits of microseconds since epoch followed by 18
+  hex digits of random data. Ids are roughly ordered by creation time.
+* ``utc_id``, 14 hex digits of microseconds since epoch followed by a fixed
+  ``suffix``.
+
+:class:`ServerUUIDs` generator maintains a pool of server generated uuids,
+fetched from ``GET /_uuids`` in large batches and refilled in the background
+when the pool drops below a low-water mark.
+
+>>> gen = uuidgen( 'sequential' )
+>>> gen.next()
+'5a07c9f6b3bdc5a7cb3ea32c97000c2e'
+>>> gen.take( 2 )
+['5a07c9f6b3bdc5a7cb3ea32c97000d8c', '5a07c9f6b3bdc5a7cb3ea32c97001571']
+
+A :class:`couchpy.client.Client` instance creates its generator based on
+``uuids.source`` and ``couchdb.uuids.algorithm`` configuration parameters and
+remembers them as ``uuidgen`` attribute, which is used by
+:func:`couchpy.doc.Document.post` and :func:`couchpy.database.Database.bulkdocs`
+to assign ids to new documents.
+"""
+
+import os, time, logging
+from   binascii     import hexlify
+from   random       import randint
+from   collections  import deque
+
+try:
+    from threading       import Lock, Thread
+except ImportError:
+    from dummy_threading import Lock, Thread
+
+from   couchpy      import CouchPyError
+
+log = logging.getLogger( __name__ )
+
+def _randhex( nbytes ):
+    return hexlify( os.urandom( nbytes ))
+
+def _utcmicros():
+    return int( time.time() * 1000000 )
+
+
+class UUIDs( object ):
+    """Base class for uuid generators. Generators are thread-safe iterators
+    yielding uuid strings. Derived classes must implement :func:`UUIDs.take`.
+    """
+    def __init__( self ):
+        self.lock = Lock()
+
+    def __iter__( self ):
+        return self
+
+    def next( self ):
+        """Return a single uuid."""
+        return self.take( 1 )[0]
+
+    def take( self, count ):
+        """Return a list of ``count`` uuids."""
+        raise NotImplementedError()
+
+
+class RandomUUIDs( UUIDs ):
+    """Same as ``random`` algorithm in CouchDB server."""
+    algorithm = 'random'
+
+    def take( self, count ):
+        return [ _randhex(16) for i in xrange(count) ]
+
+
+class SequentialUUIDs( UUIDs ):
+    """Same as ``sequential`` algorithm in CouchDB server."""
+    algorithm = 'sequential'
+    MAXSEQ = 0xfff000
+
+    def __init__( self ):
+        UUIDs.__init__( self )
+        self.prefix, self.seq = _randhex(13), randint(1, 0xffe)
+
+    def take( self, count ):
+        uuids = []
+        self.lock.acquire()
+        try :
+            for i in xrange( count ) :
+                if self.seq >= self.MAXSEQ :
+                    self.prefix, self.seq = _randhex(13), randint(1, 0xffe)
+                else :
+                    self.seq += randint( 1, 0xffe )
+                uuids.append( '%s%06x' % (self.prefix, self.seq) )
+        finally :
+            self.lock.release()
+        return uuids
+
+
+class UTCRandomUUIDs( UUIDs ):
+    """Same as ``utc_random`` algorithm in CouchDB server."""
+    algorithm = 'utc_random'
+
+    def take( self, count ):
+        return [ '%014x%s' % (_utcmicros(), _randhex(9))
+                 for i in xrange(count) ]
+
+
+class UTCIdUUIDs( UUIDs ):
+    """Same as ``utc_id`` algorithm in CouchDB server, ``suffix`` is
+    appended to the timestamp."""
+    algorithm = 'utc_id'
+
+    def __init__( self, suffix='' ):
+        UUIDs.__init__( self )
+        self.suffix = suffix
+
+    def take( self, count ):
+        return [ '%014x%s' % (_utcmicros(), self.suffix)
+                 for i in xrange(count) ]
+
+
+class ServerUUIDs( UUIDs ):
+    """Pool of uuids generated by the server, using ``client``.
+
+    ``batch``,
+        Number of uuids to fetch with a single ``GET /_uuids`` request.
+    ``lowmark``,
+        When the pool has less than ``lowmark`` uuids, a background refill is
+        started, so that callers rarely wait for the server.
+    """
+    algorithm = 'server'
+
+    def __init__( self, client, batch=1000, lowmark=200 ):
+        UUIDs.__init__( self )
+        self.client, self.batch, self.lowmark = client, batch, lowmark
+        self.pool = deque()
+        self.refilling = False
+
+    def take( self, count ):
+        uuids = []
+        while len(uuids) < count :
+            self.lock.acquire()
+            try :
+                while self.pool and len(uuids) < count :
+                    uuids.append( self.pool.popleft() )
+                refill = (len(self.pool) < self.lowmark) and not self.refilling
+                self.refilling = self.refilling or refill
+            finally :
+                self.lock.release()
+            if len(uuids) < count :         # Pool is dry, wait for the server
+                self._refill( max(self.batch, count - len(uuids)), refill )
+            elif refill :
+                t = Thread( target=self._refill, args=(self.batch, True) )
+                t.setDaemon( True )
+                t.start()
+        return uuids
+
+    def _refill( self, count, owner=False ):
+        try :
+            uuids = self.client.uuids( count )
+            if not uuids :
+                raise CouchPyError( 'Unable to fetch uuids from server' )
+            self.lock.acquire()
+            try :
+                self.pool.extend( uuids )
+            finally :
+                self.lock.release()
+        finally :
+            if owner :
+                self.refilling = False
+
+
+algorithms = {
+    'random'     : RandomUUIDs,
+    'sequential' : SequentialUUIDs,
+    'utc_random' : UTCRandomUUIDs,
+    'utc_id'     : UTCIdUUIDs,
+}
+
+def uuidgen( algorithm='utc_random', source='local', client=None, **kwargs ):
+    """Return a uuid generator, if ``source`` is ``local`` the generator
+    implements ``algorithm``, if ``source`` is ``server`` uuids are pooled
+    from ``client`` and ``algorithm`` is decided by the server's
+    configuration. For any other ``source`` value None is returned, in which
+    case the server will assign ids for new documents.
+    """
+    if source == 'local' :
+        cls = algorithms.get( algorithm, None )
+        if cls is None :
+            raise CouchPyError( 'Unknown uuid algorithm %r' % algorithm )
+        return cls( **kwargs )
+    elif source == 'server' :
+        return ServerUUIDs( client, **kwargs )
+    return None
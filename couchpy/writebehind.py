@@ -0,0 +1,300 @@
+# This file is subject to the terms and conditions defined in
+# file 'LICENSE', which is part of this source code package.
+#       Copyright (c) 2011 SKR Farms (P) LTD.
+
+# -*- coding: utf-8 -*-
+
+"""Write-behind buffer for documents. Instead of one HTTP request per
+document, :class:`WriteBehind` queues document writes and flushes them with a
+single ``POST /<db>/_bulk_docs`` when ``count`` documents or ``size`` bytes
+are queued, when the oldest write has waited ``delay`` seconds, or when
+:func:`WriteBehind.flush` is called.
+
+Every write returns a :class:`Future`, resolved with the new revision of the
+document, or with the error reported by the server for that document.
+:class:`couchpy.doc.Document` objects are moved through their state machine
+as if they were written by :func:`couchpy.doc.Document.post` or
+:func:`couchpy.doc.Document.put`, so that they can be updated again after
+the flush.
+
+>>> wb = db.WriteBehind( count=200, delay=0.5 )
+>>> f = wb.post( db.Document({ 'type' : 'click', 'x' : 10 }) )
+>>> wb.post({ 'type' : 'click', 'x' : 12 })
+>>> f.result( timeout=5 )
+u'1-d1b4f5c7d0b3b8a6c0e5f5b6d3a1e2f4'
+>>> wb.close()      # Flush pending writes and stop the timer thread
+
+Unlike ``batch='ok'`` writes, where the server acknowledges a write before
+committing it, every buffered write is confirmed by the server.
+"""
+
+import time, logging
+
+try:
+    from threading       import Thread, Lock, Event, Condition
+except ImportError:
+    from dummy_threading import Thread, Lock, Event, Condition
+
+from   couchpy          import CouchPyError, hdr_acceptjs, hdr_ctypejs
+from   couchpy.httperror import *
+from   couchpy.httpc    import CREATED
+from   couchpy.doc      import Document, ST_EVENT_POST, ST_EVENT_PUT
+from   couchpy.utils    import JSON
+
+log = logging.getLogger( __name__ )
+json = JSON()
+
+# Per document errors reported by _bulk_docs.
+errclass = {
+    'conflict'     : ResourceConflict,
+    'forbidden'    : Forbidden,
+    'unauthorized' : Unauthorized,
+    'not_found'    : ResourceNotFound,
+}
+
+def _bulk_docs( conn, encoded, paths=[], hthdrs={} ) :
+    """POST /<db>/_bulk_docs, with a list of JSON ``encoded`` documents."""
+    body = '{"docs":[%s]}' % ','.join( encoded )
+    hthdrs = conn.mixinhdrs( hthdrs, hdr_acceptjs, hdr_ctypejs )
+    s, h, d = conn.post( paths, hthdrs, body )
+    if s == CREATED :
+        return s, h, d
+    else :
+        log.error( 'POST request to /%s failed' % '/'.join(paths) )
+        return (None, None, None)
+
+
+class Future( object ):
+    """Result of a buffered write, available once it is flushed."""
+
+    def __init__( self, doc ):
+        self.doc = doc
+        self.rev = self.error = None
+        self.event = Event()
+        self.callbacks = []
+        self.lock = Lock()
+
+    def done( self ):
+        """Whether the write is flushed, successfully or not."""
+        return self.event.isSet()
+
+    def result( self, timeout=None ):
+        """Wait for the write to be flushed and return the new revision of
+        the document. Raise the error if the write failed, or CouchPyError if
+        it is not flushed within ``timeout`` seconds."""
+        self.event.wait( timeout )
+        if not self.event.isSet() :
+            raise CouchPyError( 'Buffered write not flushed in time' )
+        if self.error is not None :
+            raise self.error
+        return self.rev
+
+    def exception( self, timeout=None ):
+        """Wait for the write to be flushed and return its error, if any."""
+        self.event.wait( timeout )
+        if not self.event.isSet() :
+            raise CouchPyError( 'Buffered write not flushed in time' )
+        return self.error
+
+    def add_done_callback( self, fn ):
+        """Call ``fn( future )`` once the write is flushed, immediately if it
+        already is. Callbacks are called from the flushing thread."""
+        self.lock.acquire()
+        try :
+            if not self.event.isSet() :
+                self.callbacks.append( fn )
+                return
+        finally :
+            self.lock.release()
+        fn( self )
+
+    def resolve( self, rev=None, error=None ):
+        self.lock.acquire()
+        try :
+            self.rev, self.error = rev, error
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        finally :
+            self.lock.release()
+        for fn in callbacks :
+            try :
+                fn( self )
+            except Exception :
+                log.exception( 'Write-behind callback failed' )
+
+
+class WriteBehind( object ):
+    """Buffer document writes to database ``db`` and flush them in bulk.
+
+    ``count``,
+        Flush when this many writes are queued.
+    ``size``,
+        Flush when JSON encoded documents in the queue add up to this many
+        bytes.
+    ``delay``,
+        Flush when the oldest queued write has waited this many seconds. A
+        background thread is started for the timer. If None, writes wait
+        until ``count`` or ``size`` is reached, or an explicit flush().
+    ``hthdrs``,
+        HTTP headers for the bulk requests.
+
+    Writes that fill the buffer flush it in the calling thread, so producers
+    faster than the server are slowed down to its pace.
+    """
+
+    def __init__( self, db, count=500, size=1048576, delay=1.0, hthdrs={} ):
+        self.db, self.conn = db, db.conn
+        self.count, self.size, self.delay = count, size, delay
+        self.paths = db.paths + [ '_bulk_docs' ]
+        self.hthdrs = self.conn.mixinhdrs( db.hthdrs, hthdrs )
+        self.lock = Lock()
+        self.timer = Condition( self.lock )
+        self.flushlock = Lock()     # Batches are written one at a time
+        self.pending, self.nbytes, self.since = [], 0, None
+        self.closed = False
+        self.thread = None
+        self.flushes = 0
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_value, tb ):
+        self.close()
+
+    def __len__( self ):
+        return len( self.pending )
+
+    def post( self, doc ):
+        """Queue creation of ``doc``, a new :class:`couchpy.doc.Document` or
+        a dictionary. Document ``_id`` is generated by the client's
+        ``uuidgen``, if missing. Return a :class:`Future`."""
+        if isinstance( doc, Document ) :
+            if doc._x_smach.canCreate( doc ) == False :
+                raise CouchPyError( 'post() not allowed !!' )
+            doc._autoid()
+            return self._enqueue( dict( doc.items() ), doc, ST_EVENT_POST )
+        uuidgen = self.db.client.uuidgen
+        if uuidgen and ('_id' not in doc) :
+            doc['_id'] = uuidgen.next()
+        return self._enqueue( doc, None, None )
+
+    def put( self, doc ):
+        """Queue update of ``doc``, a dirtied :class:`couchpy.doc.Document`,
+        or a dictionary with ``_id`` and ``_rev``. Return a
+        :class:`Future`."""
+        if isinstance( doc, Document ) :
+            if doc._x_smach.canUpdate( doc ) == False :
+                raise CouchPyError(
+                        'put() is allowed only on dirtied document !!' )
+            return self._enqueue( dict( doc.items() ), doc, ST_EVENT_PUT )
+        if '_id' not in doc or '_rev' not in doc :
+            raise CouchPyError( '`_id` and `_rev` to be supplied while '
+                                'updating the doc' )
+        return self._enqueue( doc, None, None )
+
+    def _enqueue( self, body, doc, event ):
+        encoded = json.encode( body )     # Snapshot, doc may change later
+        future = Future( doc )
+        self.lock.acquire()
+        try :
+            if self.closed :
+                raise CouchPyError( 'Write-behind buffer is closed' )
+            self.pending.append( (encoded, doc, event, future) )
+            self.nbytes += len( encoded )
+            full = len(self.pending) >= self.count or self.nbytes >= self.size
+            if self.since is None :
+                self.since = time.time()
+                if not full and self.delay is not None :
+                    self._starttimer()
+                    self.timer.notify()
+        finally :
+            self.lock.release()
+        full and self.flush()
+        return future
+
+    def flush( self ):
+        """Write all queued documents to the server, in a single request.
+        Return the number of documents written."""
+        self.flushlock.acquire()
+        try :
+            self.lock.acquire()
+            try :
+                batch, self.pending = self.pending, []
+                self.nbytes, self.since = 0, None
+            finally :
+                self.lock.release()
+            batch and self._write( batch )
+            return len( batch )
+        finally :
+            self.flushlock.release()
+
+    def close( self ):
+        """Flush queued writes and stop the timer thread. Further writes
+        raise CouchPyError."""
+        self.lock.acquire()
+        try :
+            self.closed = True
+            self.timer.notify()
+        finally :
+            self.lock.release()
+        self.thread and self.thread.join()
+        self.flush()
+
+    def _write( self, batch ):
+        self.flushes += 1
+        try :
+            s, h, d = _bulk_docs( self.conn, [ b[0] for b in batch ],
+                                  self.paths, hthdrs=self.hthdrs )
+            if d is None :
+                raise CouchPyError( 'POST /_bulk_docs failed' )
+        except Exception, e :
+            log.error( 'Write-behind flush of %s documents failed, %s' % (
+                       len(batch), e ))
+            [ future.resolve( error=e ) for _, _, _, future in batch ]
+            return
+
+        for (encoded, doc, event, future), r in zip( batch, d ) :
+            if 'error' in r :
+                cls = errclass.get( r['error'], HTTPError )
+                future.resolve( error=cls( (r['error'], r.get('reason', '')) ))
+                continue
+            try :
+                doc is not None and self._handle( doc, event, r )
+            except Exception, e :
+                future.resolve( error=e )
+                continue
+            future.resolve( rev=r['rev'] )
+
+    def _handle( self, doc, event, r ):
+        doc._x_smach.handle_event( event, doc, r )
+        # Like Document.post(), document's path gets its `_id` segment.
+        _id = doc.get( '_id', None )
+        if _id and doc._x_paths and doc._x_paths[-1] != _id :
+            doc._x_paths.append( _id )
+
+    def _starttimer( self ):
+        if self.thread is None :
+            self.thread = Thread( target=self._run )
+            self.thread.setDaemon( True )
+            self.thread.start()
+
+    def _run( self ):
+        self.lock.acquire()
+        try :
+            while not self.closed :
+                if self.since is None :
+                    self.timer.wait()
+                    continue
+                wait = self.since + self.delay - time.time()
+                if wait > 0 :
+                    self.timer.wait( wait )
+                    continue
+                self.lock.release()
+                try :
+                    self.flush()
+                except Exception, e :
+                    log.error( 'Write-behind flush failed, %s' % e )
+                finally :
+                    self.lock.acquire()
+        finally :
+            self.lock.release()
@@ -58,6 +58,9 @@ setup(
     exclude_package_data={},                # setuptools
     zip_safe=True,                          # setuptools
     entry_points={                          # setuptools
+        'console_scripts' : [
+            'couchpy-queryserver = couchpy.queryserver:main',
+        ],
     },
     install_requires=[                      # setuptools
         'pygments',